@@ -47,9 +47,11 @@ INSTALLED_APPS = [
     'rest_framework',
 
     'students.apps.StudentsConfig',
+    'jobs.apps.JobsConfig',
 ]
 
 MIDDLEWARE = [
+    'courses.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'django.middleware.cache.UpdateCacheMiddleware',
@@ -126,6 +128,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# Загруженные файлы хранятся один раз под именем-хешем содержимого
+DEFAULT_FILE_STORAGE = 'courses.storage.ContentAddressableStorage'
+# Передача файлов курсов фронт-серверу после проверки прав:
+# префикс внутреннего location для X-Accel-Redirect (nginx)
+# или имя заголовка вида X-Sendfile (Apache, lighttpd).
+# Если не заданы, файлы отдает сам Django.
+MEDIA_ACCEL_REDIRECT_URL = None
+MEDIA_SENDFILE_HEADER = None
+
+# Временные файлы загрузок частями и максимальный размер загрузки.
+# Каталог должен быть на том же разделе, что и MEDIA_ROOT, чтобы готовый
+# файл перемещался в хранилище без копирования.
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads/')
+CHUNKED_UPLOAD_MAX_SIZE = 5 * 1024 ** 3
+# загрузки без новых частей дольше этого времени удаляет purge_uploads
+CHUNKED_UPLOAD_EXPIRE = 60 * 60 * 24
 
 LOGIN_REDIRECT_URL = reverse_lazy('students:student_course_list')
 
@@ -148,7 +166,35 @@ REST_FRAMEWORK = {
         # анонимные пользователи смогут только просматривать, но не изменять
         # данные, а авторизованные будут иметь доступ ко всем четырем действиям.
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly',
-    ]
+    ],
+    # размер страницы для постраничного вывода списков
+    'PAGE_SIZE': 20,
 }
+# PAGE_SIZE задан глобально, а класс постраничного вывода - в обработчиках
+SILENCED_SYSTEM_CHECKS = ['rest_framework.W001']
+
+# Определение сервиса и адреса встраивания видео при сохранении.
+# courses.video.OfflineResolver не обращается к сервисам видео.
+VIDEO_RESOLVER = 'courses.video.EmbedVideoResolver'
+
+# Фоновые задачи выполняет manage.py run_workers. JOBS_EAGER выполняет
+# их в процессе, поставившем задачу, после фиксации транзакции.
+JOBS_EAGER = False
+# задержка первого повтора после ошибки, секунды; далее удваивается
+JOBS_RETRY_DELAY = 10
+# обработчик отмечается в выполняемой задаче раз в столько секунд;
+# задача без отметок дольше JOBS_STALE_TIMEOUT возвращается в очередь
+JOBS_HEARTBEAT_INTERVAL = 30
+JOBS_STALE_TIMEOUT = 600
+# выполненные задачи удаляются через неделю
+JOBS_RETENTION = 60 * 60 * 24 * 7
+
+# Снимок каталога курсов (courses.catalog), копия кеша на диске
+CATALOG_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'catalog.json')
+
+# Статистика ServerTimingMiddleware: число последних запросов на имя URL
+# и период сохранения окна процесса в кеш, секунды
+TIMING_WINDOW = 500
+TIMING_FLUSH_INTERVAL = 60
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
@@ -21,3 +21,6 @@ DATABASES = {
 SECURE_SSL_REDIRECT = True
 # при работе с куками и CSRF-токенами будет учитываться SSL
 CSRF_COOKIE_SECURE = True
+
+# файлы курсов отдает nginx из внутреннего location /protected/
+MEDIA_ACCEL_REDIRECT_URL = '/protected/'
@@ -0,0 +1,94 @@
+import json
+from bisect import bisect_left, bisect_right
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class CoursePagination(CursorPagination):
+    """
+    Постраничный вывод курсов по ключу (-created, id). В отличие от
+    OFFSET, стоимость запроса не растет с номером страницы.
+    Размер страницы задается настройкой PAGE_SIZE или параметром page_size.
+    """
+    ordering = ('-created', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SubjectPagination(CursorPagination):
+    """ Постраничный вывод предметов по ключу (title, id) """
+    ordering = ('title', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SnapshotCursorMixin(object):
+    """
+    Курсорный вывод упорядоченного списка записей снимка каталога.
+    keys - ключи порядка записей; в курсоре передается ключ последней
+    (или первой) записи страницы, поэтому изменения снимка между
+    запросами не сдвигают страницы. position_types - типы элементов
+    ключа.
+    """
+    position_types = ()
+
+    def decode_position(self, cursor):
+        """ Ключ из курсора; поддельный курсор - 404, а не ошибка """
+        try:
+            position = json.loads(cursor.position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or \
+                len(position) != len(self.position_types) or \
+                not all(type(value) is type_ for value, type_
+                        in zip(position, self.position_types)):
+            raise NotFound(self.invalid_cursor_message)
+        return tuple(position)
+
+    def paginate_records(self, records, keys, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        position = None
+        if cursor is not None:
+            position = self.decode_position(cursor)
+        if cursor is None or not cursor.reverse:
+            start = bisect_right(keys, position) if position else 0
+            end = start + page_size
+        else:
+            end = bisect_left(keys, position)
+            start = max(end - page_size, 0)
+        self.position = position
+        self.page_keys = keys[start:end]
+        self.has_previous = start > 0
+        self.has_next = end < len(keys)
+        return records[start:end]
+
+    def _link(self, key, reverse):
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse,
+                                         position=json.dumps(key)))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # пустая страница за пределами списка: ссылки от ключа курсора
+        return self._link(self.page_keys[-1] if self.page_keys
+                          else self.position, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self._link(self.page_keys[0] if self.page_keys
+                          else self.position, True)
+
+
+class CatalogCoursePagination(SnapshotCursorMixin, CoursePagination):
+    # -created в микросекундах, id
+    position_types = (int, int)
+
+
+class CatalogSubjectPagination(SnapshotCursorMixin, SubjectPagination):
+    # title, id
+    position_types = (str, int)
@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission
 
+from ..cache import enrolled_course_ids
+
 
 class IsEnrolled(BasePermission):
     """
@@ -18,5 +20,13 @@ class IsEnrolled(BasePermission):
 
     """
 
-    def has_object_permissions(self, request, view, obj):
-        return obj.students.filter(id=request.user.id).exists()
+    def has_object_permission(self, request, view, obj):
+        # множество курсов пользователя берется из кеша, без JOIN
+        return obj.pk in enrolled_course_ids(request.user)
+
+
+class CanAddCourse(BasePermission):
+    """ Создавать курсы, в том числе копии, могут только преподаватели """
+
+    def has_permission(self, request, view):
+        return request.user.has_perm('courses.add_course')
@@ -1,9 +1,27 @@
 from rest_framework import serializers
 
-from ..models import Subject, Course, Module, Content
+from django.conf import settings
 
+from ..loaders import load_course_contents
+from ..models import Subject, Course, Module, Content, Upload, \
+    SearchDocument
 
-class SubjectSerializer(serializers.ModelSerializer):
+
+class DynamicFieldsMixin(object):
+    """
+    Сериализатор только с частью полей:
+    CourseSerializer(course, fields=['id', 'title'])
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super(DynamicFieldsMixin, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SubjectSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Subject
         fields = ['id', 'title', 'slug']
@@ -15,7 +33,17 @@ class ModuleSerializer(serializers.ModelSerializer):
         fields = ['order', 'title', 'description']
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseCloneSerializer(serializers.ModelSerializer):
+    """ Необязательные название и slug копии курса """
+
+    class Meta:
+        model = Course
+        fields = ['title', 'slug']
+        extra_kwargs = {'title': {'required': False},
+                        'slug': {'required': False}}
+
+
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     # many - может быть множество модулей
     # read_only - данные не доступны для редактирования
     modules = ModuleSerializer(many=True, read_only=True)
@@ -51,10 +79,60 @@ class ModuleWithContentsSerializer(serializers.ModelSerializer):
         fields = ['order', 'title', 'description', 'contents']
 
 
-class CourseWithContentsSerializer(serializers.ModelSerializer):
+class CourseWithContentsSerializer(DynamicFieldsMixin,
+                                   serializers.ModelSerializer):
     modules = ModuleWithContentsSerializer(many=True)
 
     class Meta:
         model = Course
         fields = ['id', 'subject', 'title', 'slug', 'overview',
                   'created', 'owner', 'modules']
+
+    def to_representation(self, instance):
+        # загружаем модули, содержимое и объекты содержимого пачкой,
+        # чтобы ItemRelatedField не выполнял запрос на каждый элемент
+        load_course_contents(instance)
+        return super(CourseWithContentsSerializer,
+                     self).to_representation(instance)
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Upload
+        fields = ['id', 'module', 'model_name', 'title', 'filename',
+                  'size', 'offset', 'checksum']
+        read_only_fields = ['offset', 'checksum']
+
+    def validate_module(self, module):
+        # загружать содержимое можно только в модули своих курсов
+        if module.course.owner_id != self.context['request'].user.id:
+            raise serializers.ValidationError('Module not found.')
+        return module
+
+    def validate_size(self, size):
+        if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('File is too large.')
+        return size
+
+
+class SearchCourseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Course
+        fields = ['id', 'title', 'slug']
+
+
+class SearchModuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Module
+        fields = ['id', 'title']
+
+
+class SearchDocumentSerializer(serializers.ModelSerializer):
+    # текст содержимого доступен только студентам курса, поэтому
+    # в результатах только заголовки
+    course = SearchCourseSerializer(read_only=True)
+    module = SearchModuleSerializer(read_only=True)
+
+    class Meta:
+        model = SearchDocument
+        fields = ['title', 'course', 'module', 'content']
@@ -0,0 +1,163 @@
+import fcntl
+import os
+import re
+import zlib
+
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from django.apps import apps
+from django.core.files import File
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from ..models import Content, Upload
+from .serializers import UploadSerializer
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class CompletedUpload(File):
+    """
+    Готовый временный файл. Метод temporary_file_path() позволяет
+    хранилищу переместить файл, а не копировать его.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class UploadCreateView(APIView):
+    """
+    Начало загрузки файла частями.
+    Принимает module, model_name (file или image), title, filename и size.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, format=None):
+        serializer = UploadSerializer(data=request.data,
+                                      context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(owner=request.user)
+        os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+        open(upload.path, 'wb').close()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class UploadDetailView(APIView):
+    """
+    GET возвращает состояние загрузки, чтобы продолжить ее после сбоя.
+    PUT принимает очередную часть с заголовком
+    Content-Range: bytes <start>-<end>/<size>, где start равен offset.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, pk, format=None):
+        upload = get_object_or_404(Upload, pk=pk, owner=request.user)
+        return Response(UploadSerializer(upload).data)
+
+    def put(self, request, pk, format=None):
+        upload = get_object_or_404(Upload, pk=pk, owner=request.user)
+        match = CONTENT_RANGE_RE.match(
+            request.META.get('HTTP_CONTENT_RANGE', ''))
+        if not match:
+            return Response({'detail': 'Content-Range header is required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        start, end, size = map(int, match.groups())
+        if size != upload.size or end < start or end >= size:
+            return Response({'detail': 'Invalid Content-Range.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            f = open(upload.path, 'r+b')
+        except FileNotFoundError:
+            raise Http404('Upload has expired.')
+        with f:
+            # одну загрузку дописывает только один запрос: иначе более
+            # медленный обрезал бы часть, уже принятую другим
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return Response(UploadSerializer(upload).data,
+                                status=status.HTTP_409_CONFLICT)
+            try:
+                upload.refresh_from_db()
+            except Upload.DoesNotExist:
+                raise Http404('Upload has expired.')
+            if start != upload.offset:
+                # часть уже принята или пропущена предыдущая
+                return Response(UploadSerializer(upload).data,
+                                status=status.HTTP_409_CONFLICT)
+
+            # тело читается и записывается блоками, в памяти
+            # не накапливается
+            remaining = end - start + 1
+            checksum = upload.checksum
+            f.seek(start)
+            while remaining:
+                data = request.stream.read(min(CHUNK_SIZE, remaining)) \
+                    if request.stream else b''
+                if not data:
+                    break
+                f.write(data)
+                checksum = zlib.crc32(data, checksum)
+                remaining -= len(data)
+            # отбрасываем остатки прерванной записи
+            f.truncate()
+            if remaining:
+                return Response({'detail': 'Incomplete chunk.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            if not Upload.objects.filter(pk=upload.pk, offset=start)\
+                    .update(offset=end + 1, checksum=checksum,
+                            updated=timezone.now()):
+                raise Http404('Upload has expired.')
+        upload.offset, upload.checksum = end + 1, checksum
+        return Response(UploadSerializer(upload).data)
+
+
+class UploadCompleteView(APIView):
+    """
+    Завершение загрузки: создает объект File или Image и его Content.
+    Необязательный параметр checksum сверяется с CRC32 принятых данных.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, pk, format=None):
+        upload = get_object_or_404(Upload, pk=pk, owner=request.user)
+        if upload.offset != upload.size:
+            return Response(UploadSerializer(upload).data,
+                            status=status.HTTP_409_CONFLICT)
+        checksum = request.data.get('checksum')
+        if checksum is not None and str(checksum) != str(upload.checksum):
+            return Response({'detail': 'Checksum mismatch.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        model = apps.get_model(app_label='courses',
+                               model_name=upload.model_name)
+        try:
+            f = open(upload.path, 'rb')
+        except FileNotFoundError:
+            raise Http404('Upload has expired.')
+        with f, transaction.atomic():
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return Response(UploadSerializer(upload).data,
+                                status=status.HTTP_409_CONFLICT)
+            # повторный запрос завершения не создаст второй объект
+            if not Upload.objects.filter(pk=upload.pk).delete()[0]:
+                raise Http404('Upload has already been completed.')
+            item = model(owner=request.user, title=upload.title)
+            item.file.save(upload.filename, CompletedUpload(f), save=False)
+            item.save()
+            content = Content.objects.create(module=upload.module, item=item)
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
+        return Response({'content': content.id, 'item': item.id},
+                        status=status.HTTP_201_CREATED)
@@ -2,7 +2,7 @@ from rest_framework import routers
 
 from django.urls import path, include
 
-from . import views
+from . import uploads, views
 
 app_name = 'courses'
 
@@ -16,6 +16,18 @@ urlpatterns = [
     path('subjects/<pk>/',
          views.SubjectDetailView.as_view(),
          name='subject_detail'),
+    path('search/',
+         views.SearchView.as_view(),
+         name='search'),
+    path('uploads/',
+         uploads.UploadCreateView.as_view(),
+         name='upload_create'),
+    path('uploads/<uuid:pk>/',
+         uploads.UploadDetailView.as_view(),
+         name='upload_detail'),
+    path('uploads/<uuid:pk>/complete/',
+         uploads.UploadCompleteView.as_view(),
+         name='upload_complete'),
     # path('courses/<pk>/enroll/',
     #      views.CourseEnrollView.as_view(),
     #      name='course_enroll'),
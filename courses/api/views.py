@@ -1,27 +1,154 @@
-from rest_framework import generics, viewsets
+from rest_framework import generics, status, viewsets
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
+from django.db import IntegrityError
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
+from .. import catalog
+from ..cloning import clone_course
 from ..models import Subject, Course
-from .permissions import IsEnrolled
-from .serializers import SubjectSerializer, \
+from ..search import search
+from .pagination import CatalogCoursePagination, CatalogSubjectPagination
+from .permissions import CanAddCourse, IsEnrolled
+from .serializers import SubjectSerializer, CourseCloneSerializer, \
     CourseSerializer, \
-    CourseWithContentsSerializer
+    CourseWithContentsSerializer, SearchDocumentSerializer
 
 
-class SubjectListView(generics.ListAPIView):
+def _split_param(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsMixin(object):
+    """
+    Выбор полей ответа параметрами запроса:
+    ?fields=id,title - только перечисленные поля,
+    ?expand=modules,contents - вложенные объекты.
+    Без этих параметров ответ полный, как раньше.
+    """
+    # поля, которые можно выбрать параметром fields
+    sparse_fields = ()
+    # вложенные объекты, которые включаются параметром expand
+    expandable = ()
+
+    def get_expandable(self):
+        """ None - действие не поддерживает выбор полей """
+        return self.expandable
+
+    def get_selection(self):
+        """ (поля, вложенные объекты) или None для полного ответа """
+        if not hasattr(self, '_selection'):
+            self._selection = self.parse_selection()
+        return self._selection
+
+    def parse_selection(self):
+        params = self.request.query_params
+        expandable = self.get_expandable()
+        if expandable is None or \
+                'fields' not in params and 'expand' not in params:
+            return None
+        fields = _split_param(params.get('fields', '')) or \
+            self.sparse_fields
+        expand = set(_split_param(params.get('expand', '')))
+        errors = {}
+        unknown = set(fields) - set(self.sparse_fields)
+        if unknown:
+            errors['fields'] = ['Unknown fields: {}.'.format(
+                ', '.join(sorted(unknown)))]
+        unknown = expand - set(expandable)
+        if unknown:
+            errors['expand'] = ['Cannot expand: {}.'.format(
+                ', '.join(sorted(unknown)))]
+        if errors:
+            raise ValidationError(errors)
+        # порядок полей как в полном ответе
+        return [name for name in self.sparse_fields if name in fields], \
+            expand
+
+    def get_selection_key(self):
+        """ Нормализованный выбор полей для ключей и ETag """
+        selection = self.get_selection()
+        if selection is None:
+            return ''
+        fields, expand = selection
+        return 'fields={};expand={}'.format(','.join(fields),
+                                            ','.join(sorted(expand)))
+
+    def get_serializer_fields(self, fields, expand):
+        return list(fields) + sorted(expand)
+
+    def get_serializer(self, *args, **kwargs):
+        selection = self.get_selection()
+        if selection is not None:
+            kwargs['fields'] = self.get_serializer_fields(*selection)
+        return super(SparseFieldsMixin, self).get_serializer(*args,
+                                                             **kwargs)
+
+
+class SubjectListView(SparseFieldsMixin, generics.ListAPIView):
+    """ Список предметов из снимка каталога, без запросов к базе """
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    pagination_class = CatalogSubjectPagination
+    sparse_fields = ('id', 'title', 'slug')
+
+    def list(self, request, *args, **kwargs):
+        selection = self.get_selection()
+        fields = self.sparse_fields if selection is None else selection[0]
+        snapshot = catalog.get_catalog()
+        subjects = self.paginator.paginate_records(
+            snapshot.subjects, snapshot.subject_keys, request)
+        return self.get_paginated_response(
+            [{field: subject[field] for field in fields}
+             for subject in subjects])
 
 
-class SubjectDetailView(generics.RetrieveAPIView):
+class SubjectDetailView(SparseFieldsMixin, generics.RetrieveAPIView):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    sparse_fields = ('id', 'title', 'slug')
+
+    def get_queryset(self):
+        qs = super(SubjectDetailView, self).get_queryset()
+        selection = self.get_selection()
+        if selection is not None:
+            qs = qs.only('id', *selection[0])
+        return qs
+
+
+class SearchView(APIView):
+    """
+    Полнотекстовый поиск по курсам, модулям и текстам курсов,
+    на которые пользователь записан или которые он ведет:
+    /api/search/?q=слова&page=2
+    """
+    permission_classes = (AllowAny,)
+    page_size = 20
+
+    def get(self, request, format=None):
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        documents, has_more = search(request.query_params.get('q', ''),
+                                     offset=(page - 1) * self.page_size,
+                                     limit=self.page_size,
+                                     user=request.user)
+        next_url = replace_query_param(request.build_absolute_uri(),
+                                       'page', page + 1) \
+            if has_more else None
+        return Response({
+            'next': next_url,
+            'results': SearchDocumentSerializer(documents, many=True).data,
+        })
 
 
 # class CourseEnrollView(APIView):
@@ -38,10 +165,66 @@ class SubjectDetailView(generics.RetrieveAPIView):
 #         return Response({'enrolled': True})
 
 
-class CourseViewSet(viewsets.ReadOnlyModelViewSet):
-    """ Маршрутизатор с методами retrieve и list """
+class CourseViewSet(SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Маршрутизатор с методами retrieve и list.
+    ?fields=id,title&expand=modules - часть полей курса и модули,
+    для contents также expand=contents.
+    """
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CatalogCoursePagination
+    sparse_fields = ('id', 'subject', 'title', 'slug', 'overview',
+                     'created', 'owner')
+
+    def get_expandable(self):
+        if self.action == 'contents':
+            return ('modules', 'contents')
+        if self.action in ('list', 'retrieve'):
+            return ('modules',)
+        return None
+
+    def get_serializer_fields(self, fields, expand):
+        # модули с содержимым или без него выводятся в поле modules
+        return list(fields) + (['modules'] if expand else [])
+
+    def get_serializer_class(self):
+        selection = self.get_selection()
+        if self.action == 'contents' and selection is not None and \
+                'contents' not in selection[1]:
+            # без содержимого HTML объектов не генерируется
+            return CourseSerializer
+        return super(CourseViewSet, self).get_serializer_class()
+
+    def get_queryset(self):
+        qs = super(CourseViewSet, self).get_queryset()
+        selection = self.get_selection()
+        if selection is not None:
+            # загружаются только выбранные столбцы, модули - только
+            # если они нужны; содержимое загружает сериализатор
+            fields, expand = selection
+            columns = ['id'] + list(fields)
+            if self.action == 'contents':
+                columns.append('updated')
+            qs = qs.only(*columns)
+            if expand == {'modules'}:
+                qs = qs.prefetch_related('modules')
+        elif self.action in ('list', 'retrieve'):
+            # модули всех курсов страницы загружаются одним запросом
+            qs = qs.select_related('subject', 'owner')\
+                .prefetch_related('modules')
+        return qs
+
+    def list(self, request, *args, **kwargs):
+        # список курсов формируется из снимка каталога
+        selection = self.get_selection()
+        fields = catalog.API_COURSE_FIELDS if selection is None \
+            else self.get_serializer_fields(*selection)
+        snapshot = catalog.get_catalog()
+        courses = self.paginator.paginate_records(
+            snapshot.courses, snapshot.course_keys, request)
+        return self.get_paginated_response(
+            [catalog.api_course(course, fields) for course in courses])
 
     # detail_route, чтобы указать, что метод работает с одним объектом,
     # а не списком
@@ -57,6 +240,29 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
         course.students.add(request.user)
         return Response({'enrolled': True})
 
+    @action(detail=True, methods=['post'],
+            authentication_classes=[BasicAuthentication],
+            permission_classes=[IsAuthenticated, CanAddCourse])
+    def clone(self, request, *args, **kwargs):
+        """
+        Копия курса владельца со всем содержимым. Можно передать title
+        и slug копии.
+        """
+        course = self.get_object()
+        if course.owner_id != request.user.id:
+            raise PermissionDenied()
+        serializer = CourseCloneSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            clone = clone_course(course, owner=request.user,
+                                 **serializer.validated_data)
+        except IntegrityError:
+            # тот же slug занят параллельным запросом
+            raise ValidationError({'slug': ['Course with this slug '
+                                            'already exists.']})
+        return Response(CourseSerializer(clone).data,
+                        status=status.HTTP_201_CREATED)
+
     # возвращать данные курса, его модулей и содержимого
     # оборачиваем метод в декоратор detail_route, т. к. он работает с одним
     # объектом
@@ -68,4 +274,16 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
             permission_classes=[IsAuthenticated, IsEnrolled])
     def contents(self, request, *args, **kwargs):
         # возвращаем объект модели Course.
-        return self.retrieve(request, *args, **kwargs)
+        course = self.get_object()
+        # версия содержимого известна без сериализации: если у клиента
+        # та же версия, отвечаем 304 и не формируем ответ
+        etag = course.get_contents_etag(self.get_selection_key())
+        last_modified = int(course.updated.timestamp())
+        response = get_conditional_response(request,
+                                            etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = Response(self.get_serializer(course).data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
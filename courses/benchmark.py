@@ -0,0 +1,301 @@
+import base64
+import json
+import random
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .bulk import bulk_insert, bulk_contents, after_bulk_insert
+from .counters import update_total_students
+from .models import Subject, Course, Module, Content, Text, Video, Image, \
+    File
+from .timing import percentile
+
+PASSWORD = 'bench'
+PERCENTILES = (50, 90, 95, 99)
+
+
+def seed(subjects=5, courses=20, modules=8, contents=3, students=200,
+         enrollments=5, rng=None):
+    """
+    Заполняет базу синтетическими данными: subjects предметов по courses
+    курсов, в каждом modules модулей с contents объектами каждого типа
+    содержимого, students студентов, записанных на enrollments курсов.
+    Возвращает (преподаватель, студент для запросов, курсы).
+    """
+    rng = rng or random.Random(0)
+    password = make_password(PASSWORD)
+    owner = User.objects.create(username='bench-owner', password=password)
+    users = bulk_insert(User, [
+        User(username='bench-student-{}'.format(n), password=password)
+        for n in range(max(students, 1))])
+
+    subject_objs = bulk_insert(Subject, [
+        Subject(title='Subject {}'.format(n), slug='subject-{}'.format(n))
+        for n in range(subjects)])
+    course_objs = bulk_insert(Course, [
+        Course(subject=subject, owner=owner,
+               title='Course {}-{}'.format(subject.pk, n),
+               slug='course-{}-{}'.format(subject.pk, n),
+               overview='Synthetic course overview ' * 20)
+        for subject in subject_objs for n in range(courses)])
+
+    for start in range(0, len(course_objs), 50):
+        batch = course_objs[start:start + 50]
+        module_objs = [Module(course=course, title='Module {}'.format(n),
+                              description='Synthetic module ' * 10)
+                       for course in batch for n in range(modules)]
+        Module._meta.get_field('order').assign(module_objs, fresh=True)
+        bulk_insert(Module, module_objs)
+        module_items = []
+        for module in module_objs:
+            for n in range(contents):
+                module_items += [
+                    (module.pk, None, Text(
+                        owner=owner, title='Text {}'.format(n),
+                        content='Lorem ipsum dolor sit amet. ' * 40)),
+                    (module.pk, None, Video(
+                        owner=owner, title='Video {}'.format(n),
+                        url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                        provider='youtube', video_id='dQw4w9WgXcQ',
+                        embed_url='https://www.youtube.com/embed/'
+                                  'dQw4w9WgXcQ')),
+                    (module.pk, None, Image(
+                        owner=owner, title='Image {}'.format(n),
+                        file='images/bench.jpg')),
+                    (module.pk, None, File(
+                        owner=owner, title='File {}'.format(n),
+                        file='files/bench.pdf')),
+                ]
+        contents_objs = bulk_contents(module_items, fresh=True)
+        after_bulk_insert(batch, module_objs, contents_objs,
+                          derivatives=False)
+
+    through = Course.students.through
+    through.objects.bulk_create([
+        through(course=course, user=user)
+        for user in users
+        for course in rng.sample(course_objs,
+                                 min(enrollments, len(course_objs)))],
+        batch_size=500)
+    update_total_students()
+    # HTML содержимого генерируется заранее, как после render_contents
+    for model in (Text, Video, Image, File):
+        for item in model.objects.iterator():
+            item.update_html()
+    student = users[0]
+    return owner, student, course_objs
+
+
+class CacheStats:
+    """
+    Считает попадания и промахи get/get_many кеша на время замера.
+    Методы подменяются у объекта бэкенда, поэтому учитываются и
+    обращения через django.core.cache.cache.
+    """
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+        self.hits = self.misses = 0
+
+    @contextmanager
+    def count(self):
+        cache = self.cache
+        original_get, original_get_many = cache.get, cache.get_many
+        missing = object()
+
+        def get(key, default=None, version=None):
+            value = original_get(key, missing, version=version)
+            if value is missing:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+        def get_many(keys, version=None):
+            keys = list(keys)
+            values = original_get_many(keys, version=version)
+            self.hits += len(values)
+            self.misses += len(keys) - len(values)
+            return values
+
+        cache.get, cache.get_many = get, get_many
+        try:
+            yield self
+        finally:
+            del cache.get, cache.get_many
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return round(self.hits / total, 3) if total else None
+
+
+class Scenario:
+    def __init__(self, name, request, user=None, setup=None):
+        self.name = name
+        self.request = request
+        self.user = user
+        # вызывается с клиентом перед прогревом
+        self.setup = setup
+
+
+def get_scenarios(owner, student, courses, rng):
+    """
+    Сценарии: имя, функция запроса (client -> response) и пользователь.
+    Объекты для каждого запроса выбираются случайно, но воспроизводимо.
+    """
+    enrolled = list(Course.objects.filter(students=student))
+    modules = list(Module.objects.filter(course__in=courses)
+                   .values_list('pk', 'course_id'))
+    modules_by_course = {}
+    for pk, course_id in modules:
+        modules_by_course.setdefault(course_id, []).append(pk)
+    contents_by_module = {}
+    for pk, module_id in Content.objects.filter(module__course__in=courses)\
+            .values_list('pk', 'module_id'):
+        contents_by_module.setdefault(module_id, []).append(pk)
+    api_auth = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(
+        '{}:{}'.format(student.username, PASSWORD).encode()).decode()}
+
+    def reorder(ids):
+        ids = list(ids)
+        rng.shuffle(ids)
+        return json.dumps({pk: n for n, pk in enumerate(ids)})
+
+    def module_order(client):
+        course = rng.choice(courses)
+        return client.post(reverse('courses:module_order'),
+                           reorder(modules_by_course[course.pk]),
+                           content_type='application/json')
+
+    def content_order(client):
+        module_id = rng.choice(modules)[0]
+        return client.post(reverse('courses:content_order'),
+                           reorder(contents_by_module[module_id]),
+                           content_type='application/json')
+
+    # ETag содержимого курсов, полученные клиентом
+    contents_etags = {}
+
+    def course_contents(client, course, **headers):
+        response = client.get(reverse('api:course-contents',
+                                      args=[course.pk]),
+                              **api_auth, **headers)
+        if response.has_header('ETag'):
+            contents_etags[course.pk] = response['ETag']
+        return response
+
+    def fetch_contents(client):
+        for course in enrolled:
+            course_contents(client, course)
+
+    def contents_not_modified(client):
+        course = rng.choice(enrolled)
+        return course_contents(
+            client, course,
+            HTTP_IF_NONE_MATCH=contents_etags.get(course.pk, ''))
+
+    def student_course_detail(client):
+        course = rng.choice(enrolled)
+        return client.get(reverse(
+            'students:student_course_detail_module',
+            args=[course.pk, rng.choice(modules_by_course[course.pk])]))
+
+    return [
+        Scenario('course_list', lambda client: client.get(
+            reverse('course_list'))),
+        Scenario('course_list_subject', lambda client: client.get(
+            reverse('courses:course_list_subject',
+                    args=[rng.choice(courses).subject.slug]))),
+        Scenario('course_detail', lambda client: client.get(
+            reverse('courses:course_detail',
+                    args=[rng.choice(courses).slug]))),
+        Scenario('student_course_detail', student_course_detail, student),
+        Scenario('module_content_list', lambda client: client.get(
+            reverse('courses:module_content_list',
+                    args=[rng.choice(modules)[0]])), owner),
+        Scenario('module_order', module_order, owner),
+        Scenario('content_order', content_order, owner),
+        Scenario('api_subjects', lambda client: client.get(
+            reverse('api:subject_list'))),
+        Scenario('api_courses', lambda client: client.get(
+            reverse('api:course-list'))),
+        Scenario('api_course_detail', lambda client: client.get(
+            reverse('api:course-detail',
+                    args=[rng.choice(courses).pk]))),
+        Scenario('api_course_contents', lambda client: course_contents(
+            client, rng.choice(enrolled))),
+        Scenario('api_course_contents_304', contents_not_modified,
+                 setup=fetch_contents),
+    ]
+
+
+def run_scenario(scenario, iterations=50, warmup=5):
+    """
+    Выполняет сценарий warmup раз без замеров, затем iterations раз.
+    Возвращает задержки, число запросов к БД и попадания в кеш.
+    """
+    client = Client()
+    if scenario.user is not None:
+        client.force_login(scenario.user)
+    if scenario.setup is not None:
+        scenario.setup(client)
+    for _ in range(warmup):
+        scenario.request(client)
+
+    stats = CacheStats()
+    latencies, queries, errors = [], [], 0
+    with stats.count():
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = scenario.request(client)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+
+    result = {'iterations': iterations,
+              'errors': errors,
+              'mean_ms': round(sum(latencies) / len(latencies), 3),
+              'max_ms': round(max(latencies), 3),
+              'queries_mean': round(sum(queries) / len(queries), 2),
+              'queries_max': max(queries),
+              'cache_hits': stats.hits,
+              'cache_misses': stats.misses,
+              'cache_hit_rate': stats.hit_rate}
+    for p in PERCENTILES:
+        result['p{}_ms'.format(p)] = round(percentile(latencies, p), 3)
+    return result
+
+
+def compare(results, baseline, latency_threshold=0.2, query_threshold=0):
+    """
+    Сравнивает результаты с сохраненными. Возвращает список регрессий:
+    рост p95 больше чем на latency_threshold (доля), рост максимального
+    числа запросов больше чем на query_threshold, новые ошибки.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + latency_threshold):
+            regressions.append('{}: p95 {:.1f} ms > baseline {:.1f} ms'
+                               .format(name, result['p95_ms'],
+                                       base['p95_ms']))
+        if result['queries_max'] > base['queries_max'] + query_threshold:
+            regressions.append('{}: {} queries > baseline {}'.format(
+                name, result['queries_max'], base['queries_max']))
+        if result['errors'] > base.get('errors', 0):
+            regressions.append('{}: {} errors > baseline {}'.format(
+                name, result['errors'], base.get('errors', 0)))
+    return regressions
@@ -0,0 +1,143 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import NotSupportedError, connections, router, transaction
+
+from .models import Module, Content, Text, Video, Image, File, Blob, \
+    SearchDocument
+from . import catalog
+from .cache import forget_course_slugs
+from .counters import update_total_courses, update_total_modules
+from .storage import ContentAddressableStorage
+
+ITEM_MODELS = {model._meta.model_name: model
+               for model in (Text, Video, Image, File)}
+# служебные поля объектов содержимого, которые не переносятся
+ITEM_SKIP_FIELDS = {'id', 'owner', 'created', 'updated', 'html', 'html_key',
+                    'derivatives'}
+
+
+def item_fields(model):
+    """ Переносимые поля объекта содержимого: title, content, url, file... """
+    return [field for field in model._meta.concrete_fields
+            if field.name not in ITEM_SKIP_FIELDS]
+
+
+def bulk_insert(model, objs, batch_size=500):
+    """
+    bulk_create, после которого у всех объектов заполнен pk.
+
+    PostgreSQL возвращает pk из INSERT ... RETURNING. SQLite этого
+    не умеет, но запись в нем выполняется только одной транзакцией
+    за раз, поэтому pk вставленной пачки - последние pk таблицы.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model._base_manager.using(using).bulk_create(
+            objs, batch_size=batch_size)
+    if connection.vendor != 'sqlite':
+        raise NotSupportedError(
+            'bulk_insert() needs INSERT ... RETURNING or SQLite')
+    with transaction.atomic(using=using):
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            model._base_manager.using(using).bulk_create(batch)
+            pks = model._base_manager.using(using).order_by('-pk')\
+                .values_list('pk', flat=True)[:len(batch)]
+            for obj, pk in zip(batch, reversed(list(pks))):
+                obj.pk = pk
+                obj._state.adding = False
+                obj._state.db = using
+    return objs
+
+
+def after_bulk_insert(courses=(), modules=(), contents=(), subject_ids=(),
+                      derivatives=True):
+    """
+    То, что для одиночных объектов делают обработчики сигналов: счетчики,
+    поисковые документы, ссылки на файлы, уменьшенные копии изображений
+    и обновление снимка каталога. Объекты Content должны иметь
+    загруженный item.
+    derivatives=False - копии изображений уже есть (копирование курса).
+    """
+    subject_ids = set(subject_ids) | \
+        {course.subject_id for course in courses}
+    course_ids = {course.pk for course in courses} | \
+        {module.course_id for module in modules}
+    update_total_courses(subject_ids)
+    update_total_modules(course_ids)
+    # slug новых курсов мог быть закеширован как неизвестный
+    forget_course_slugs(*[course.slug for course in courses])
+
+    module_courses = {module.pk: module.course_id for module in modules}
+    missing = {content.module_id for content in contents} - \
+        set(module_courses)
+    module_courses.update(Module.objects.filter(pk__in=missing)
+                          .values_list('pk', 'course_id'))
+    documents = [SearchDocument(course=course, title=course.title,
+                                body=course.overview)
+                 for course in courses]
+    # как в search.index_module: описание модуля не индексируется
+    documents += [SearchDocument(course_id=module.course_id, module=module,
+                                 title=module.title, body='')
+                  for module in modules]
+
+    blobs = {}
+    images = []
+    rendered = {}
+    for content in contents:
+        item = content.item
+        rendered.setdefault(item._meta.model_name, []).append(item.pk)
+        if isinstance(item, Text):
+            documents.append(SearchDocument(
+                course_id=module_courses[content.module_id],
+                module_id=content.module_id, content=content,
+                title=item.title, body=item.content))
+        elif isinstance(item, (Image, File)) and item.file:
+            storage = item.file.storage
+            if isinstance(storage, ContentAddressableStorage) and \
+                    storage.is_blob(item.file.name):
+                blobs[item.file.name] = blobs.get(item.file.name, 0) + 1
+            if isinstance(item, Image):
+                images.append(item)
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+    if blobs:
+        Blob.acquire_many(blobs)
+
+    from .tasks import make_image_derivatives, render_items
+    # bulk_create не вызывает save(), который ставит задачу render_item
+    for model_name, pks in rendered.items():
+        for start in range(0, len(pks), 500):
+            render_items.delay(model_name, pks[start:start + 500])
+    if images and derivatives:
+        for image in images:
+            make_image_derivatives.delay(image.pk, image.file.name)
+    catalog.refresh(subject_ids, course_ids)
+
+
+def bulk_contents(module_items, batch_size=500, fresh=False):
+    """
+    Создает объекты содержимого и связывающие их Content.
+    module_items - список (module_id, order, item) с несохраненными item,
+    fresh=True - все модули только что созданы.
+    Возвращает созданные Content с загруженными item.
+    """
+    by_model = {}
+    for _, _, item in module_items:
+        by_model.setdefault(type(item), []).append(item)
+    for model, items in by_model.items():
+        bulk_insert(model, items, batch_size)
+
+    content_types = {model: ContentType.objects.get_for_model(model)
+                     for model in by_model}
+    item_field = Content._meta.get_field('item')
+    contents = []
+    for module_id, order, item in module_items:
+        content = Content(module_id=module_id, order=order,
+                          content_type=content_types[type(item)],
+                          object_id=item.pk)
+        item_field.set_cached_value(content, item)
+        contents.append(content)
+    Content._meta.get_field('order').assign(contents, fresh=fresh)
+    bulk_insert(Content, contents, batch_size)
+    return contents
+
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Course
+
+# Сопоставление slug -> id курса. Неизвестные slug кешируются на меньшее
+# время, локальный кеш процесса живет недолго, так как его нельзя
+# сбросить из другого процесса.
+COURSE_SLUG_TIMEOUT = 60 * 60 * 24
+COURSE_SLUG_MISS_TIMEOUT = 60 * 5
+COURSE_SLUG_LOCAL_TIMEOUT = 30
+# Множества курсов, на которые записаны пользователи
+ENROLLMENTS_TIMEOUT = 60 * 60 * 24
+
+
+class LocalLRUCache(object):
+    """
+    Небольшой LRU-кеш в памяти процесса с ограниченным временем жизни
+    записей. Используется перед общим кешем для самых частых ключей.
+    """
+
+    def __init__(self, maxsize=1024, timeout=30):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_course_slugs = LocalLRUCache(timeout=COURSE_SLUG_LOCAL_TIMEOUT)
+
+
+def _course_slug_key(slug):
+    return 'course_slug:{}'.format(slug)
+
+
+def resolve_course_slug(slug):
+    """
+    Возвращает id курса по slug или None, если такого курса нет.
+    В установившемся режиме запросов к базе данных не выполняет.
+    """
+    course_id = _course_slugs.get(slug)
+    if course_id is None:
+        key = _course_slug_key(slug)
+        course_id = cache.get(key)
+        if course_id is None:
+            # 0 означает, что курса с таким slug нет
+            course_id = Course.objects.filter(slug=slug)\
+                .values_list('id', flat=True).first() or 0
+            cache.set(key, course_id, COURSE_SLUG_TIMEOUT if course_id
+                      else COURSE_SLUG_MISS_TIMEOUT)
+        _course_slugs.set(slug, course_id)
+    return course_id or None
+
+
+def forget_course_slugs(*slugs):
+    """ Сбрасывает сопоставления для slug, измененных или удаленных """
+    slugs = [slug for slug in slugs if slug]
+    cache.delete_many([_course_slug_key(slug) for slug in slugs])
+    for slug in slugs:
+        _course_slugs.delete(slug)
+
+
+def _enrollments_key(user_id):
+    """
+    Ключ множества курсов с версией: после записи или отчисления версия
+    увеличивается, и множество строится заново. Запрос, прочитавший
+    базу до фиксации изменений, сохранит результат под старой версией,
+    которая уже не используется.
+    """
+    version_key = 'enrollments_version:{}'.format(user_id)
+    version = cache.get(version_key)
+    if version is None:
+        # от текущего времени, чтобы не вернуться к старым версиям
+        cache.add(version_key, int(time.time() * 1000), None)
+        version = cache.get(version_key)
+    return 'enrollments:{}:{}'.format(user_id, version)
+
+
+def enrolled_course_ids(user):
+    """
+    Множество id курсов, на которые записан пользователь. Строится
+    из промежуточной таблицы при промахе кеша и сбрасывается сигналом
+    m2m_changed, поэтому проверки записи не выполняют JOIN.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    key = _enrollments_key(user.pk)
+    course_ids = cache.get(key)
+    if course_ids is None:
+        course_ids = frozenset(
+            Course.students.through.objects.filter(user_id=user.pk)
+            .values_list('course_id', flat=True))
+        cache.set(key, course_ids, ENROLLMENTS_TIMEOUT)
+    return course_ids
+
+
+def forget_enrollments(user_ids):
+    """
+    Сбрасывает множества курсов пользователей после фиксации транзакции.
+    Множества не изменяются на месте: чтение и запись нескольких
+    процессов не атомарны, а это кеш прав доступа.
+    """
+    keys = ['enrollments_version:{}'.format(user_id)
+            for user_id in user_ids]
+
+    def forget():
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                # версии нет: при обращении будет создана новая
+                pass
+
+    transaction.on_commit(forget)
@@ -0,0 +1,479 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .api.serializers import CourseSerializer
+from .models import Subject, Course
+
+logger = logging.getLogger(__name__)
+
+# Снимок каталога хранится в общем кеше по частям: версия, индекс
+# версии (порядок предметов и курсов с ревизиями записей) и записи
+# предметов и курсов, по ключу на ревизию. Изменение курса переписывает
+# только его запись и индекс. Каждый сервер держит копию снимка
+# в файле CATALOG_SNAPSHOT_PATH, с которой снимок восстанавливается
+# после перезапуска memcached без запросов к базе данных.
+VERSION_KEY = 'catalog:version'
+INDEX_KEY = 'catalog:index:{}'
+SUBJECT_KEY = 'catalog:subject:{}:{}'
+COURSE_KEY = 'catalog:course:{}:{}'
+LOCK_KEY = 'catalog:lock'
+# блокировка снимается сама, если ее владелец завершился аварийно
+LOCK_TIMEOUT = 60
+# сколько запрос ждет блокировку, прежде чем обойтись без общего кеша
+LOCK_WAIT = 2
+# после сбоя общий кеш снова проверяется не раньше чем через
+CACHE_RETRY_INTERVAL = 10
+# поля курса в ответе API, как у CourseSerializer
+API_COURSE_FIELDS = ('id', 'subject', 'title', 'slug', 'overview',
+                     'created', 'owner', 'modules')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_pending = threading.local()
+_current = None
+_cache_failed_at = None
+
+
+class CatalogLockTimeout(Exception):
+    pass
+
+
+class Catalog(object):
+    """
+    Снимок каталога: предметы с количеством курсов и курсы с
+    преподавателем, количеством и списком модулей. Предметы упорядочены
+    по (title, id), курсы - по (-created, id), как в API. records -
+    записи по ключам кеша; при смене версии неизмененные записи
+    берутся из предыдущего снимка процесса.
+    """
+
+    def __init__(self, index, records):
+        self.version = index['version']
+        self.index = index
+        self.records = records
+        subject_entries = [entry for entry in index['subjects']
+                           if subject_record_key(entry) in records]
+        course_entries = [entry for entry in index['courses']
+                          if course_record_key(entry) in records]
+        self.subjects = [records[subject_record_key(entry)]
+                         for entry in subject_entries]
+        self.subject_keys = [(title, pk)
+                             for title, pk, rev in subject_entries]
+        subjects_by_id = {subject['id']: {'id': subject['id'],
+                                          'title': subject['title'],
+                                          'slug': subject['slug']}
+                          for subject in self.subjects}
+        # название и slug предмета подставляются в записи курсов
+        self.courses = [
+            dict(record, subject=subjects_by_id.get(
+                record['subject'], {'id': record['subject'],
+                                    'title': '', 'slug': ''}))
+            for record in (records[course_record_key(entry)]
+                           for entry in course_entries)]
+        self.course_keys = [(position, pk)
+                            for position, pk, subject_id, rev
+                            in course_entries]
+        self.subjects_by_slug = {subject['slug']: subject
+                                 for subject in self.subjects}
+        self._courses_by_subject = {}
+        for course in self.courses:
+            self._courses_by_subject.setdefault(
+                course['subject']['id'], []).append(course)
+
+    def subject_courses(self, subject_id):
+        return self._courses_by_subject.get(subject_id, [])
+
+
+def subject_record_key(entry):
+    """ Элемент индекса предмета: [title, id, ревизия] """
+    return SUBJECT_KEY.format(entry[1], entry[2])
+
+
+def course_record_key(entry):
+    """ Элемент индекса курса: [-created, id, id предмета, ревизия] """
+    return COURSE_KEY.format(entry[1], entry[3])
+
+
+def api_course(course, fields=API_COURSE_FIELDS):
+    """ Запись курса в виде ответа CourseSerializer с полями fields """
+    data = {field: course[field] for field in fields}
+    if 'subject' in data:
+        data['subject'] = course['subject']['id']
+    return data
+
+
+def _subject_record(subject):
+    return {'id': subject.id,
+            'title': subject.title,
+            'slug': subject.slug,
+            'total_courses': subject.total_courses}
+
+
+def _course_records(queryset):
+    courses = queryset.select_related('owner').prefetch_related('modules')
+    records = []
+    for course, data in zip(courses, CourseSerializer(courses,
+                                                      many=True).data):
+        record = dict(data)
+        record['modules'] = [dict(module) for module in data['modules']]
+        record['owner_name'] = course.owner.get_full_name()
+        record['total_modules'] = course.total_modules
+        record['created_us'] = (course.created - _EPOCH) // \
+            timedelta(microseconds=1)
+        records.append(record)
+    return records
+
+
+def _subject_entry(record, rev):
+    return [record['title'], record['id'], rev]
+
+
+def _course_entry(record, rev):
+    return [-record['created_us'], record['id'], record['subject'], rev]
+
+
+def _next_version(previous=0):
+    return max(previous + 1, int(time.time() * 1000))
+
+
+def build(version):
+    """ Полное построение снимка по базе данных: (индекс, записи) """
+    records = {}
+    subjects, courses = [], []
+    for subject in Subject.objects.all():
+        record = _subject_record(subject)
+        subjects.append(_subject_entry(record, version))
+        records[subject_record_key(subjects[-1])] = record
+    for record in _course_records(Course.objects.all()):
+        courses.append(_course_entry(record, version))
+        records[course_record_key(courses[-1])] = record
+    return ({'version': version,
+             'subjects': sorted(subjects),
+             'courses': sorted(courses)},
+            records)
+
+
+def patch(index, version, subject_ids=(), course_ids=()):
+    """
+    Новая версия индекса, в которой указанные предметы и курсы
+    перечитаны из базы. Предметы курсов, старые и новые, обновляются
+    вместе с ними: меняется их количество курсов. Возвращает (индекс,
+    новые записи, ключи замененных записей).
+    """
+    course_ids = set(course_ids)
+    subject_ids = set(subject_ids)
+    records, replaced = {}, []
+    courses = index['courses']
+    if course_ids:
+        replaced += [course_record_key(entry) for entry in courses
+                     if entry[1] in course_ids]
+        subject_ids.update(entry[2] for entry in courses
+                           if entry[1] in course_ids)
+        courses = [entry for entry in courses if entry[1] not in course_ids]
+        for record in _course_records(Course.objects.filter(
+                pk__in=course_ids)):
+            subject_ids.add(record['subject'])
+            courses.append(_course_entry(record, version))
+            records[course_record_key(courses[-1])] = record
+    subjects = index['subjects']
+    if subject_ids:
+        replaced += [subject_record_key(entry) for entry in subjects
+                     if entry[1] in subject_ids]
+        subjects = [entry for entry in subjects
+                    if entry[1] not in subject_ids]
+        for subject in Subject.objects.filter(pk__in=subject_ids):
+            record = _subject_record(subject)
+            subjects.append(_subject_entry(record, version))
+            records[subject_record_key(subjects[-1])] = record
+    return ({'version': version,
+             'subjects': sorted(subjects),
+             'courses': sorted(courses)},
+            records, replaced)
+
+
+@contextmanager
+def _locked(wait=None):
+    """
+    Изменения снимка выполняются по очереди всеми процессами всех
+    серверов: блокировка - ключ в общем кеше. Если ее не удалось
+    получить за wait (по умолчанию LOCK_WAIT) секунд, выбрасывается
+    CatalogLockTimeout.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + (LOCK_WAIT if wait is None else wait)
+    while not cache.add(LOCK_KEY, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise CatalogLockTimeout('Catalog snapshot lock timed out')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+@contextmanager
+def _file_locked():
+    """ Копию на диске процессы одного сервера пишут по очереди """
+    with open(settings.CATALOG_SNAPSHOT_PATH + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _file_version():
+    try:
+        with open(settings.CATALOG_SNAPSHOT_PATH) as f:
+            return int(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def _read_file():
+    """ (индекс, записи) из копии на диске или None """
+    try:
+        with open(settings.CATALOG_SNAPSHOT_PATH) as f:
+            f.readline()
+            data = json.load(f)
+        return data['index'], data['records']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_file(snapshot):
+    """
+    Первая строка файла - версия снимка: ее можно проверить, не читая
+    файл целиком. Более новую копию файл не заменяет.
+    """
+    path = settings.CATALOG_SNAPSHOT_PATH
+    with _file_locked():
+        version = _file_version()
+        if version is not None and version >= snapshot.version:
+            return
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write('{}\n'.format(snapshot.version))
+            json.dump({'index': snapshot.index,
+                       'records': snapshot.records},
+                      f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+
+def _save_file(snapshot):
+    try:
+        _write_file(snapshot)
+    except OSError:
+        logger.exception('Catalog snapshot file write failed')
+
+
+def _get_index(version):
+    compressed = cache.get(INDEX_KEY.format(version))
+    if compressed is None:
+        return None
+    return json.loads(zlib.decompress(compressed))
+
+
+def _load_records(index):
+    """
+    Записи снимка: из предыдущего снимка процесса, затем из кеша.
+    Вытесненные из кеша записи перечитываются из базы и возвращаются
+    в кеш.
+    """
+    known = _current.records if _current is not None else {}
+    keys = [subject_record_key(entry) for entry in index['subjects']] + \
+        [course_record_key(entry) for entry in index['courses']]
+    records = {key: known[key] for key in keys if key in known}
+    missing = [key for key in keys if key not in records]
+    if missing:
+        records.update(cache.get_many(missing))
+    lost = set(missing) - set(records)
+    if lost:
+        subject_ids = {entry[1]: subject_record_key(entry)
+                       for entry in index['subjects']
+                       if subject_record_key(entry) in lost}
+        course_ids = {entry[1]: course_record_key(entry)
+                      for entry in index['courses']
+                      if course_record_key(entry) in lost}
+        found = {}
+        for subject in Subject.objects.filter(pk__in=subject_ids):
+            found[subject_ids[subject.pk]] = _subject_record(subject)
+        for record in _course_records(Course.objects.filter(
+                pk__in=course_ids)):
+            found[course_ids[record['id']]] = record
+        cache.set_many(found, None)
+        records.update(found)
+    return records
+
+
+def _use(index, records=None):
+    """
+    Делает снимок текущим для процесса. Файл на диске здесь не
+    пишется: его переписывают только полные построения снимка.
+    """
+    global _current, _cache_failed_at
+    if records is None:
+        records = _load_records(index)
+    _current = Catalog(index, records)
+    _cache_failed_at = None
+    return _current
+
+
+def _publish(index, records, replaced=()):
+    """
+    Записи кладутся в кеш раньше индекса, индекс - раньше версии:
+    процессы, увидевшие новую версию, находят все ее части
+    """
+    cache.set_many(records, None)
+    cache.set(INDEX_KEY.format(index['version']),
+              zlib.compress(json.dumps(index, separators=(',', ':'))
+                            .encode()), None)
+    previous = cache.get(VERSION_KEY)
+    cache.set(VERSION_KEY, index['version'], None)
+    # процессы, читающие прежнюю версию, перечитают недостающее из базы
+    stale = list(replaced)
+    if previous is not None and previous != index['version']:
+        stale.append(INDEX_KEY.format(previous))
+    cache.delete_many(stale)
+
+
+def _restore():
+    """
+    Снимок при пустом кеше. Копия на диске могла отстать от базы, если
+    этот сервер не видел последних изменений, поэтому после нее
+    снимок перестраивается фоновой задачей.
+    """
+    version = cache.get(VERSION_KEY)
+    index = _get_index(version) if version is not None else None
+    if index is not None:
+        # снимок восстановил другой процесс, пока мы ждали
+        return _use(index)
+    data = _read_file()
+    if data is not None:
+        index, records = data
+        _publish(index, records)
+        from .tasks import rebuild_catalog
+        rebuild_catalog.delay()
+        return _use(index, records)
+    index, records = build(_next_version(version or 0))
+    _publish(index, records)
+    snapshot = _use(index, records)
+    _save_file(snapshot)
+    return snapshot
+
+
+def _fallback():
+    """
+    Снимок, когда общий кеш недоступен или занят: копия процесса,
+    копия на диске или построение по базе данных без блокировки.
+    Общий кеш снова проверяется через CACHE_RETRY_INTERVAL секунд.
+    """
+    global _current, _cache_failed_at
+    _cache_failed_at = time.monotonic()
+    if _current is not None:
+        return _current
+    data = _read_file()
+    if data is None:
+        data = build(_next_version())
+        _current = Catalog(*data)
+        _save_file(_current)
+    else:
+        _current = Catalog(*data)
+    return _current
+
+
+def get_catalog():
+    """
+    Текущий снимок каталога. Обычно это копия в памяти процесса, версия
+    которой сверяется с кешем; при смене версии из кеша читаются индекс
+    и только измененные записи. При пустом кеше снимок берется из файла,
+    и только при его отсутствии строится по базе данных. Ошибки кеша
+    и блокировки не выбрасываются: снимок тогда дает _fallback().
+    """
+    current = _current
+    if current is not None and _cache_failed_at is not None and \
+            time.monotonic() - _cache_failed_at < CACHE_RETRY_INTERVAL:
+        return current
+    try:
+        version = cache.get(VERSION_KEY)
+        if current is not None and current.version == version:
+            return current
+        if version is not None:
+            index = _get_index(version)
+            if index is not None:
+                return _use(index)
+        with _locked():
+            return _restore()
+    except Exception:
+        logger.exception('Catalog snapshot cache is unavailable')
+        return _fallback()
+
+
+def rebuild():
+    """ Полное построение снимка, в фоновой задаче или команде """
+    with _locked(wait=LOCK_TIMEOUT):
+        previous = cache.get(VERSION_KEY)
+        old = _get_index(previous) if previous is not None else None
+        index, records = build(_next_version(previous or 0))
+        replaced = []
+        if old is not None:
+            replaced = [subject_record_key(entry)
+                        for entry in old['subjects']] + \
+                [course_record_key(entry) for entry in old['courses']]
+        _publish(index, records, replaced)
+        snapshot = _use(index, records)
+    _save_file(snapshot)
+    return snapshot
+
+
+def _apply():
+    subject_ids = getattr(_pending, 'subject_ids', set())
+    course_ids = getattr(_pending, 'course_ids', set())
+    if not subject_ids and not course_ids:
+        # уже применено вместе с изменениями, отложенными раньше
+        return
+    _pending.subject_ids, _pending.course_ids = set(), set()
+    try:
+        with _locked():
+            # изменения накладываются на снимок из общего кеша, а не на
+            # копию процесса или сервера
+            previous = cache.get(VERSION_KEY)
+            index = _get_index(previous) if previous is not None else None
+            if index is None:
+                # копия на диске может не знать об этих изменениях
+                _publish(*build(_next_version(previous or 0)))
+                return
+            _publish(*patch(index, _next_version(previous),
+                            subject_ids, course_ids))
+    except Exception:
+        # при сбое снимок перестраивается фоновой задачей, а до тех пор
+        # остается прежним
+        logger.exception('Catalog snapshot update failed')
+        from .tasks import rebuild_catalog
+        rebuild_catalog.delay()
+
+
+def refresh(subject_ids=(), course_ids=()):
+    """
+    Обновляет в снимке предметы и курсы после фиксации транзакции.
+    Изменения одной транзакции применяются вместе первым из отложенных
+    вызовов. Изменения отмененной транзакции будут перечитаны вместе
+    со следующими, что не меняет результата.
+    """
+    if not hasattr(_pending, 'course_ids'):
+        _pending.subject_ids, _pending.course_ids = set(), set()
+    _pending.subject_ids.update(subject_ids)
+    _pending.course_ids.update(course_ids)
+    transaction.on_commit(_apply)
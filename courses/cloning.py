@@ -0,0 +1,70 @@
+from django.db import transaction
+
+from .bulk import item_fields, bulk_insert, bulk_contents, after_bulk_insert
+from .loaders import load_content_items
+from .models import Course, Module, Content, Image
+
+
+def unique_slug(slug):
+    """ slug-copy, slug-copy-2, ... - первый свободный вариант """
+    base = '{}-copy'.format(slug)
+    taken = set(Course.objects.filter(slug__startswith=base)
+                .values_list('slug', flat=True))
+    candidate, number = base, 1
+    while candidate in taken:
+        number += 1
+        candidate = '{}-{}'.format(base, number)
+    return candidate
+
+
+def copy_item(item, owner_id):
+    """
+    Несохраненная копия объекта содержимого. Файлы не копируются: копия
+    ссылается на тот же файл хранилища. Сохраненный HTML не переносится
+    и будет сгенерирован для копии заново.
+    """
+    model = type(item)
+    copy = model(owner_id=owner_id)
+    for field in item_fields(model):
+        setattr(copy, field.attname, getattr(item, field.attname))
+    if isinstance(item, Image):
+        copy.derivatives = item.derivatives
+    return copy
+
+
+def clone_course(course, owner=None, title=None, slug=None):
+    """
+    Копирует курс с модулями, элементами Content и объектами содержимого
+    в одной транзакции. Число запросов не зависит от размера курса:
+    по одному bulk_create на модель.
+    """
+    owner_id = owner.pk if owner is not None else course.owner_id
+    with transaction.atomic():
+        clone = Course(subject_id=course.subject_id, owner_id=owner_id,
+                       title=title or course.title,
+                       slug=slug or unique_slug(course.slug),
+                       overview=course.overview)
+        bulk_insert(Course, [clone])
+
+        modules = list(Module.objects.filter(course=course)
+                       .order_by('order'))
+        module_copies = [Module(course=clone, title=module.title,
+                                description=module.description,
+                                order=module.order)
+                         for module in modules]
+        bulk_insert(Module, module_copies)
+        copy_ids = {module.pk: copy.pk
+                    for module, copy in zip(modules, module_copies)}
+
+        contents = list(Content.objects.filter(module__course=course)
+                        .order_by('module_id', 'order'))
+        load_content_items(contents)
+        content_copies = bulk_contents(
+            [(copy_ids[content.module_id], content.order,
+              copy_item(content.item, owner_id))
+             for content in contents if content.item is not None],
+            fresh=True)
+
+        after_bulk_insert([clone], module_copies, content_copies,
+                          derivatives=False)
+    return clone
@@ -0,0 +1,41 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Subject, Course, Module
+
+
+def _count(queryset, field):
+    """
+    Подзапрос с количеством строк queryset, связанных с текущей строкой
+    внешнего запроса через поле field
+    """
+    return Coalesce(Subquery(queryset.filter(**{field: OuterRef('pk')})
+                             .order_by()
+                             .values(field)
+                             .annotate(total=Count('*'))
+                             .values('total')), 0)
+
+
+def update_total_courses(subject_ids=None):
+    """ Пересчитывает Subject.total_courses одним UPDATE """
+    qs = Subject.objects.all()
+    if subject_ids is not None:
+        qs = qs.filter(pk__in=subject_ids)
+    return qs.update(total_courses=_count(Course.objects.all(), 'subject'))
+
+
+def update_total_modules(course_ids=None):
+    """ Пересчитывает Course.total_modules одним UPDATE """
+    qs = Course.objects.all()
+    if course_ids is not None:
+        qs = qs.filter(pk__in=course_ids)
+    return qs.update(total_modules=_count(Module.objects.all(), 'course'))
+
+
+def update_total_students(course_ids=None):
+    """ Пересчитывает Course.total_students одним UPDATE """
+    qs = Course.objects.all()
+    if course_ids is not None:
+        qs = qs.filter(pk__in=course_ids)
+    return qs.update(total_students=_count(
+        Course.students.through.objects.all(), 'course'))
@@ -1,30 +1,255 @@
-from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+import os
+from bisect import bisect_left
+from collections import defaultdict
+from functools import reduce
+from operator import or_
 
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Case, Max, Q, Value, When
+from django.db.models.fields.files import FieldFile
 
-class OrderField(models.PositiveIntegerField):
+# Шаг между соседними порядковыми номерами. Промежутки позволяют
+# переместить объект, изменив номер только у него самого.
+ORDER_GAP = 1024
 
-    def __init__(self, for_fields=None, *args, **kwargs):
+
+def _longest_increasing(values):
+    """
+    Индексы самой длинной строго возрастающей подпоследовательности values
+    """
+    tails, tail_indexes, parents = [], [], [None] * len(values)
+    for i, value in enumerate(values):
+        pos = bisect_left(tails, value)
+        if pos:
+            parents[i] = tail_indexes[pos - 1]
+        if pos == len(tails):
+            tails.append(value)
+            tail_indexes.append(i)
+        else:
+            tails[pos] = value
+            tail_indexes[pos] = i
+    result = []
+    i = tail_indexes[-1] if tail_indexes else None
+    while i is not None:
+        result.append(i)
+        i = parents[i]
+    return result[::-1]
+
+
+class OrderField(models.PositiveBigIntegerField):
+    """
+    Порядковый номер объекта в рамках значений полей for_fields.
+
+    Номера выдаются счетчиком OrderCounter атомарно, без чтения последнего
+    объекта, поэтому параллельные вставки не получают одинаковых номеров.
+    Счетчик только растет (каждое перемещение в конец занимает новые
+    номера), поэтому номер, как и счетчик, - 64-битное число.
+    """
+
+    def __init__(self, for_fields=None, gap=ORDER_GAP, *args, **kwargs):
         self.for_fields = for_fields
+        self.gap = gap
         super(OrderField, self).__init__(*args, **kwargs)
 
+    def get_scope_filter(self, model_instance):
+        """
+        Значения полей for_fields объекта. Берем значения столбцов
+        (course_id, а не course), чтобы не загружать связанные объекты.
+        """
+        return {self.model._meta.get_field(field).attname:
+                getattr(model_instance,
+                        self.model._meta.get_field(field).attname)
+                for field in self.for_fields or []}
+
+    def get_scope(self, scope_filter):
+        """ Имя счетчика для набора объектов с одинаковыми for_fields """
+        return '{}.{}:{}'.format(
+            self.model._meta.label_lower, self.attname,
+            ','.join('{}={}'.format(field, value)
+                     for field, value in sorted(scope_filter.items())))
+
+    def delete_counters(self, scope_filters):
+        """ Удаляет счетчики наборов объектов, например удаленного курса """
+        OrderCounter = apps.get_model('courses', 'OrderCounter')
+        OrderCounter.objects.filter(scope__in=[
+            self.get_scope(scope_filter) for scope_filter in scope_filters
+        ]).delete()
+
+    def reserve(self, scope_filter, count=1):
+        """
+        Резервирует count порядковых номеров подряд и возвращает первый.
+        Для bulk_create весь блок резервируется одним запросом.
+        """
+        OrderCounter = apps.get_model('courses', 'OrderCounter')
+
+        def initial():
+            # Счетчика еще нет: продолжаем после уже существующих объектов
+            last = self.model._base_manager.filter(**scope_filter)\
+                .aggregate(last=Max(self.attname))['last']
+            return 0 if last is None else last + self.gap
+
+        return OrderCounter.reserve(self.get_scope(scope_filter),
+                                    count * self.gap,
+                                    initial)
+
+    def assign(self, objs, fresh=False):
+        """
+        Назначает порядковые номера объектам без номера перед bulk_create:
+        один блок номеров на каждый набор for_fields.
+
+        fresh=True - наборы только что созданы (объекты нового модуля):
+        номера идут с нуля без обращения к счетчику, который при первом
+        использовании продолжит после них.
+        """
+        groups = defaultdict(list)
+        for obj in objs:
+            if getattr(obj, self.attname) is None:
+                scope_filter = self.get_scope_filter(obj)
+                groups[tuple(sorted(scope_filter.items()))].append(obj)
+        for scope_items, group in groups.items():
+            value = 0 if fresh else self.reserve(dict(scope_items),
+                                                 len(group))
+            for obj in group:
+                setattr(obj, self.attname, value)
+                value += self.gap
+        return objs
+
     def pre_save(self, model_instance, add):
         if getattr(model_instance, self.attname) is None:
-            # Значение пусто
-            try:
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    # Фильтруем  объекты с такими же значениями полей,
-                    # перечисленных в "for_fields"
-                    query = {field: getattr(model_instance, field)
-                             for field in self.for_fields}
-                    qs = qs.filter(**query)
-                # Получаем номер последнего объекта.
-                last_item = qs.latest(self.attname)
-                value = last_item.order + 1
-            except ObjectDoesNotExist:
-                value = 0
+            # Значение пусто: резервируем следующий номер
+            value = self.reserve(self.get_scope_filter(model_instance))
             setattr(model_instance, self.attname, value)
             return value
         else:
             return super(OrderField, self).pre_save(model_instance, add)
+
+    def _rerank(self, scope_filter, ranks):
+        """
+        Новые номера для объектов с текущими номерами ranks, перечисленных
+        в новом порядке. Объекты, которые уже стоят по возрастанию, номер не
+        меняют, остальные получают номера в промежутках между ними.
+        Если промежуток исчерпан, весь набор получает новые номера.
+        """
+        keep = set(_longest_increasing(ranks))
+        new_ranks = list(ranks)
+        i = 0
+        while i < len(ranks):
+            if i in keep:
+                i += 1
+                continue
+            # серия перемещенных объектов между двумя неподвижными
+            end = i
+            while end < len(ranks) and end not in keep:
+                end += 1
+            count = end - i
+            low = new_ranks[i - 1] if i else -1
+            if end < len(ranks):
+                step = (ranks[end] - low) // (count + 1)
+                if not step:
+                    # промежуток исчерпан: перенумеровываем весь набор
+                    start = self.reserve(scope_filter, len(ranks))
+                    return [start + n * self.gap for n in range(len(ranks))]
+                first = low + step
+            else:
+                # хвост списка: берем новые номера у счетчика
+                step = self.gap
+                first = self.reserve(scope_filter, count)
+            for n in range(count):
+                new_ranks[i + n] = first + n * step
+            i = end
+        return new_ranks
+
+    def reorder(self, queryset, positions):
+        """
+        Применяет новый порядок {id: позиция} к объектам queryset одним
+        запросом UPDATE ... CASE. Позиции задают порядок переданных
+        объектов между собой: они занимают в наборе for_fields те же
+        места, что и раньше, остальные объекты набора остаются на своих
+        местах. Объекты вне queryset (например, чужие) не изменяются.
+
+        Возвращает идентификаторы измененных объектов и список
+        отклоненных идентификаторов. Если positions - не словарь целых
+        чисел, вызывает ValueError.
+        """
+        try:
+            requested = {int(pk): int(position)
+                         for pk, position in positions.items()}
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError('Expected {id: position} with integer values')
+
+        scope_fields = [self.model._meta.get_field(field).attname
+                        for field in self.for_fields or []]
+        with transaction.atomic(using=queryset.db):
+            queryset = queryset.select_for_update(of=('self',))
+            # права проверяются одним запросом для всего набора
+            rows = queryset.filter(pk__in=requested).order_by()\
+                .values_list('pk', *scope_fields)
+            found, scopes = set(), set()
+            for pk, *scope_values in rows:
+                found.add(pk)
+                scopes.add(tuple(zip(scope_fields, scope_values)))
+            rejected = sorted(set(requested) - found)
+            if not scopes:
+                return [], rejected
+
+            # остальные объекты тех же наборов, в текущем порядке
+            groups = defaultdict(list)
+            rows = queryset.filter(reduce(or_, [Q(**dict(scope_items))
+                                                for scope_items in scopes]))\
+                .order_by(*scope_fields, self.attname, 'pk')\
+                .values_list('pk', self.attname, *scope_fields)
+            for pk, rank, *scope_values in rows:
+                groups[tuple(zip(scope_fields, scope_values))].append(
+                    (pk, rank))
+
+            changes = {}
+            for scope_items, group in groups.items():
+                ranks = dict(group)
+                moved = iter(sorted((pk for pk, _ in group if pk in found),
+                                    key=lambda pk: (requested[pk],
+                                                    ranks[pk], pk)))
+                order = [next(moved) if pk in found else pk
+                         for pk, _ in group]
+                new_ranks = self._rerank(dict(scope_items),
+                                         [ranks[pk] for pk in order])
+                for pk, new_rank in zip(order, new_ranks):
+                    if ranks[pk] != new_rank:
+                        changes[pk] = new_rank
+            if changes:
+                self.model._base_manager.using(queryset.db)\
+                    .filter(pk__in=changes)\
+                    .update(**{self.attname: Case(
+                        *[When(pk=pk, then=Value(rank))
+                          for pk, rank in changes.items()],
+                        output_field=self)})
+        return list(changes), rejected
+
+
+class MediaFieldFile(FieldFile):
+    """
+    Файл объекта File или Image. При сохранении запоминает исходное имя
+    загруженного файла в поле filename объекта, а в _reserved_file_name -
+    имя, на которое хранилище уже добавило ссылку Blob
+    (см. ContentAddressableStorage).
+    """
+
+    def save(self, name, content, save=True):
+        from .models import Blob
+        from .storage import storage_is_blob
+
+        instance = self.instance
+        reserved = getattr(instance, '_reserved_file_name', None)
+        if reserved:
+            # файл заменен до сохранения объекта
+            Blob.release(reserved, self.storage)
+        instance.filename = os.path.basename(name)
+        super(MediaFieldFile, self).save(name, content, save=False)
+        instance._reserved_file_name = \
+            self.name if storage_is_blob(self.storage, self.name) else None
+        if save:
+            instance.save()
+
+
+class MediaFileField(models.FileField):
+    attr_class = MediaFieldFile
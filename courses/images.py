@@ -0,0 +1,53 @@
+import os
+
+# Ширины уменьшенных копий изображений
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+DERIVATIVE_QUALITY = 80
+
+
+def derivative_name(name, width):
+    """
+    Имя уменьшенной копии рядом с оригиналом:
+    images/photo.jpg -> images/photo.640w.webp
+    """
+    return '{}.{}w.webp'.format(os.path.splitext(name)[0], width)
+
+
+def make_derivatives(path, widths=DERIVATIVE_WIDTHS):
+    """
+    Создает WebP-копии изображения path для ширин меньше исходной.
+    Выполняется обработчиком фоновых задач и не обращается к Django.
+    Возвращает список созданных ширин.
+    """
+    from PIL import Image as PILImage
+
+    created = []
+    with PILImage.open(path) as original:
+        mode = 'RGBA' if 'A' in original.getbands() else 'RGB'
+        for width in sorted(widths):
+            if width >= original.width:
+                break
+            height = max(round(original.height * width / original.width), 1)
+            resized = original.convert(mode).resize((width, height),
+                                                    PILImage.LANCZOS)
+            target = derivative_name(path, width)
+            if os.path.exists(target):
+                # имена детерминированы: копия этого файла уже есть
+                created.append(width)
+                continue
+            # одинаковые файлы могут обрабатываться одновременно
+            tmp_target = '{}.{}.tmp'.format(target, os.getpid())
+            resized.save(tmp_target, 'WEBP', quality=DERIVATIVE_QUALITY)
+            os.replace(tmp_target, target)
+            created.append(width)
+    return created
+
+
+def schedule_derivatives(image):
+    """
+    Ставит создание уменьшенных копий изображения в очередь фоновых
+    задач. Запрос, сохранивший изображение, не ждет их создания: до тех
+    пор страница использует оригинал.
+    """
+    from .tasks import make_image_derivatives
+    return make_image_derivatives.delay(image.pk, image.file.name)
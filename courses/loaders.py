@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import prefetch_related_objects
+
+from .models import Content
+
+
+def load_content_items(contents):
+    """
+    Загружает объекты содержимого (Text, Video, Image, File) для набора
+    объектов Content.
+
+    Объекты группируются по content_type, и каждая модель получается одним
+    запросом IN. Результат кладется в кеш GenericForeignKey, поэтому
+    обращение к content.item больше не выполняет запросов.
+    """
+    contents = list(contents)
+    ids_by_type = defaultdict(set)
+    for content in contents:
+        ids_by_type[content.content_type_id].add(content.object_id)
+
+    items = {}
+    for content_type_id, ids in ids_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        for item in model._base_manager.filter(pk__in=ids):
+            items[content_type_id, item.pk] = item
+
+    item_field = Content._meta.get_field('item')
+    for content in contents:
+        item = items.get((content.content_type_id, content.object_id))
+        if item is not None:
+            item_field.set_cached_value(content, item)
+    return contents
+
+
+def load_module_contents(modules):
+    """
+    Загружает содержимое модулей вместе с объектами содержимого.
+    После вызова module.contents.all() не выполняет запросов.
+    """
+    modules = list(modules)
+    prefetch_related_objects(modules, 'contents')
+    load_content_items(content
+                       for module in modules
+                       for content in module.contents.all())
+    return modules
+
+
+def load_course_contents(course):
+    """
+    Загружает все модули курса, их содержимое и объекты содержимого
+    фиксированным числом запросов.
+    """
+    prefetch_related_objects([course], 'modules')
+    load_module_contents(course.modules.all())
+    return course
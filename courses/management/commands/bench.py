@@ -0,0 +1,149 @@
+import json
+import os
+import random
+import tempfile
+import uuid
+
+from django import get_version
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, \
+    setup_test_environment, teardown_test_environment
+
+from courses.benchmark import seed, get_scenarios, run_scenario, compare
+
+
+class Command(BaseCommand):
+    """
+    Замеряет основные страницы и API на синтетических данных в отдельной
+    тестовой базе. Ключи кеша получают собственный префикс, снимок
+    каталога пишется во временный файл, рабочие данные и кеш
+    не затрагиваются:
+
+    python manage.py bench --output bench.json
+    python manage.py bench --baseline bench.json --threshold 0.2
+
+    """
+
+    help = 'Benchmarks the hot views on a synthetic dataset and compares ' \
+           'the results with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=5)
+        parser.add_argument('--courses', type=int, default=20,
+                            help='Courses per subject')
+        parser.add_argument('--modules', type=int, default=8,
+                            help='Modules per course')
+        parser.add_argument('--contents', type=int, default=3,
+                            help='Contents of each type per module')
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--enrollments', type=int, default=5,
+                            help='Courses per student')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--scenario', dest='scenarios',
+                            action='append',
+                            help='Run only this scenario, can be repeated')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write JSON results to file')
+        parser.add_argument('--baseline',
+                            help='JSON results to compare against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 latency growth, 0.2 = 20%%')
+        parser.add_argument('--query-threshold', dest='query_threshold',
+                            type=int, default=0,
+                            help='Allowed growth of queries per request')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        cache = caches['default']
+        old_prefix = cache.key_prefix
+        cache.key_prefix = 'bench-{}'.format(uuid.uuid4().hex[:8])
+        # снимок каталога тестовой базы не заменяет рабочий. API
+        # проверяет пароль BasicAuthentication в каждом запросе: с PBKDF2
+        # замер показывал бы время хеширования, а не работу страницы
+        snapshot_dir = tempfile.TemporaryDirectory()
+        bench_settings = override_settings(
+            CATALOG_SNAPSHOT_PATH=os.path.join(snapshot_dir.name,
+                                               'catalog.json'),
+            PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher'])
+        bench_settings.enable()
+        try:
+            results = self.run(options)
+        finally:
+            bench_settings.disable()
+            snapshot_dir.cleanup()
+            cache.key_prefix = old_prefix
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'django': get_version(),
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'dataset': {key: options[key] for key in (
+                    'subjects', 'courses', 'modules', 'contents',
+                    'students', 'enrollments', 'seed')},
+                'iterations': options['iterations'],
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        self.print_table(results)
+
+        if baseline is not None:
+            if baseline['meta']['dataset'] != report['meta']['dataset']:
+                self.stderr.write('Warning: the baseline was measured on '
+                                  'a different dataset')
+            regressions = compare(results, baseline['results'],
+                                  options['threshold'],
+                                  options['query_threshold'])
+            if regressions:
+                raise CommandError('Regressions against {}:\n{}'.format(
+                    options['baseline'], '\n'.join(regressions)))
+            self.stderr.write('No regressions against {}'.format(
+                options['baseline']))
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        owner, student, courses = seed(
+            options['subjects'], options['courses'], options['modules'],
+            options['contents'], options['students'],
+            options['enrollments'], rng)
+        results = {}
+        for scenario in get_scenarios(owner, student, courses, rng):
+            if options['scenarios'] and \
+                    scenario.name not in options['scenarios']:
+                continue
+            results[scenario.name] = run_scenario(
+                scenario, options['iterations'], options['warmup'])
+            self.stderr.write('{:<24} p50 {:>8.2f} ms'.format(
+                scenario.name, results[scenario.name]['p50_ms']))
+        return results
+
+    def print_table(self, results):
+        self.stderr.write('{:<24} {:>9} {:>9} {:>9} {:>8} {:>6}'.format(
+            'scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'hits'))
+        for name, result in results.items():
+            self.stderr.write(
+                '{:<24} {:>9.2f} {:>9.2f} {:>9.2f} {:>8} {:>6}'.format(
+                    name, result['p50_ms'], result['p95_ms'],
+                    result['p99_ms'], result['queries_max'],
+                    '-' if result['cache_hit_rate'] is None
+                    else '{:.0%}'.format(result['cache_hit_rate'])))
@@ -0,0 +1,103 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from courses.images import DERIVATIVE_WIDTHS, derivative_name
+from courses.models import Image, File, Blob
+from courses.storage import ContentAddressableStorage, file_digest
+
+
+class Command(BaseCommand):
+    """
+    Переносит файлы, загруженные до включения хранилища с адресацией
+    по содержимому, под имена-хеши. Одинаковые файлы остаются в одном
+    экземпляре, счетчики ссылок Blob пересчитываются:
+
+    python manage.py dedupe_media --dry-run
+
+    """
+
+    help = 'Moves uploaded files into the content-addressable storage ' \
+           'and removes duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', dest='dry_run',
+                            action='store_true',
+                            help='Only report the space to be freed')
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not isinstance(storage, ContentAddressableStorage):
+            raise CommandError('DEFAULT_FILE_STORAGE is not '
+                               'ContentAddressableStorage')
+        dry_run = options['dry_run']
+        moved = freed = 0
+        seen = set()
+        # старое имя -> имя-хеш: одно имя может быть у нескольких объектов,
+        # например у копий курса, сделанных до переноса
+        blobs = {}
+        for model in (File, Image):
+            legacy = model.objects.exclude(file='')\
+                .exclude(file__startswith=storage.prefix + '/')\
+                .order_by().values_list('file', flat=True).distinct()
+            # имена читаются целиком до UPDATE тех же строк
+            for old_name in list(legacy):
+                name = blobs.get(old_name)
+                if name is None:
+                    if not storage.exists(old_name):
+                        self.stderr.write('Missing file {}'.format(old_name))
+                        continue
+                    with storage.open(old_name) as f:
+                        name = storage.blob_name(file_digest(f), old_name)
+                    if name in seen or storage.exists(name):
+                        freed += storage.size(old_name)
+                    seen.add(name)
+                    blobs[old_name] = name
+                    moved += 1
+                    if not dry_run:
+                        self.move(storage, old_name, name, model is Image)
+                if not dry_run:
+                    # update() не вызывает сигналы: ссылки на каждый
+                    # объект считаются ниже
+                    model.objects.filter(file=old_name).update(file=name)
+        if not dry_run:
+            self.recount(storage)
+        self.stdout.write('{} {} files, {} bytes {}'.format(
+            'Would move' if dry_run else 'Moved', moved, freed,
+            'to be freed' if dry_run else 'freed'))
+
+    def move(self, storage, old_name, name, derivatives):
+        pairs = [(old_name, name)]
+        if derivatives:
+            pairs += [(derivative_name(old_name, width),
+                       derivative_name(name, width))
+                      for width in DERIVATIVE_WIDTHS]
+        for source, target in pairs:
+            if not storage.exists(source):
+                continue
+            if storage.exists(target):
+                storage.delete(source)
+            else:
+                os.makedirs(os.path.dirname(storage.path(target)),
+                            exist_ok=True)
+                os.replace(storage.path(source), storage.path(target))
+
+    def recount(self, storage):
+        """ Пересчитывает число ссылок на каждый файл-хеш """
+        counts = {}
+        for model in (File, Image):
+            rows = model.objects\
+                .filter(file__startswith=storage.prefix + '/')\
+                .values_list('file').annotate(count=Count('pk'))
+            for name, count in rows.iterator():
+                counts[name] = counts.get(name, 0) + count
+        for blob in Blob.objects.iterator():
+            if blob.references != counts.get(blob.name, 0):
+                Blob.objects.filter(name=blob.name)\
+                    .update(references=counts.get(blob.name, 0))
+            counts.pop(blob.name, None)
+        Blob.objects.bulk_create([Blob(name=name, references=count)
+                                  for name, count in counts.items()],
+                                 batch_size=500)
@@ -0,0 +1,92 @@
+import json
+import sys
+import tarfile
+import tempfile
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from courses.models import Course
+from courses.transfer import export_records, media_names
+
+
+class Command(BaseCommand):
+    """
+    Выгружает курсы с модулями и содержимым в JSON Lines, по курсу на
+    строку, или в архив tar с файлами содержимого:
+
+    python manage.py export_courses -o courses.jsonl --subject math
+    python manage.py export_courses -o courses.tar.gz
+
+    """
+
+    help = 'Exports courses with modules and contents as JSON Lines ' \
+           'or a tar archive with media files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', dest='output', default='-',
+                            help='Output file, - for stdout')
+        parser.add_argument('--format', dest='format',
+                            choices=['jsonl', 'tar'],
+                            help='Defaults to tar for .tar, .tar.gz and '
+                                 '.tgz outputs, jsonl otherwise')
+        parser.add_argument('--subject', dest='subjects', action='append',
+                            help='Subject slug, can be repeated')
+        parser.add_argument('--course', dest='courses', action='append',
+                            help='Course slug, can be repeated')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=100)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        fmt = options['format'] or (
+            'tar' if output.endswith(('.tar', '.tar.gz', '.tgz'))
+            else 'jsonl')
+        courses = Course.objects.all()
+        if options['subjects']:
+            courses = courses.filter(subject__slug__in=options['subjects'])
+        if options['courses']:
+            courses = courses.filter(slug__in=options['courses'])
+        records = export_records(courses, options['batch_size'])
+
+        if fmt == 'jsonl':
+            if output == '-':
+                count = self.write_jsonl(records, sys.stdout)
+            else:
+                with open(output, 'w') as f:
+                    count = self.write_jsonl(records, f)
+            self.stderr.write('Exported {} courses'.format(count))
+            return
+
+        media = set()
+        with tempfile.TemporaryFile('w+b') as jsonl:
+            count = self.write_jsonl(records, jsonl, media)
+            mode = 'w:gz' if output.endswith(('.gz', '.tgz')) else 'w'
+            with tarfile.open(output if output != '-' else None, mode,
+                              fileobj=sys.stdout.buffer
+                              if output == '-' else None) as tar:
+                info = tarfile.TarInfo('courses.jsonl')
+                info.size = jsonl.tell()
+                jsonl.seek(0)
+                tar.addfile(info, jsonl)
+                for name in sorted(media):
+                    if not default_storage.exists(name):
+                        self.stderr.write('Missing file {}'.format(name))
+                        continue
+                    info = tarfile.TarInfo('media/' + name)
+                    info.size = default_storage.size(name)
+                    with default_storage.open(name) as f:
+                        tar.addfile(info, f)
+        self.stderr.write('Exported {} courses and {} files'.format(
+            count, len(media)))
+
+    def write_jsonl(self, records, f, media=None):
+        count = 0
+        binary = 'b' in getattr(f, 'mode', '')
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False) + '\n'
+            f.write(line.encode('utf-8') if binary else line)
+            if media is not None:
+                media.update(media_names(record))
+            count += 1
+        return count
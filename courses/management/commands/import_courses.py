@@ -0,0 +1,98 @@
+import io
+import json
+import sys
+import tarfile
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.models import Blob, File as FileItem, Image
+from courses.storage import storage_is_blob
+from courses.transfer import Importer
+
+
+class Command(BaseCommand):
+    """
+    Загружает курсы, выгруженные export_courses. Файлы содержимого из
+    архива сохраняются в хранилище до создания курсов, файлы пропущенных
+    курсов затем удаляются. Курсы с уже существующим slug пропускаются:
+
+    python manage.py import_courses courses.tar.gz --owner teacher
+
+    """
+
+    help = 'Imports courses exported by export_courses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='JSON Lines file or tar archive, '
+                                 '- for JSON Lines on stdin')
+        parser.add_argument('--owner', dest='owner',
+                            help='Username to own all imported courses '
+                                 'and contents')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=100)
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError('Unknown user {}'.format(options['owner']))
+
+        path = options['path']
+        try:
+            if path != '-' and tarfile.is_tarfile(path):
+                with tarfile.open(path) as tar:
+                    media_map = self.import_media(tar)
+                    try:
+                        member = tar.extractfile('courses.jsonl')
+                        importer = self.run(
+                            io.TextIOWrapper(member, 'utf-8'),
+                            owner, media_map, options)
+                    finally:
+                        self.release_media(media_map)
+            elif path == '-':
+                importer = self.run(sys.stdin, owner, {}, options)
+            else:
+                with open(path, encoding='utf-8') as f:
+                    importer = self.run(f, owner, {}, options)
+        except User.DoesNotExist as e:
+            raise CommandError('{}, use --owner'.format(e))
+        self.stdout.write('Imported {} courses, skipped {} existing'.format(
+            importer.imported, importer.skipped))
+
+    def run(self, lines, owner, media_map, options):
+        importer = Importer(owner=owner, media_map=media_map,
+                            batch_size=options['batch_size'])
+        importer.run(json.loads(line) for line in lines if line.strip())
+        return importer
+
+    def import_media(self, tar):
+        """ Сохраняет файлы архива, возвращает {имя в архиве: имя} """
+        media_map = {}
+        for member in tar:
+            if not member.isfile() or not member.name.startswith('media/'):
+                continue
+            name = member.name[len('media/'):]
+            media_map[name] = default_storage.save(
+                name, File(tar.extractfile(member), name))
+        return media_map
+
+    def release_media(self, media_map):
+        """
+        Убирает ссылки, которые хранилище добавило при сохранении файлов
+        архива. На файлы пропущенных курсов больше ничто не ссылается,
+        и они удаляются. Одинаковые файлы архива сохраняются в один blob,
+        и каждое сохранение добавляет ссылку, поэтому ссылка снимается
+        для каждого файла архива.
+        """
+        for name in media_map.values():
+            if storage_is_blob(default_storage, name):
+                Blob.release(name, default_storage)
+            elif not FileItem.objects.filter(file=name).exists() and \
+                    not Image.objects.filter(file=name).exists():
+                default_storage.delete(name)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from courses.tasks import purge_uploads
+
+
+class Command(BaseCommand):
+    """
+    Удаляет брошенные загрузки частями и их временные файлы.
+    Запускается по расписанию, например из cron:
+
+    python manage.py purge_uploads
+    python manage.py purge_uploads --background
+
+    """
+
+    help = 'Deletes chunked uploads that received no data for ' \
+           'CHUNKED_UPLOAD_EXPIRE seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', dest='max_age', type=int,
+                            help='Seconds since the last chunk')
+        parser.add_argument('--background', dest='background',
+                            action='store_true',
+                            help='Queue the cleanup for run_workers')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = purge_uploads.delay(options['max_age'])
+            self.stdout.write('Queued job {}'.format(job.pk))
+            return
+        purged = purge_uploads(options['max_age'])
+        self.stdout.write('Deleted {} uploads'.format(purged))
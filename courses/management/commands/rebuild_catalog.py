@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from courses.catalog import rebuild
+
+
+class Command(BaseCommand):
+    """
+    Снимок каталога обновляется сигналами при изменении предметов,
+    курсов и модулей. Полное перестроение нужно после изменений
+    в обход ORM и после восстановления базы из резервной копии:
+
+    python manage.py rebuild_catalog
+
+    """
+
+    help = 'Rebuilds the catalog snapshot in the cache and on disk'
+
+    def handle(self, *args, **options):
+        snapshot = rebuild()
+        self.stdout.write('Catalog snapshot {}: {} subjects, {} courses'
+                          .format(snapshot.version, len(snapshot.subjects),
+                                  len(snapshot.courses)))
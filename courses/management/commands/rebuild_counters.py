@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from courses import catalog
+from courses.counters import update_total_courses, update_total_modules, \
+    update_total_students
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает денормализованные счетчики с нуля, например после
+    массового изменения данных в обход сигналов:
+
+    python manage.py rebuild_counters
+
+    """
+
+    help = 'Rebuilds Subject.total_courses, Course.total_modules ' \
+           'and Course.total_students from scratch'
+
+    def handle(self, *args, **options):
+        subjects = update_total_courses()
+        courses = update_total_modules()
+        update_total_students()
+        # счетчики входят в снимок каталога
+        catalog.rebuild()
+        self.stdout.write('Rebuilt counters for {} subjects and {} '
+                          'courses'.format(subjects, courses))
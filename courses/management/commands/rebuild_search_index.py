@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from courses.search import rebuild_index
+
+
+class Command(BaseCommand):
+    """
+    Индекс обновляется сигналами при сохранении объектов. Перестроение
+    нужно после первой установки и после массовых изменений в обход ORM:
+
+    python manage.py rebuild_search_index
+
+    """
+
+    help = 'Rebuilds the full-text search index of courses, modules ' \
+           'and text contents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=1000)
+
+    def handle(self, *args, **options):
+        total = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write('Indexed {} documents'.format(total))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import Text, Video, Image, File
+
+
+class Command(BaseCommand):
+    """
+    Запускается после выкладки измененных шаблонов содержимого,
+    чтобы не генерировать HTML при первых запросах. Заодно заполняет
+    данные видео, сохраненных до появления поля embed_url:
+
+    python manage.py render_contents
+
+    """
+
+    help = 'Regenerates stored HTML of content items whose template ' \
+           'or data changed since the last rendering'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', dest='chunk_size', type=int,
+                            default=500)
+
+    def handle(self, *args, **options):
+        total = 0
+        for model in (Text, Video, Image, File):
+            for item in model.objects.iterator(
+                    chunk_size=options['chunk_size']):
+                if model is Video and not item.embed_url:
+                    item.resolve_legacy()
+                if item.update_html():
+                    total += 1
+        self.stdout.write('Rendered {} items'.format(total))
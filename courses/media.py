@@ -0,0 +1,120 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, \
+    HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.static import was_modified_since
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Разбирает заголовок Range с одним диапазоном. Возвращает (start, end)
+    включительно, None если заголовка нет или он не поддерживается,
+    и False если диапазон не пересекается с файлом.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # последние N байт файла
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve_file(request, path, filename, as_attachment=False):
+    """
+    Отдает файл потоком с поддержкой If-Modified-Since и одного диапазона
+    Range. Используется, когда перед Django нет фронт-сервера.
+    """
+    stat = os.stat(path)
+    last_modified = http_date(stat.st_mtime)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    content_type = mimetypes.guess_type(filename)[0] or \
+        'application/octet-stream'
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range is not None and if_range and \
+            parse_http_date_safe(if_range) != int(stat.st_mtime):
+        # файл изменился с момента первого запроса: отдаем целиком
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+        return response
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(path, start, end - start + 1),
+            status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end,
+                                                            stat.st_size)
+        if as_attachment:
+            response['Content-Disposition'] = \
+                "attachment; filename*=utf-8''{}".format(quote(filename))
+    else:
+        response = FileResponse(open(path, 'rb'),
+                                content_type=content_type,
+                                as_attachment=as_attachment,
+                                filename=filename)
+    response['Last-Modified'] = last_modified
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve_media(request, storage, name, as_attachment=False,
+                filename=None):
+    """
+    Отдает загруженный файл после проверки прав. filename - имя файла
+    для браузера, по умолчанию последняя часть name.
+
+    Если настроен фронт-сервер, передача файла поручается ему через
+    X-Accel-Redirect (nginx) или X-Sendfile, и рабочий процесс uWSGI
+    освобождается сразу. Иначе файл отдается самим Django.
+    """
+    filename = filename or os.path.basename(name)
+    accel_url = getattr(settings, 'MEDIA_ACCEL_REDIRECT_URL', None)
+    sendfile_header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+    if accel_url or sendfile_header:
+        response = HttpResponse(
+            content_type=mimetypes.guess_type(filename)[0] or
+            'application/octet-stream')
+        if accel_url:
+            response['X-Accel-Redirect'] = accel_url + quote(name)
+        else:
+            response[sendfile_header] = storage.path(name)
+        if as_attachment:
+            response['Content-Disposition'] = \
+                "attachment; filename*=utf-8''{}".format(quote(filename))
+        return response
+    return serve_file(request, storage.path(name), filename, as_attachment)
@@ -1,7 +1,14 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404
 from django.urls import reverse
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import redirect
 
-from .models import Course
+from . import timing
+from .cache import resolve_course_slug
 
 
 def subdomain_course_middleware(get_response):
@@ -11,9 +18,12 @@ def subdomain_course_middleware(get_response):
     def middleware(request):
         host_parts = request.get_host().split('.')
         if len(host_parts) > 2 and host_parts[0] != 'www':
-            # Получение объекта курса по данным из URL.
-            course = get_object_or_404(Course, slug=host_parts[0])
-            course_url = reverse('courses:course_detail', args=[course.slug])
+            # Получение курса по данным из URL. Сопоставление slug -> id
+            # кешируется, в том числе для несуществующих курсов.
+            slug = host_parts[0]
+            if resolve_course_slug(slug) is None:
+                raise Http404('No Course matches the given query.')
+            course_url = reverse('courses:course_detail', args=[slug])
             # Перенаправление на страницу курса.
             url = '{}://{}{}'.format(request.scheme,
                                      '.'.join(host_parts[1:]),
@@ -24,3 +34,56 @@ def subdomain_course_middleware(get_response):
         return response
 
     return middleware
+
+
+class ServerTimingMiddleware:
+    """
+    Замеряет время запроса к БД, кешу, генерации шаблона ответа и
+    ItemBase.render. Результат отдается в заголовке Server-Timing
+    (в режиме отладки и сотрудникам) и накапливается по именам URL
+    для статистики timing_stats. Подключается первым в MIDDLEWARE.
+
+    Класс, а не функция: Django вызывает process_template_response
+    только у объектов middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        timing.instrument_caches()
+
+    def __call__(self, request):
+        timings = timing.RequestTimings()
+        timing._local.timings = timings
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timing.sql_wrapper))
+                response = self.get_response(request)
+        finally:
+            timing._local.timings = None
+        total = timings.total
+
+        match = request.resolver_match
+        name = match.view_name if match else 'unresolved'
+        timing.store.add(name, total, timings)
+        timing.logger.debug('%s %s', name, request.path, extra={
+            'view': name,
+            'duration': total,
+            'durations': timings.durations,
+            'counts': timings.counts,
+        })
+        if settings.DEBUG or getattr(request, 'user', None) is not None \
+                and request.user.is_staff:
+            response['Server-Timing'] = timings.header(total)
+        return response
+
+    def process_template_response(self, request, response):
+        # шаблон ответа генерируется после этого метода
+        timings = timing.current()
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: timings.add(
+                    'tpl', time.perf_counter() - started))
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 3.1 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_auto_20200905_1135'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='html_key',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='html_key',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='text',
+            name='html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='text',
+            name='html_key',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='html_key',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.1 on 2026-10-18 09:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count(queryset, field):
+    return Coalesce(Subquery(queryset.filter(**{field: OuterRef('pk')})
+                             .order_by()
+                             .values(field)
+                             .annotate(total=Count('*'))
+                             .values('total')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Subject = apps.get_model('courses', 'Subject')
+    Course = apps.get_model('courses', 'Course')
+    Module = apps.get_model('courses', 'Module')
+    Subject.objects.update(
+        total_courses=count(Course.objects.all(), 'subject'))
+    Course.objects.update(
+        total_modules=count(Module.objects.all(), 'course'),
+        total_students=count(Course.students.through.objects.all(),
+                             'course'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_auto_20261018_0949'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='total_modules',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='total_students',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='total_courses',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+def widen_order_columns(apps, schema_editor):
+    """
+    OrderField стал 64-битным. Исторические модели используют текущий
+    класс поля, поэтому старый тип столбца описываем явно.
+    """
+    for model_name in ('Module', 'Content'):
+        model = apps.get_model('courses', model_name)
+        old_field = models.PositiveIntegerField(blank=True, default=0)
+        old_field.set_attributes_from_name('order')
+        old_field.model = model
+        schema_editor.alter_field(model, old_field,
+                                  model._meta.get_field('order'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_auto_20261018_0950'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=200, unique=True)),
+                ('value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='module',
+            options={'ordering': ['order']},
+        ),
+        migrations.RunPython(widen_order_columns,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_auto_20261018_0951'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-created', 'id'], name='courses_cou_created_112d71_idx'),
+        ),
+    ]
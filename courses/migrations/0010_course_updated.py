@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0009_auto_20261018_0952'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
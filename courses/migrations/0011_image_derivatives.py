@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0010_course_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='derivatives',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
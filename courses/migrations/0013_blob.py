@@ -0,0 +1,41 @@
+# Generated by Django 3.1 on 2026-10-18 10:00
+
+import courses.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0012_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='filename',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='filename',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=courses.fields.MediaFileField(upload_to='files'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='file',
+            field=courses.fields.MediaFileField(upload_to='images'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0013_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='embed_url',
+            field=models.URLField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='provider',
+            field=models.CharField(blank=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='video_id',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
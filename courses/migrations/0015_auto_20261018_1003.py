@@ -0,0 +1,100 @@
+# Generated by Django 3.1 on 2026-10-18 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Полнотекстовый индекс строится средствами СУБД и не описывается моделью
+POSTGRESQL_INDEX = [
+    # PostgreSQL 12+: вектор пересчитывается самой СУБД при записи строки
+    """ALTER TABLE courses_searchdocument ADD COLUMN search_vector tsvector
+       GENERATED ALWAYS AS (
+           setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('simple',
+                                 left(coalesce(body, ''), 500000)), 'B')
+       ) STORED""",
+    """CREATE INDEX courses_searchdocument_vector
+       ON courses_searchdocument USING GIN (search_vector)""",
+]
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS courses_searchdocument_vector',
+    'ALTER TABLE courses_searchdocument DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_INDEX = [
+    # таблица FTS5 хранит только индекс, текст берется из documents
+    """CREATE VIRTUAL TABLE courses_searchdocument_fts USING fts5(
+           title, body,
+           content='courses_searchdocument', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2')""",
+    # совпадение в заголовке весит больше, чем в тексте
+    """INSERT INTO courses_searchdocument_fts(courses_searchdocument_fts, rank)
+       VALUES ('rank', 'bm25(10.0, 1.0)')""",
+    """CREATE TRIGGER courses_searchdocument_ai
+       AFTER INSERT ON courses_searchdocument BEGIN
+           INSERT INTO courses_searchdocument_fts(rowid, title, body)
+           VALUES (new.id, new.title, new.body);
+       END""",
+    """CREATE TRIGGER courses_searchdocument_ad
+       AFTER DELETE ON courses_searchdocument BEGIN
+           INSERT INTO courses_searchdocument_fts(
+               courses_searchdocument_fts, rowid, title, body)
+           VALUES ('delete', old.id, old.title, old.body);
+       END""",
+    """CREATE TRIGGER courses_searchdocument_au
+       AFTER UPDATE OF title, body ON courses_searchdocument BEGIN
+           INSERT INTO courses_searchdocument_fts(
+               courses_searchdocument_fts, rowid, title, body)
+           VALUES ('delete', old.id, old.title, old.body);
+           INSERT INTO courses_searchdocument_fts(rowid, title, body)
+           VALUES (new.id, new.title, new.body);
+       END""",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS courses_searchdocument_au',
+    'DROP TRIGGER IF EXISTS courses_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS courses_searchdocument_ai',
+    'DROP TABLE IF EXISTS courses_searchdocument_fts',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+create_index = run_for_vendor({'postgresql': POSTGRESQL_INDEX,
+                               'sqlite': SQLITE_INDEX})
+drop_index = run_for_vendor({'postgresql': POSTGRESQL_DROP,
+                             'sqlite': SQLITE_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0014_auto_20261018_1003'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=250)),
+                ('body', models.TextField(blank=True)),
+                ('content', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='courses.content')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='courses.course')),
+                ('module', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='courses.module')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(condition=models.Q(module=None), fields=('course',), name='search_course_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(condition=models.Q(content=None), fields=('module',), name='search_module_unique'),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,16 +1,65 @@
-from django.db import models
+import hashlib
+import os
+import sqlite3
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.template.loader import render_to_string
+from django.db.models import Case, F, Value, When
+from django.template.loader import get_template, render_to_string
+from django.urls import reverse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 
-from .fields import OrderField
+from .fields import MediaFileField, OrderField
+from .timing import timer
+from .video import get_resolver as get_video_resolver
+
+@lru_cache(maxsize=None)
+def template_digest(template_name):
+    """
+    Отпечаток исходного кода шаблона. Меняется вместе с шаблоном, поэтому
+    сохраненный HTML после выкладки нового шаблона считается устаревшим.
+    """
+    source = get_template(template_name).template.source
+    return hashlib.md5(source.encode('utf-8')).hexdigest()
+
+
+# служебные поля объектов содержимого, которые не выводятся в шаблонах
+HTML_SKIP_FIELDS = ('owner', 'created', 'updated', 'html', 'html_key')
+
+
+class CounterFieldsMixin(object):
+    """
+    Денормализованные счетчики меняются только через queryset.update()
+    (см. signals.py и counters.py). Обычное сохранение существующей
+    строки их не записывает, иначе значения из памяти объекта затерли бы
+    изменения, сделанные после его загрузки.
+    """
+    counter_fields = ()
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and \
+                kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields]
+        super(CounterFieldsMixin, self).save(*args, **kwargs)
 
-class Subject(models.Model):
+
+class Subject(CounterFieldsMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
+    # Счетчик курсов, поддерживается сигналами (см. signals.py)
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_courses',)
 
     class Meta:
         ordering = ['title']
@@ -19,7 +68,17 @@ class Subject(models.Model):
         return f'{self.title}'
 
 
-class Course(models.Model):
+class CourseQuerySet(models.QuerySet):
+
+    def touch(self):
+        """
+        Обновляет отметку изменения курсов. Вызывается при изменении
+        модулей и содержимого, которые входят в ответ API курса.
+        """
+        return self.update(updated=timezone.now())
+
+
+class Course(CounterFieldsMixin, models.Model):
     owner = models.ForeignKey(User,
                               related_name='courses_created',
                               on_delete=models.CASCADE)
@@ -30,16 +89,39 @@ class Course(models.Model):
     slug = models.SlugField(max_length=200, unique=True)
     overview = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    # время последнего изменения курса, его модулей или содержимого
+    updated = models.DateTimeField(auto_now=True)
     students = models.ManyToManyField(User,
                                       related_name='courses_joined',
                                       blank=True)
+    # Счетчики модулей и студентов, поддерживаются сигналами
+    total_modules = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CourseQuerySet.as_manager()
+    counter_fields = ('total_modules', 'total_students')
 
     class Meta:
         ordering = ['-created']
+        # ключ постраничного вывода курсов в API
+        indexes = [models.Index(fields=['-created', 'id'])]
 
     def __str__(self) -> str:
         return f'{self.title}'
 
+    def get_contents_etag(self, variant=''):
+        """
+        Версия содержимого курса для условных запросов к API. Учитывает
+        отметку изменения курса и шаблоны, по которым генерируется HTML.
+        variant различает ответы с разным набором полей.
+        """
+        key = '{}:{}:{}{}'.format(
+            self.pk, self.updated.isoformat(),
+            ':'.join(template_digest('courses/content/{}.html'.format(name))
+                     for name in ('text', 'video', 'image', 'file')),
+            ':' + variant if variant else '')
+        return '"{}"'.format(hashlib.md5(key.encode('utf-8')).hexdigest())
+
 
 class Module(models.Model):
     course = models.ForeignKey(Course,
@@ -49,8 +131,71 @@ class Module(models.Model):
     description = models.TextField(blank=True)
     order = OrderField(blank=True, for_fields=['course'])
 
+    class Meta:
+        ordering = ['order']
+
     def __str__(self) -> str:
-        return f'{self.order}. {self.title}'
+        # order - ранг с промежутками, а не номер модуля в курсе
+        return f'{self.title}'
+
+
+class OrderCounter(models.Model):
+    """
+    Счетчик порядковых номеров OrderField для одного набора объектов,
+    например модулей одного курса
+    """
+    scope = models.CharField(max_length=200, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.scope}: {self.value}'
+
+    @classmethod
+    def _increment(cls, scope, count, using):
+        """
+        Атомарно увеличивает счетчик и возвращает новое значение
+        или None, если счетчика еще нет
+        """
+        connection = connections[using]
+        if connection.vendor == 'postgresql' or (
+                connection.vendor == 'sqlite'
+                and sqlite3.sqlite_version_info >= (3, 35)):
+            # UPDATE ... RETURNING: один запрос без явной транзакции
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'UPDATE {table} SET {value} = {value} + %s '
+                    'WHERE {scope} = %s RETURNING {value}'.format(
+                        table=connection.ops.quote_name(cls._meta.db_table),
+                        value=connection.ops.quote_name('value'),
+                        scope=connection.ops.quote_name('scope')),
+                    [count, scope])
+                row = cursor.fetchone()
+            return row[0] if row else None
+        with transaction.atomic(using=using):
+            # UPDATE блокирует строку до конца транзакции,
+            # поэтому прочитанное значение принадлежит только нам
+            qs = cls.objects.using(using).filter(scope=scope)
+            if not qs.update(value=F('value') + count):
+                return None
+            return qs.values_list('value', flat=True).get()
+
+    @classmethod
+    def reserve(cls, scope, count, initial):
+        """
+        Резервирует count значений и возвращает первое из них.
+        initial() вызывается один раз, при создании счетчика.
+        """
+        using = router.db_for_write(cls)
+        value = cls._increment(scope, count, using)
+        if value is None:
+            start = initial()
+            counter, created = cls.objects.using(using).get_or_create(
+                scope=scope, defaults={'value': start + count})
+            if created:
+                return start
+            # счетчик успел создать параллельный запрос
+            value = cls._increment(scope, count, using)
+        return value - count
 
 
 class Content(models.Model):
@@ -81,6 +226,12 @@ class ItemBase(models.Model):
     title = models.CharField(max_length=200)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # HTML, сгенерированный по шаблону, и ключ, по которому
+    # проверяется его актуальность
+    html = models.TextField(blank=True, editable=False)
+    html_key = models.CharField(max_length=32, blank=True, editable=False)
+    # ключ значений полей на момент загрузки или последнего сохранения
+    _saved_html_key = None
 
     class Meta:
         abstract = True
@@ -88,12 +239,71 @@ class ItemBase(models.Model):
     def __str__(self) -> str:
         return f'{self.title}'
 
-    def render(self):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ItemBase, cls).from_db(db, field_names, values)
+        if len(values) == len(cls._meta.concrete_fields):
+            instance._saved_html_key = instance.get_html_key()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super(ItemBase, self).save(*args, **kwargs)
+        # HTML генерируется фоновой задачей, когда известны окончательные
+        # значения полей (например, имя загруженного файла). Задача
+        # ставится, только если изменилось то, что выводится в шаблоне.
+        key = self.get_html_key()
+        if key != self._saved_html_key:
+            self._saved_html_key = key
+            if key != self.html_key:
+                from .tasks import render_item
+                render_item.delay(self._meta.model_name, self.pk)
+
+    @property
+    def template_name(self):
+        return 'courses/content/{}.html'.format(self._meta.model_name)
+
+    def get_html_key(self):
+        """
+        Ключ актуальности HTML: отпечаток шаблона и значения полей,
+        которые выводятся в шаблоне
+        """
+        values = [template_digest(self.template_name)] + [
+            str(field.value_from_object(self))
+            for field in self._meta.concrete_fields
+            if field.name not in HTML_SKIP_FIELDS]
+        return hashlib.md5('\0'.join(values).encode('utf-8')).hexdigest()
+
+    def render_html(self):
         """
         Генерируем шаблон с контекстом и получаем результат в виде строки
         """
-        return render_to_string('courses/content/{}.html'.format(
-            self._meta.model_name), {'item': self})
+        return render_to_string(self.template_name, {'item': self})
+
+    def render(self):
+        """
+        Возвращает сохраненный HTML. Если объект или шаблон изменились
+        после последней генерации, шаблон генерируется заново, но
+        результат не сохраняется: запись - дело update_html().
+        """
+        if self.html_key == self.get_html_key():
+            return mark_safe(self.html)
+        with timer('item'):
+            return mark_safe(self.render_html())
+
+    def update_html(self):
+        """
+        Генерирует и сохраняет HTML, если он устарел. Вызывается задачей
+        render_item и командой render_contents. Возвращает True, если
+        HTML сгенерирован заново.
+        """
+        key = self.get_html_key()
+        if self.html_key == key:
+            return False
+        self.html, self.html_key = self.render_html(), key
+        # update() не меняет поле updated и не вызывает save()
+        type(self)._base_manager.filter(pk=self.pk).update(
+            html=self.html, html_key=self.html_key)
+        return True
 
 
 class Text(ItemBase):
@@ -101,12 +311,215 @@ class Text(ItemBase):
 
 
 class File(ItemBase):
-    file = models.FileField(upload_to='files')
+    file = MediaFileField(upload_to='files')
+    # имя загруженного файла: в хранилище файл назван по содержимому
+    filename = models.CharField(max_length=255, blank=True, editable=False)
 
 
 class Image(ItemBase):
-    file = models.FileField(upload_to='images')
+    file = MediaFileField(upload_to='images')
+    filename = models.CharField(max_length=255, blank=True, editable=False)
+    # ширины созданных уменьшенных копий через запятую
+    derivatives = models.CharField(max_length=100, blank=True,
+                                   editable=False)
+
+    def get_derivative_widths(self):
+        return [int(width) for width in self.derivatives.split(',')
+                if width]
+
+    @property
+    def srcset(self):
+        """ Значение атрибута srcset из уменьшенных копий """
+        url = reverse('courses:content_media', args=['image', self.id])
+        return ', '.join('{}?w={} {}w'.format(url, width, width)
+                         for width in self.get_derivative_widths())
 
 
 class Video(ItemBase):
     url = models.URLField()
+    # определяются по url при сохранении, чтобы не разбирать адрес
+    # и не обращаться к сервису видео при каждом выводе
+    provider = models.CharField(max_length=20, blank=True, editable=False)
+    video_id = models.CharField(max_length=100, blank=True, editable=False)
+    embed_url = models.URLField(blank=True, editable=False)
+    thumbnail_url = models.URLField(blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Video, cls).from_db(db, field_names, values)
+        instance._resolved_url = instance.__dict__.get('url')
+        return instance
+
+    def resolve(self):
+        """
+        Заполняет данные видео по url с помощью VIDEO_RESOLVER. Миниатюру
+        получает fetch_thumbnail() в задаче render_item.
+        """
+        info = get_video_resolver().resolve(self.url)
+        self.provider, self.video_id, self.embed_url = info or ('', '', '')
+        self.thumbnail_url = ''
+        self._resolved_url = self.url
+
+    def fetch_thumbnail(self):
+        """
+        Получает адрес миниатюры. Вызывается фоновой задачей, а не при
+        сохранении: бэкенд может обращаться к сервису видео.
+        """
+        if self.thumbnail_url or not self.video_id:
+            return
+        self.thumbnail_url = get_video_resolver().thumbnail(self.url)
+        if self.thumbnail_url:
+            # видео могли изменить, пока шел запрос
+            Video._base_manager.filter(pk=self.pk, url=self.url)\
+                .update(thumbnail_url=self.thumbnail_url)
+
+    def save(self, *args, **kwargs):
+        if self.url != getattr(self, '_resolved_url', None):
+            self.resolve()
+        super(Video, self).save(*args, **kwargs)
+
+    def resolve_legacy(self):
+        """
+        Заполняет данные видео, сохраненного до появления полей embed_url
+        и других. Вызывается командой render_contents, а не при выводе:
+        определение данных может обращаться к сервису видео.
+        """
+        self.resolve()
+        if not self.embed_url:
+            return
+        self.thumbnail_url = get_video_resolver().thumbnail(self.url)
+        # HTML сгенерирован без embed_url
+        self.html_key = ''
+        Video._base_manager.filter(pk=self.pk).update(
+            provider=self.provider, video_id=self.video_id,
+            embed_url=self.embed_url, thumbnail_url=self.thumbnail_url,
+            html_key=self.html_key)
+
+
+class SearchDocument(models.Model):
+    """
+    Текст курса, модуля или текстового содержимого для полнотекстового
+    поиска. Индекс строится средствами СУБД (см. courses.search).
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE,
+                               related_name='search_documents')
+    module = models.ForeignKey(Module, on_delete=models.CASCADE,
+                               null=True, blank=True,
+                               related_name='search_documents')
+    content = models.OneToOneField(Content, on_delete=models.CASCADE,
+                                   null=True, blank=True,
+                                   related_name='search_document')
+    title = models.CharField(max_length=250)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['course'], name='search_course_unique',
+                condition=models.Q(module=None)),
+            models.UniqueConstraint(
+                fields=['module'], name='search_module_unique',
+                condition=models.Q(content=None)),
+        ]
+
+    def __str__(self) -> str:
+        return self.title
+
+
+class Blob(models.Model):
+    """
+    Файл в хранилище с адресацией по содержимому и число объектов
+    File и Image, которые на него ссылаются
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    references = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.references})'
+
+    @classmethod
+    def acquire(cls, name, count=1):
+        """ Добавляет count ссылок на файл name """
+        if cls.objects.filter(name=name)\
+                .update(references=F('references') + count):
+            return
+        blob, created = cls.objects.get_or_create(
+            name=name, defaults={'references': count})
+        if not created:
+            cls.objects.filter(name=name)\
+                .update(references=F('references') + count)
+
+    @classmethod
+    def acquire_many(cls, counts):
+        """
+        Добавляет ссылки {имя: количество} одним UPDATE для уже
+        известных файлов
+        """
+        existing = set(cls.objects.filter(name__in=counts)
+                       .values_list('name', flat=True))
+        if existing:
+            cls.objects.filter(name__in=existing).update(
+                references=F('references') + Case(
+                    *[When(name=name, then=Value(counts[name]))
+                      for name in existing],
+                    output_field=models.PositiveIntegerField()))
+        for name in set(counts) - existing:
+            cls.acquire(name, counts[name])
+
+    @classmethod
+    def release(cls, name, storage):
+        """
+        Убирает ссылку на файл name. Файл без ссылок удаляется из
+        хранилища вместе с уменьшенными копиями после фиксации транзакции.
+        """
+        from .images import DERIVATIVE_WIDTHS, derivative_name
+
+        cls.objects.filter(name=name, references__gt=0)\
+            .update(references=F('references') - 1)
+
+        def delete_unused():
+            # файлы удаляются, пока удаленная строка заблокирована:
+            # ContentAddressableStorage.save ждет ее, прежде чем проверить,
+            # есть ли уже такой файл
+            with transaction.atomic():
+                if cls.objects.filter(name=name, references=0).delete()[0]:
+                    for path in [name] + [derivative_name(name, width)
+                                          for width in DERIVATIVE_WIDTHS]:
+                        storage.delete(path)
+
+        transaction.on_commit(delete_unused)
+
+
+class Upload(models.Model):
+    """
+    Загрузка файла частями. Принятые части дописываются во временный
+    файл, контрольная сумма CRC32 обновляется с каждой частью.
+    После завершения создается объект File или Image и его Content.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    owner = models.ForeignKey(User,
+                              related_name='uploads',
+                              on_delete=models.CASCADE)
+    module = models.ForeignKey(Module,
+                               related_name='uploads',
+                               on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=10,
+                                  choices=(('file', 'File'),
+                                           ('image', 'Image')))
+    title = models.CharField(max_length=200)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    checksum = models.PositiveBigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    # время приема последней части, по нему удаляются брошенные загрузки
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    @property
+    def path(self):
+        """ Временный файл с принятыми данными """
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, str(self.id))
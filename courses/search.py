@@ -0,0 +1,208 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Course, Module, Content, Text, SearchDocument
+
+# Индексы создаются миграцией 0015: в PostgreSQL - вычисляемый столбец
+# search_vector с индексом GIN, в SQLite - таблица FTS5 с триггерами
+FTS_TABLE = 'courses_searchdocument_fts'
+SEARCH_CONFIG = 'simple'
+
+
+def index_course(course):
+    SearchDocument.objects.update_or_create(
+        course=course, module=None,
+        defaults={'title': course.title, 'body': course.overview})
+
+
+def index_module(module):
+    # описание модуля видно только студентам курса, индексируется
+    # только общедоступное название
+    SearchDocument.objects.update_or_create(
+        module=module, content=None,
+        defaults={'course_id': module.course_id,
+                  'title': module.title,
+                  'body': ''})
+    # модуль мог перейти в другой курс вместе с содержимым
+    SearchDocument.objects.filter(module=module)\
+        .exclude(course_id=module.course_id)\
+        .update(course_id=module.course_id)
+
+
+def index_content(content):
+    """ Индексируется только текстовое содержимое """
+    if content.content_type_id != \
+            ContentType.objects.get_for_model(Text).pk:
+        return
+    text = content.item
+    if text is None:
+        return
+    SearchDocument.objects.update_or_create(
+        content=content,
+        defaults={'course_id': Module.objects.filter(pk=content.module_id)
+                  .values_list('course_id', flat=True).get(),
+                  'module_id': content.module_id,
+                  'title': text.title,
+                  'body': text.content})
+
+
+def update_text(text):
+    """ Обновляет документы всех элементов Content с этим текстом """
+    return SearchDocument.objects.filter(
+        content__content_type=ContentType.objects.get_for_model(Text),
+        content__object_id=text.pk)\
+        .update(title=text.title, body=text.content)
+
+
+def forget_text(text):
+    SearchDocument.objects.filter(
+        content__content_type=ContentType.objects.get_for_model(Text),
+        content__object_id=text.pk).delete()
+
+
+def _fts5_query(query):
+    # каждое слово в кавычках: пользовательский ввод не разбирается
+    # как синтаксис запросов FTS5
+    return ' '.join('"{}"'.format(word.replace('"', '""'))
+                    for word in query.split())
+
+
+def _visible_sql(user_id):
+    """
+    Условие WHERE на документы, которые может найти пользователь:
+    курсы и модули видны всем, тексты - только студентам и владельцу
+    курса.
+    """
+    if user_id is None:
+        return 'doc.content_id IS NULL', []
+    sql = 'doc.content_id IS NULL OR doc.course_id IN (' \
+          'SELECT course_id FROM {students} WHERE user_id = %s ' \
+          'UNION SELECT id FROM {courses} WHERE owner_id = %s)'.format(
+              students=Course.students.through._meta.db_table,
+              courses=Course._meta.db_table)
+    return sql, [user_id, user_id]
+
+
+def _ranked_ids(query, offset, limit, user_id=None):
+    """
+    Идентификаторы документов, подходящих под query и видимых
+    пользователю user_id, по убыванию релевантности. Ранжирование
+    и LIMIT выполняются в индексе СУБД.
+    """
+    using = router.db_for_read(SearchDocument)
+    connection = connections[using]
+    table = SearchDocument._meta.db_table
+    visible, visible_params = _visible_sql(user_id)
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT doc.id FROM {table} doc, ' \
+              'plainto_tsquery(%s, %s) query ' \
+              'WHERE doc.search_vector @@ query AND ({visible}) ' \
+              'ORDER BY ts_rank(doc.search_vector, query) DESC, doc.id ' \
+              'LIMIT %s OFFSET %s'.format(table=table, visible=visible)
+        params = [SEARCH_CONFIG, query] + visible_params + [limit, offset]
+    elif connection.vendor == 'sqlite':
+        sql = 'SELECT {fts}.rowid FROM {fts} ' \
+              'JOIN {table} doc ON doc.id = {fts}.rowid ' \
+              'WHERE {fts} MATCH %s AND ({visible}) ' \
+              'ORDER BY rank LIMIT %s OFFSET %s'.format(
+                  fts=FTS_TABLE, table=table, visible=visible)
+        params = [_fts5_query(query)] + visible_params + [limit, offset]
+    else:
+        # без полнотекстового индекса: простой поиск подстроки
+        documents = SearchDocument.objects.using(using)\
+            .filter(Q(title__icontains=query) | Q(body__icontains=query))
+        if user_id is None:
+            documents = documents.filter(content__isnull=True)
+        else:
+            documents = documents.filter(
+                Q(content__isnull=True) |
+                Q(course__in=Course.objects.filter(
+                    Q(students__id=user_id) | Q(owner_id=user_id))))
+        return list(documents.order_by('id')
+                    .values_list('id', flat=True)[offset:offset + limit])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(query, offset=0, limit=20, user=None):
+    """
+    Возвращает (документы, есть_еще) для страницы результатов поиска.
+    Тексты ищутся только в курсах, на которые пользователь user записан
+    или которые он ведет. Общее количество найденного не считается:
+    на больших индексах это дороже самого поиска.
+    """
+    query = query.strip()
+    if not query:
+        return [], False
+    user_id = user.pk if user is not None and user.is_authenticated \
+        else None
+    ids = _ranked_ids(query, offset, limit + 1, user_id)
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    documents = SearchDocument.objects\
+        .select_related('course', 'module')\
+        .only('title', 'content_id',
+              'course__title', 'course__slug',
+              'module__title')\
+        .in_bulk(ids)
+    return [documents[pk] for pk in ids if pk in documents], has_more
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Перестраивает индекс целиком. Объекты читаются потоком и
+    записываются пачками, поэтому память не зависит от объема данных.
+    """
+    SearchDocument.objects.all().delete()
+    total = 0
+
+    def flush(batch):
+        SearchDocument.objects.bulk_create(batch, batch_size=batch_size)
+        return len(batch)
+
+    batch = []
+    for course in Course.objects.only('title', 'overview')\
+            .iterator(chunk_size=batch_size):
+        batch.append(SearchDocument(course=course, title=course.title,
+                                    body=course.overview))
+        if len(batch) >= batch_size:
+            total += flush(batch)
+            batch = []
+    for module in Module.objects.only('course_id', 'title')\
+            .iterator(chunk_size=batch_size):
+        batch.append(SearchDocument(course_id=module.course_id,
+                                    module=module, title=module.title))
+        if len(batch) >= batch_size:
+            total += flush(batch)
+            batch = []
+    if batch:
+        total += flush(batch)
+
+    contents = Content.objects\
+        .filter(content_type=ContentType.objects.get_for_model(Text))\
+        .values_list('pk', 'module_id', 'module__course_id', 'object_id')\
+        .order_by('pk')
+    chunk = []
+    for row in contents.iterator(chunk_size=batch_size):
+        chunk.append(row)
+        if len(chunk) >= batch_size:
+            total += _index_text_chunk(chunk, batch_size)
+            chunk = []
+    if chunk:
+        total += _index_text_chunk(chunk, batch_size)
+    return total
+
+
+def _index_text_chunk(rows, batch_size):
+    texts = Text.objects.only('title', 'content')\
+        .in_bulk({object_id for _, _, _, object_id in rows})
+    batch = [SearchDocument(content_id=pk, module_id=module_id,
+                            course_id=course_id,
+                            title=texts[object_id].title,
+                            body=texts[object_id].content)
+             for pk, module_id, course_id, object_id in rows
+             if object_id in texts]
+    SearchDocument.objects.bulk_create(batch, batch_size=batch_size)
+    return len(batch)
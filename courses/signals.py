@@ -0,0 +1,262 @@
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, \
+    post_init, m2m_changed
+from django.dispatch import receiver
+
+from django.contrib.contenttypes.models import ContentType
+
+from django.contrib.auth.models import User
+
+from . import catalog, search
+from .cache import forget_course_slugs, forget_enrollments
+from .counters import update_total_courses, update_total_modules, \
+    update_total_students
+from .images import schedule_derivatives
+from .storage import storage_is_blob
+from .models import Subject, Course, Module, Content, Text, Video, Image, \
+    File, Blob
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_state(sender, instance, **kwargs):
+    """
+    Запоминаем предмет и slug курса до сохранения, чтобы при их смене
+    пересчитать счетчики обоих предметов и сбросить кеш slug
+    """
+    instance._old_subject_id = instance._old_slug = None
+    if instance.pk:
+        old = Course.objects.filter(pk=instance.pk)\
+            .values_list('subject_id', 'slug').first()
+        if old:
+            instance._old_subject_id, instance._old_slug = old
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, created, **kwargs):
+    if created:
+        Subject.objects.filter(pk=instance.subject_id)\
+            .update(total_courses=F('total_courses') + 1)
+        # slug мог быть закеширован как неизвестный
+        forget_course_slugs(instance.slug)
+    else:
+        old_subject_id = getattr(instance, '_old_subject_id', None)
+        if old_subject_id and old_subject_id != instance.subject_id:
+            update_total_courses([old_subject_id, instance.subject_id])
+        old_slug = getattr(instance, '_old_slug', None)
+        if old_slug != instance.slug:
+            forget_course_slugs(old_slug, instance.slug)
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    Subject.objects.filter(pk=instance.subject_id, total_courses__gt=0)\
+        .update(total_courses=F('total_courses') - 1)
+    forget_course_slugs(instance.slug)
+
+
+@receiver(pre_save, sender=Module)
+def remember_module_course(sender, instance, **kwargs):
+    """
+    Запоминаем курс модуля до сохранения: при переносе модуля в другой
+    курс меняются счетчики и данные обоих курсов
+    """
+    instance._old_course_id = None
+    if instance.pk:
+        instance._old_course_id = Module.objects.filter(pk=instance.pk)\
+            .values_list('course_id', flat=True).first()
+
+
+def module_course_ids(instance):
+    """ Курс модуля и прежний курс, если модуль перенесен """
+    old_course_id = getattr(instance, '_old_course_id', None)
+    if old_course_id and old_course_id != instance.course_id:
+        return [old_course_id, instance.course_id]
+    return [instance.course_id]
+
+
+@receiver(post_save, sender=Module)
+def module_saved(sender, instance, created, **kwargs):
+    if created:
+        Course.objects.filter(pk=instance.course_id)\
+            .update(total_modules=F('total_modules') + 1)
+    else:
+        course_ids = module_course_ids(instance)
+        if len(course_ids) > 1:
+            update_total_modules(course_ids)
+
+
+@receiver(post_delete, sender=Module)
+def module_deleted(sender, instance, **kwargs):
+    Course.objects.filter(pk=instance.course_id, total_modules__gt=0)\
+        .update(total_modules=F('total_modules') - 1)
+
+
+@receiver(post_delete, sender=Course)
+def delete_module_order_counter(sender, instance, **kwargs):
+    Module._meta.get_field('order').delete_counters(
+        [{'course_id': instance.pk}])
+
+
+@receiver(post_delete, sender=Module)
+def delete_content_order_counter(sender, instance, **kwargs):
+    Content._meta.get_field('order').delete_counters(
+        [{'module_id': instance.pk}])
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def course_students_changed(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    """
+    Пересчитывает Course.total_students и сбрасывает закешированные
+    множества курсов студентов при записи и отчислении.
+    Сигнал приходит с обеих сторон связи: course.students.add(user)
+    и user.courses_joined.add(course).
+    """
+    if not reverse:
+        if action == 'pre_clear':
+            # после очистки связи студентов курса уже не узнать
+            instance._cleared_user_ids = list(
+                instance.students.values_list('pk', flat=True))
+        elif action == 'post_clear':
+            update_total_students([instance.pk])
+            forget_enrollments(getattr(instance, '_cleared_user_ids', []))
+        elif action == 'post_add':
+            update_total_students([instance.pk])
+            forget_enrollments(pk_set)
+        elif action == 'post_remove':
+            update_total_students([instance.pk])
+            forget_enrollments(pk_set)
+    elif action == 'pre_clear':
+        # после очистки связи курсы пользователя уже не узнать
+        instance._cleared_course_ids = list(
+            instance.courses_joined.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        update_total_students(getattr(instance, '_cleared_course_ids', []))
+        forget_enrollments([instance.pk])
+    elif action == 'post_add':
+        update_total_students(pk_set)
+        forget_enrollments([instance.pk])
+    elif action == 'post_remove':
+        update_total_students(pk_set)
+        forget_enrollments([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Module)
+def touch_module_course(sender, instance, **kwargs):
+    Course.objects.filter(pk__in=module_course_ids(instance)).touch()
+
+
+@receiver([post_save, post_delete], sender=Content)
+def touch_content_course(sender, instance, **kwargs):
+    Course.objects.filter(modules=instance.module_id).touch()
+
+
+@receiver([post_save, post_delete], sender=Text)
+@receiver([post_save, post_delete], sender=Video)
+@receiver([post_save, post_delete], sender=Image)
+@receiver([post_save, post_delete], sender=File)
+def touch_item_courses(sender, instance, **kwargs):
+    """
+    Изменение объекта содержимого меняет все курсы, в которые он входит
+    """
+    Course.objects.filter(
+        modules__contents__content_type=ContentType.objects.get_for_model(
+            sender),
+        modules__contents__object_id=instance.pk).touch()
+
+
+@receiver(post_init, sender=Image)
+@receiver(post_init, sender=File)
+def remember_item_file(sender, instance, **kwargs):
+    instance._saved_file_name = instance.file.name
+    instance._reserved_file_name = None
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=File)
+def item_file_saved(sender, instance, created, **kwargs):
+    """
+    Учитывает ссылки на файлы в хранилище с адресацией по содержимому.
+    Для нового или замененного изображения в очередь ставится создание
+    уменьшенных копий.
+    """
+    old_name, name = instance._saved_file_name, instance.file.name
+    storage = instance.file.storage
+    # ссылка, которую добавило хранилище при сохранении файла
+    reserved, instance._reserved_file_name = \
+        instance._reserved_file_name, None
+    changed = created or name != old_name
+    if changed:
+        if reserved != name and storage_is_blob(storage, name):
+            Blob.acquire(name)
+        if not created and storage_is_blob(storage, old_name):
+            Blob.release(old_name, storage)
+        if name and sender is Image:
+            schedule_derivatives(instance)
+    if reserved and (reserved != name or not changed):
+        # файл заменен до сохранения или уже был у объекта
+        Blob.release(reserved, storage)
+    instance._saved_file_name = name
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=File)
+def item_file_deleted(sender, instance, **kwargs):
+    storage = instance.file.storage
+    if storage_is_blob(storage, instance.file.name):
+        Blob.release(instance.file.name, storage)
+
+
+@receiver(post_save, sender=Course)
+def index_saved_course(sender, instance, **kwargs):
+    search.index_course(instance)
+
+
+@receiver(post_save, sender=Module)
+def index_saved_module(sender, instance, **kwargs):
+    search.index_module(instance)
+
+
+@receiver(post_save, sender=Content)
+def index_saved_content(sender, instance, **kwargs):
+    search.index_content(instance)
+
+
+@receiver(post_save, sender=Text)
+def index_saved_text(sender, instance, created, **kwargs):
+    # новый текст индексируется при создании его Content
+    if not created:
+        search.update_text(instance)
+
+
+@receiver(post_delete, sender=Text)
+def unindex_deleted_text(sender, instance, **kwargs):
+    # документы курсов, модулей и Content удаляются каскадно
+    search.forget_text(instance)
+
+
+@receiver([post_save, post_delete], sender=Subject)
+def refresh_catalog_subject(sender, instance, **kwargs):
+    catalog.refresh(subject_ids=[instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Course)
+def refresh_catalog_course(sender, instance, **kwargs):
+    # прежний предмет курса известен снимку каталога
+    catalog.refresh(course_ids=[instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Module)
+def refresh_catalog_module(sender, instance, **kwargs):
+    catalog.refresh(course_ids=module_course_ids(instance))
+
+
+@receiver(post_save, sender=User)
+def refresh_catalog_owner(sender, instance, update_fields=None, **kwargs):
+    """ Имя преподавателя хранится в записях его курсов """
+    if update_fields is None or \
+            {'first_name', 'last_name'} & set(update_fields):
+        course_ids = list(Course.objects.filter(owner=instance)
+                          .values_list('pk', flat=True))
+        if course_ids:
+            catalog.refresh(course_ids=course_ids)
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(content):
+    """ SHA-256 содержимого файла, читаемого блоками """
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressableStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла - хеш его содержимого:
+    blobs/ab/cd/abcd...<расширение>. Одинаковые файлы, загруженные в разные
+    курсы, хранятся один раз. Число ссылок на файл ведет модель Blob,
+    файл удаляется вместе с последним ссылающимся объектом.
+    """
+    prefix = 'blobs'
+
+    def blob_name(self, digest, name):
+        ext = os.path.splitext(name)[1].lower()
+        return posixpath.join(self.prefix, digest[:2], digest[2:4],
+                              digest + ext)
+
+    def is_blob(self, name):
+        return bool(name) and name.startswith(self.prefix + '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        from .models import Blob
+
+        name = self.blob_name(file_digest(content), name)
+        with transaction.atomic():
+            # ссылка добавляется до проверки файла: строка Blob остается
+            # заблокированной, и удаление файла без ссылок, начатое
+            # раньше, успевает завершиться, а начатое позже - не удалит его
+            Blob.acquire(name)
+            if self.exists(name):
+                # такой файл уже хранится
+                return name
+            return self._save(name, content)
+
+
+def storage_is_blob(storage, name):
+    return isinstance(storage, ContentAddressableStorage) and \
+        storage.is_blob(name)
@@ -0,0 +1,92 @@
+import os
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+from jobs.queue import task
+
+from .images import make_derivatives
+from .models import Image, Upload, Video
+
+
+@task(priority=10)
+def render_item(model_name, pk):
+    """
+    Генерирует сохраненный HTML объекта содержимого. Для видео сначала
+    получает миниатюру: при сохранении к сервису видео не обращаются.
+    """
+    item = apps.get_model('courses', model_name).objects\
+        .filter(pk=pk).first()
+    if isinstance(item, Video):
+        item.fetch_thumbnail()
+    if item is not None:
+        item.update_html()
+
+
+@task(priority=10)
+def render_items(model_name, pks):
+    """ Генерирует HTML объектов, созданных через bulk_create """
+    for item in apps.get_model('courses', model_name).objects\
+            .filter(pk__in=pks).iterator():
+        if isinstance(item, Video):
+            item.fetch_thumbnail()
+        item.update_html()
+
+
+@task(priority=5)
+def rebuild_catalog():
+    """ Перестраивает снимок каталога, восстановленный из файла """
+    from .catalog import rebuild
+    return rebuild().version
+
+
+@task
+def make_image_derivatives(pk, name):
+    """
+    Создает уменьшенные копии изображения. Если файл изображения за это
+    время заменили, результат не сохраняется: для нового файла уже
+    поставлена своя задача.
+    """
+    image = Image.objects.filter(pk=pk, file=name).first()
+    if image is None:
+        return []
+    widths = make_derivatives(image.file.path)
+    if Image.objects.filter(pk=pk, file=name).exists():
+        image.derivatives = ','.join(str(width) for width in widths)
+        # вместе с updated изменится сохраненный HTML и версия курсов
+        image.save(update_fields=['derivatives', 'updated'])
+    return widths
+
+
+@task(priority=-5)
+def purge_uploads(max_age=None):
+    """
+    Удаляет загрузки частями, в которые не поступало данных дольше
+    max_age секунд (CHUNKED_UPLOAD_EXPIRE), и их временные файлы.
+    Возвращает число удаленных загрузок.
+    """
+    if max_age is None:
+        max_age = settings.CHUNKED_UPLOAD_EXPIRE
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    purged = 0
+    for upload in Upload.objects.filter(updated__lt=cutoff).iterator():
+        # загрузка могла продолжиться после выборки
+        if Upload.objects.filter(pk=upload.pk,
+                                 updated__lt=cutoff).delete()[0]:
+            purged += 1
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
+    # временные файлы без записи, например после сбоя при создании
+    directory = settings.CHUNKED_UPLOAD_DIR
+    if os.path.isdir(directory):
+        known = {str(pk) for pk in Upload.objects.values_list('pk',
+                                                              flat=True)}
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name not in known and os.path.isfile(path) and \
+                    os.path.getmtime(path) < time.time() - max_age:
+                os.remove(path)
+    return purged
@@ -1,3 +1,1247 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import zlib
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from jobs.models import Job
+
+from . import catalog, timing
+from .bulk import bulk_contents
+from .cache import enrolled_course_ids, forget_course_slugs, \
+    resolve_course_slug
+from .cloning import clone_course
+from .fields import _longest_increasing
+from .loaders import load_course_contents, load_module_contents
+from .search import rebuild_index, search
+from .tasks import make_image_derivatives, purge_uploads, \
+    rebuild_catalog, render_item
+from .video import OfflineResolver, get_resolver
+from .models import Subject, Course, Module, Content, Text, Video, File, \
+    Image, OrderCounter, Upload, Blob, SearchDocument
+
+PASSWORD = 'secret'
+
+
+class TemporarySettingsMixin(object):
+    """
+    Кеш в памяти процесса, файлы во временном каталоге, видео без
+    обращений к сервисам и быстрый хеш паролей для BasicAuthentication
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.temp_settings = override_settings(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }},
+            MEDIA_ROOT=os.path.join(cls.temp_dir, 'media'),
+            CHUNKED_UPLOAD_DIR=os.path.join(cls.temp_dir, 'uploads'),
+            CATALOG_SNAPSHOT_PATH=os.path.join(cls.temp_dir,
+                                               'catalog.json'),
+            VIDEO_RESOLVER='courses.video.OfflineResolver',
+            PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher'],
+        )
+        cls.temp_settings.enable()
+        super(TemporarySettingsMixin, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TemporarySettingsMixin, cls).tearDownClass()
+        cls.temp_settings.disable()
+        shutil.rmtree(cls.temp_dir, ignore_errors=True)
+
+    def setUp(self):
+        super(TemporarySettingsMixin, self).setUp()
+        cache.clear()
+        catalog._current = None
+
+    def basic_auth(self, user):
+        credentials = '{}:{}'.format(user.username, PASSWORD)
+        return {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(
+            credentials.encode()).decode()}
+
+
+def create_course(owner, subject, slug, modules=0):
+    course = Course.objects.create(owner=owner, subject=subject,
+                                   title=slug.title(), slug=slug,
+                                   overview='Overview')
+    for n in range(modules):
+        Module.objects.create(course=course, title='Module {}'.format(n))
+    return course
+
+
+def add_texts(module, count, fresh=True):
+    """
+    Тексты модуля одним bulk_create. В новом модуле (fresh) порядковые
+    номера 0, 1024, ... назначаются без счетчика.
+    """
+    return bulk_contents([
+        (module.pk, None, Text(owner=module.course.owner,
+                               title='Text {}'.format(n),
+                               content='Text {}'.format(n)))
+        for n in range(count)], fresh=fresh)
+
+
+def add_media(module):
+    """ Файл и видео в конце модуля """
+    owner = module.course.owner
+    item = File(owner=owner, title='Notes')
+    item.file.save('notes.txt', ContentFile(b'notes'))
+    Content.objects.create(module=module, item=item)
+    Content.objects.create(module=module, item=Video.objects.create(
+        owner=owner, title='Video',
+        url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'))
+
+
+class LoaderTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(LoaderTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(owner, subject, 'algebra', 3)
+        for module in self.course.modules.all():
+            add_texts(module, 2)
+            add_media(module)
+        for model in (Text, Video, File):
+            ContentType.objects.get_for_model(model)
+
+    def titles(self, modules):
+        return [[content.item.title for content in module.contents.all()]
+                for module in modules]
+
+    def test_one_query_per_content_type(self):
+        # модули, содержимое и по одному запросу на Text, Video и File
+        with self.assertNumQueries(5):
+            modules = load_module_contents(self.course.modules.all())
+            titles = self.titles(modules)
+        self.assertEqual(titles,
+                         [['Text 0', 'Text 1', 'Notes', 'Video']] * 3)
+
+    def test_query_count_does_not_grow(self):
+        add_texts(self.course.modules.first(), 50, fresh=False)
+        course = Course.objects.get(pk=self.course.pk)
+        with self.assertNumQueries(5):
+            load_course_contents(course)
+            titles = self.titles(course.modules.all())
+        self.assertEqual(len(titles[0]), 54)
+
+
+class StoredHTMLTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(StoredHTMLTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+
+    def render_jobs(self):
+        return Job.objects.filter(name=render_item.job_name).count()
+
+    def test_render_job_only_when_output_changes(self):
+        text = Text.objects.create(owner=self.owner, title='Text',
+                                   content='First')
+        self.assertEqual(self.render_jobs(), 1)
+        text.save()
+        Text.objects.get(pk=text.pk).save()
+        self.assertEqual(self.render_jobs(), 1)
+        text.content = 'Second'
+        text.save()
+        self.assertEqual(self.render_jobs(), 2)
+
+    def test_render_does_not_write(self):
+        text = Text.objects.create(owner=self.owner, title='Text',
+                                   content='First')
+        with self.assertNumQueries(0):
+            self.assertEqual(text.render(), '<p>First</p>')
+        self.assertEqual(Text.objects.get(pk=text.pk).html_key, '')
+
+    def test_template_change_invalidates_html(self):
+        text = Text.objects.create(owner=self.owner, title='Text',
+                                   content='First')
+        render_item('text', text.pk)
+        self.assertFalse(Text.objects.get(pk=text.pk).update_html())
+        # сохраненный HTML отдается как есть, пока ключ совпадает
+        Text.objects.filter(pk=text.pk).update(html='stored')
+        text = Text.objects.get(pk=text.pk)
+        self.assertEqual(text.render(), 'stored')
+        with mock.patch('courses.models.template_digest',
+                        return_value='new template'):
+            self.assertEqual(text.render(), '<p>First</p>')
+            self.assertTrue(text.update_html())
+            self.assertEqual(Text.objects.get(pk=text.pk).render(),
+                             '<p>First</p>')
+
+
+class CounterTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(CounterTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        self.math = Subject.objects.create(title='Math', slug='math')
+        self.art = Subject.objects.create(title='Art', slug='art')
+
+    def totals(self, obj, *fields):
+        obj.refresh_from_db()
+        return tuple(getattr(obj, field) for field in fields)
+
+    def test_subject_courses(self):
+        course = create_course(self.owner, self.math, 'algebra')
+        create_course(self.owner, self.math, 'geometry')
+        self.assertEqual(self.totals(self.math, 'total_courses'), (2,))
+        course.subject = self.art
+        course.save()
+        self.assertEqual(self.totals(self.math, 'total_courses'), (1,))
+        self.assertEqual(self.totals(self.art, 'total_courses'), (1,))
+        course.delete()
+        self.assertEqual(self.totals(self.art, 'total_courses'), (0,))
+
+    def test_course_modules_and_students(self):
+        course = create_course(self.owner, self.math, 'algebra', 3)
+        other = create_course(self.owner, self.math, 'geometry')
+        module = course.modules.first()
+        module.course = other
+        module.save()
+        course.modules.first().delete()
+        self.assertEqual(self.totals(course, 'total_modules'), (1,))
+        self.assertEqual(self.totals(other, 'total_modules'), (1,))
+
+        students = [User.objects.create_user('student{}'.format(n))
+                    for n in range(3)]
+        course.students.add(*students)
+        students[0].courses_joined.add(other)
+        course.students.remove(students[1])
+        self.assertEqual(self.totals(course, 'total_students'), (2,))
+        students[0].courses_joined.clear()
+        self.assertEqual(self.totals(course, 'total_students'), (1,))
+        self.assertEqual(self.totals(other, 'total_students'), (0,))
+
+    def test_save_keeps_counters(self):
+        course = create_course(self.owner, self.math, 'algebra')
+        stale = Course.objects.get(pk=course.pk)
+        Module.objects.create(course=course, title='Module')
+        course.students.add(User.objects.create_user('student'))
+        # объект загружен до изменений, но счетчики не затирает
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(
+            self.totals(course, 'title', 'total_modules', 'total_students'),
+            ('Renamed', 1, 1))
+
+
+class OrderCounterTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(OrderCounterTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(owner, subject, 'algebra')
+        self.field = Module._meta.get_field('order')
+
+    def test_numbers_follow_counter(self):
+        modules = [Module.objects.create(course=self.course, title=str(n))
+                   for n in range(3)]
+        self.assertEqual([module.order for module in modules],
+                         [0, 1024, 2048])
+        # набор объектов bulk_create получает один блок номеров
+        with self.assertNumQueries(1):
+            objs = self.field.assign([Module(course=self.course)
+                                      for n in range(3)])
+        self.assertEqual([module.order for module in objs],
+                         [3072, 4096, 5120])
+        module = Module.objects.create(course=self.course, title='Last')
+        self.assertEqual(module.order, 6144)
+
+    def test_counter_continues_after_existing_objects(self):
+        Module.objects.create(course=self.course, title='Old', order=5000)
+        OrderCounter.objects.all().delete()
+        module = Module.objects.create(course=self.course, title='New')
+        self.assertEqual(module.order, 5000 + 1024)
+
+    def test_numbers_beyond_32_bits(self):
+        Module.objects.create(course=self.course, title='Old',
+                              order=2 ** 40)
+        OrderCounter.objects.all().delete()
+        module = Module.objects.create(course=self.course, title='New')
+        self.assertEqual(Module.objects.get(pk=module.pk).order,
+                         2 ** 40 + 1024)
+
+    def test_counters_deleted_with_parent(self):
+        module = Module.objects.create(course=self.course, title='Module')
+        add_texts(module, 1, fresh=False)
+        self.assertEqual(OrderCounter.objects.count(), 2)
+        self.course.delete()
+        self.assertFalse(OrderCounter.objects.exists())
+
+
+class OrderFieldTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(OrderFieldTest, self).setUp()
+        self.owner = User.objects.create_user('owner', password=PASSWORD)
+        self.subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(self.owner, self.subject, 'algebra', 1)
+        self.module = self.course.modules.get()
+        self.contents = add_texts(self.module, 5)
+        self.ids = [content.pk for content in self.contents]
+        self.field = Content._meta.get_field('order')
+
+    def reorder(self, ids):
+        return self.field.reorder(
+            Content.objects.filter(module__course__owner=self.owner),
+            {pk: n for n, pk in enumerate(ids)})
+
+    def orders(self):
+        return dict(Content.objects.values_list('pk', 'order'))
+
+    def assertOrdered(self, ids):
+        orders = self.orders()
+        self.assertEqual(sorted(ids, key=orders.get), ids)
+
+    def test_longest_increasing(self):
+        self.assertEqual(_longest_increasing([5, 1, 2, 8, 3, 4]),
+                         [1, 2, 4, 5])
+        self.assertEqual(_longest_increasing([]), [])
+        self.assertEqual(len(_longest_increasing([3, 2, 1])), 1)
+
+    def test_unchanged_order(self):
+        changed, rejected = self.reorder(self.ids)
+        self.assertEqual((changed, rejected), ([], []))
+
+    def test_move_into_gap(self):
+        # последний объект встает между первым и вторым: меняется только
+        # его номер, посередине промежутка
+        ids = [self.ids[0], self.ids[4]] + self.ids[1:4]
+        changed, rejected = self.reorder(ids)
+        self.assertEqual(changed, [self.ids[4]])
+        self.assertEqual(self.orders()[self.ids[4]], 512)
+        self.assertOrdered(ids)
+
+    def test_move_to_end_takes_counter_numbers(self):
+        ids = self.ids[1:] + [self.ids[0]]
+        changed, rejected = self.reorder(ids)
+        self.assertEqual(changed, [self.ids[0]])
+        self.assertEqual(self.orders()[self.ids[0]], 5 * 1024)
+        self.assertOrdered(ids)
+
+    def test_renumber_when_gap_is_exhausted(self):
+        for n, pk in enumerate(self.ids):
+            Content.objects.filter(pk=pk).update(order=n)
+        ids = [self.ids[0], self.ids[4]] + self.ids[1:4]
+        changed, rejected = self.reorder(ids)
+        self.assertEqual(sorted(changed), sorted(self.ids))
+        self.assertOrdered(ids)
+        orders = sorted(self.orders().values())
+        self.assertEqual([b - a for a, b in zip(orders, orders[1:])],
+                         [1024] * 4)
+
+    def test_subset_keeps_places_of_other_objects(self):
+        # переданы только второй и четвертый объекты: они меняются
+        # местами, остальные остаются где были
+        expected = [self.ids[n] for n in (0, 3, 2, 1, 4)]
+        self.reorder([self.ids[3], self.ids[1]])
+        self.assertOrdered(expected)
+        for n, pk in enumerate(self.ids):
+            Content.objects.filter(pk=pk).update(order=n)
+        changed, rejected = self.reorder([self.ids[3], self.ids[1]])
+        self.assertEqual(sorted(changed), sorted(self.ids))
+        self.assertOrdered(expected)
+
+    def test_rejected_ids(self):
+        stranger = User.objects.create_user('stranger')
+        other = create_course(stranger, self.subject, 'other', 1)
+        foreign = add_texts(other.modules.get(), 1)[0]
+        changed, rejected = self.field.reorder(
+            Content.objects.filter(module__course__owner=self.owner),
+            {str(self.ids[1]): 0, str(self.ids[0]): '1',
+             str(foreign.pk): 2, 999999: 3})
+        self.assertEqual(rejected, [foreign.pk, 999999])
+        self.assertEqual(Content.objects.get(pk=foreign.pk).order, 0)
+        self.assertOrdered([self.ids[1], self.ids[0]])
+
+    def test_malformed_positions(self):
+        queryset = Content.objects.filter(module__course__owner=self.owner)
+        for positions in ({'abc': 1}, {self.ids[0]: 'x'},
+                          {self.ids[0]: None}, [self.ids[0]], None):
+            with self.assertRaises(ValueError):
+                self.field.reorder(queryset, positions)
+
+
+class ReorderViewTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(ReorderViewTest, self).setUp()
+        self.owner = User.objects.create_user('owner', password=PASSWORD)
+        self.subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(self.owner, self.subject, 'algebra', 4)
+        self.client.force_login(self.owner)
+
+    def post(self, url_name, ids):
+        return self.client.post(
+            reverse(url_name),
+            json.dumps({pk: n for n, pk in enumerate(ids)}),
+            content_type='application/json')
+
+    def test_module_order(self):
+        ids = list(self.course.modules.values_list('pk', flat=True))
+        ids.reverse()
+        response = self.post('courses:module_order', ids)
+        self.assertEqual(response.json(), {'saved': 'OK', 'rejected': []})
+        self.assertEqual(list(self.course.modules.order_by('order')
+                              .values_list('pk', flat=True)), ids)
+
+    def test_content_order_is_one_update(self):
+        module = self.course.modules.first()
+        ids = [content.pk for content in add_texts(module, 200,
+                                                   fresh=False)]
+        random.Random(0).shuffle(ids)
+        # сессия и пользователь; в точке сохранения (SAVEPOINT и RELEASE)
+        # SELECT ... FOR UPDATE переданных объектов и их модулей, номера
+        # в конце списка от счетчика и один UPDATE; отметка изменения курса
+        with self.assertNumQueries(9):
+            response = self.post('courses:content_order', ids)
+        self.assertEqual(response.json()['rejected'], [])
+        self.assertEqual(list(module.contents.order_by('order')
+                              .values_list('pk', flat=True)), ids)
+
+    def test_malformed_request(self):
+        response = self.client.post(reverse('courses:module_order'),
+                                    json.dumps({'abc': 1}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_foreign_ids_are_rejected(self):
+        stranger = User.objects.create_user('stranger')
+        foreign = create_course(stranger, self.subject, 'other', 1)\
+            .modules.get()
+        ids = list(self.course.modules.values_list('pk', flat=True))
+        response = self.post('courses:module_order', [foreign.pk] + ids)
+        self.assertEqual(response.json()['rejected'], [foreign.pk])
+        self.assertEqual(Module.objects.get(pk=foreign.pk).order, 0)
+
+
+@override_settings(ALLOWED_HOSTS=['.example.com'])
+class CourseSlugTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(CourseSlugTest, self).setUp()
+        # кеш процесса переживает откат транзакции теста
+        forget_course_slugs('algebra', 'algebra-1', 'geometry', 'missing')
+        self.owner = User.objects.create_user('owner')
+        self.subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(self.owner, self.subject, 'algebra')
+
+    def test_cached_resolution(self):
+        self.assertEqual(resolve_course_slug('algebra'), self.course.pk)
+        self.assertIsNone(resolve_course_slug('missing'))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_course_slug('algebra'), self.course.pk)
+            self.assertIsNone(resolve_course_slug('missing'))
+
+    def test_changes_reset_cached_slugs(self):
+        self.assertIsNone(resolve_course_slug('geometry'))
+        geometry = create_course(self.owner, self.subject, 'geometry')
+        self.assertEqual(resolve_course_slug('geometry'), geometry.pk)
+        self.course.slug = 'algebra-1'
+        self.course.save()
+        self.assertIsNone(resolve_course_slug('algebra'))
+        self.assertEqual(resolve_course_slug('algebra-1'), self.course.pk)
+        geometry.delete()
+        self.assertIsNone(resolve_course_slug('geometry'))
+
+    def test_subdomain_redirect(self):
+        response = self.client.get('/', HTTP_HOST='algebra.example.com')
+        self.assertRedirects(response, reverse('courses:course_detail',
+                                               args=['algebra']),
+                             fetch_redirect_response=False)
+        response = self.client.get('/', HTTP_HOST='missing.example.com')
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogPaginationTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(CatalogPaginationTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        subjects = [Subject.objects.create(title=title, slug=title.lower())
+                    for title in ('Math', 'Art', 'Biology')]
+        for n in range(25):
+            create_course(owner, subjects[n % 3], 'course-{}'.format(n))
+        catalog.rebuild()
+
+    def cursor(self, position, reverse=0):
+        query = 'p={}&r={}'.format(quote(json.dumps(position)), reverse)
+        return quote(base64.b64encode(query.encode()).decode())
+
+    def test_pages_follow_catalog_order(self):
+        expected = list(Course.objects.order_by('-created', 'id')
+                        .values_list('pk', flat=True))
+        url = reverse('api:course-list') + '?page_size=10'
+        pages = []
+        with self.assertNumQueries(0):
+            while url:
+                data = self.client.get(url).json()
+                pages.append(data)
+                url = data['next']
+        self.assertEqual([len(page['results']) for page in pages],
+                         [10, 10, 5])
+        self.assertEqual([course['id'] for page in pages
+                          for course in page['results']], expected)
+        previous = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+
+    def test_subject_pages(self):
+        data = self.client.get(reverse('api:subject_list') +
+                               '?page_size=2').json()
+        self.assertEqual([subject['slug'] for subject in data['results']],
+                         ['art', 'biology'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([subject['slug'] for subject in data['results']],
+                         ['math'])
+        self.assertIsNone(data['next'])
+
+    def test_malformed_cursors(self):
+        url = reverse('api:course-list') + '?cursor='
+        self.assertEqual(self.client.get(url + 'bad').status_code, 404)
+        for position in (['x', 1], [1], [1, 2, 3], {'a': 1}, 5, None,
+                         [1.5, 2], [True, 1]):
+            for reverse_ in (0, 1):
+                response = self.client.get(
+                    url + self.cursor(position, reverse_))
+                self.assertEqual(response.status_code, 404, position)
+        response = self.client.get(reverse('api:subject_list') +
+                                   '?cursor=' + self.cursor([1, 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_past_the_end(self):
+        response = self.client.get(reverse('api:course-list') + '?cursor=' +
+                                   self.cursor([0, 0]))
+        data = response.json()
+        self.assertEqual(data['results'], [])
+        self.assertIsNone(data['next'])
+        self.assertEqual(
+            len(self.client.get(data['previous']).json()['results']), 20)
+
+
+class ContentsETagTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(ContentsETagTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        self.student = User.objects.create_user('student',
+                                                password=PASSWORD)
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(owner, subject, 'algebra', 2)
+        add_texts(self.course.modules.first(), 3)
+        self.course.students.add(self.student)
+        self.url = reverse('api:course-contents', args=[self.course.pk])
+
+    def get(self, **headers):
+        return self.client.get(self.url, **self.basic_auth(self.student),
+                               **headers)
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(len(response.json()['modules']), 2)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_contents(self):
+        etag = self.get()['ETag']
+        text = Text.objects.first()
+        text.content = 'Changed'
+        text.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_fields(self):
+        etag = self.get()['ETag']
+        response = self.client.get(self.url + '?fields=id,title',
+                                   HTTP_IF_NONE_MATCH=etag,
+                                   **self.basic_auth(self.student))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'id', 'title'})
+
+
+class SparseFieldsTest(TemporarySettingsMixin, TestCase):
+    """ Параметры ?fields= и ?expand= API курсов и предметов """
+
+    def setUp(self):
+        super(SparseFieldsTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        self.student = User.objects.create_user('student',
+                                                password=PASSWORD)
+        self.subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(owner, self.subject, 'algebra', 2)
+        add_texts(self.course.modules.first(), 2)
+        self.course.students.add(self.student)
+
+    def get(self, url, **params):
+        return self.client.get(url, params, **self.basic_auth(self.student))
+
+    def test_course_fields(self):
+        url = reverse('api:course-detail', args=[self.course.pk])
+        self.assertEqual(set(self.get(url).json()),
+                         {'id', 'subject', 'title', 'slug', 'overview',
+                          'created', 'owner', 'modules'})
+        data = self.get(url, fields='title, id').json()
+        self.assertEqual(data, {'id': self.course.pk, 'title': 'Algebra'})
+        data = self.get(url, fields='slug', expand='modules').json()
+        self.assertEqual(data['slug'], 'algebra')
+        self.assertEqual([module['title'] for module in data['modules']],
+                         ['Module 0', 'Module 1'])
+
+    def test_course_list_fields(self):
+        results = self.get(reverse('api:course-list'),
+                           fields='id,slug').json()['results']
+        self.assertEqual(results, [{'id': self.course.pk,
+                                    'slug': 'algebra'}])
+        results = self.get(reverse('api:course-list'),
+                           expand='modules').json()['results']
+        self.assertEqual(len(results[0]['modules']), 2)
+
+    def test_subject_fields(self):
+        data = self.get(reverse('api:subject_detail',
+                                args=[self.subject.pk]),
+                        fields='slug').json()
+        self.assertEqual(data, {'slug': 'math'})
+        results = self.get(reverse('api:subject_list'),
+                           fields='title').json()['results']
+        self.assertEqual(results, [{'title': 'Math'}])
+
+    def test_contents_expand(self):
+        url = reverse('api:course-contents', args=[self.course.pk])
+        with mock.patch.object(Text, 'render') as render:
+            data = self.get(url, fields='id', expand='modules').json()
+        render.assert_not_called()
+        self.assertEqual(set(data['modules'][0]),
+                         {'order', 'title', 'description'})
+        data = self.get(url, fields='id', expand='contents').json()
+        self.assertEqual([content['item'] for content
+                          in data['modules'][0]['contents']],
+                         ['<p>Text 0</p>', '<p>Text 1</p>'])
+
+    def test_unknown_fields(self):
+        url = reverse('api:course-detail', args=[self.course.pk])
+        response = self.get(url, fields='id,students', expand='contents')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'fields': ['Unknown fields: students.'],
+            'expand': ['Cannot expand: contents.']})
+        response = self.get(reverse('api:subject_list'), expand='courses')
+        self.assertEqual(response.status_code, 400)
+
+
+class EnrollmentIndexTest(TemporarySettingsMixin, TransactionTestCase):
+    """ Множества курсов сбрасываются после фиксации транзакции """
+
+    def setUp(self):
+        super(EnrollmentIndexTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.algebra = create_course(owner, subject, 'algebra')
+        self.geometry = create_course(owner, subject, 'geometry')
+        self.student = User.objects.create_user('student',
+                                                password=PASSWORD)
+
+    def test_cached_until_enrollments_change(self):
+        self.assertEqual(enrolled_course_ids(self.student), frozenset())
+        self.algebra.students.add(self.student)
+        self.assertEqual(enrolled_course_ids(self.student),
+                         {self.algebra.pk})
+        with self.assertNumQueries(0):
+            enrolled_course_ids(self.student)
+        self.student.courses_joined.add(self.geometry)
+        self.algebra.students.remove(self.student)
+        self.assertEqual(enrolled_course_ids(self.student),
+                         {self.geometry.pk})
+        self.geometry.students.clear()
+        self.assertEqual(enrolled_course_ids(self.student), frozenset())
+
+    def test_api_checks_enrollment(self):
+        url = reverse('api:course-contents', args=[self.algebra.pk])
+        auth = self.basic_auth(self.student)
+        self.assertEqual(self.client.get(url, **auth).status_code, 403)
+        self.algebra.students.add(self.student)
+        self.assertEqual(self.client.get(url, **auth).status_code, 200)
+
+
+class ContentMediaTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(ContentMediaTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(self.owner, subject, 'algebra', 1)
+        self.data = bytes(range(256)) * 4
+        self.item = File(owner=self.owner, title='Data')
+        self.item.file.save('Data File.bin', ContentFile(self.data))
+        Content.objects.create(module=self.course.modules.get(),
+                               item=self.item)
+        self.url = reverse('courses:content_media',
+                           args=['file', self.item.pk])
+        self.student = User.objects.create_user('student')
+
+    def get(self, user, **headers):
+        self.client.force_login(user)
+        return self.client.get(self.url, **headers)
+
+    def test_only_owner_and_students(self):
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(self.get(stranger).status_code, 404)
+        self.course.students.add(self.student)
+        response = self.get(self.student)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertIn('filename="Data File.bin"',
+                      response['Content-Disposition'])
+        self.assertEqual(self.get(self.owner).status_code, 200)
+
+    def test_range(self):
+        response = self.get(self.owner, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.data[10:20])
+        response = self.get(self.owner, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.data[-4:])
+        response = self.get(self.owner, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+        # файл изменился после первого запроса: отдается целиком
+        response = self.get(self.owner, HTTP_RANGE='bytes=10-19',
+                            HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified(self):
+        last_modified = self.get(self.owner)['Last-Modified']
+        response = self.get(self.owner,
+                            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_URL='/protected/')
+    def test_accel_redirect(self):
+        response = self.get(self.owner)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected/' + self.item.file.name)
+        self.assertEqual(response.content, b'')
+
+
+def image_file(width, height):
+    from PIL import Image as PILImage
+
+    data = io.BytesIO()
+    PILImage.new('RGB', (width, height), 'red').save(data, 'PNG')
+    return ContentFile(data.getvalue())
+
+
+class ImageDerivativeTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(ImageDerivativeTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        self.image = Image(owner=self.owner, title='Photo')
+        self.image.file.save('photo.png', image_file(700, 350))
+
+    def test_derivatives_in_background(self):
+        job = Job.objects.get(name=make_image_derivatives.job_name)
+        self.assertEqual(job.args, [self.image.pk, self.image.file.name])
+        self.assertEqual(make_image_derivatives(*job.args), [320, 640])
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.get_derivative_widths(), [320, 640])
+        url = reverse('courses:content_media', args=['image',
+                                                     self.image.pk])
+        self.assertEqual(self.image.srcset,
+                         '{0}?w=320 320w, {0}?w=640 640w'.format(url))
+
+        self.client.force_login(self.owner)
+        response = self.client.get(url + '?w=320')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        from PIL import Image as PILImage
+        data = io.BytesIO(b''.join(response.streaming_content))
+        with PILImage.open(data) as derivative:
+            self.assertEqual(derivative.size, (320, 160))
+        self.assertEqual(self.client.get(url + '?w=1280').status_code, 404)
+
+    def test_replaced_file_is_not_updated(self):
+        name = self.image.file.name
+        self.image.file.save('other.png', image_file(400, 400))
+        self.assertEqual(make_image_derivatives(self.image.pk, name), [])
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.derivatives, '')
+
+
+class ChunkedUploadTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(ChunkedUploadTest, self).setUp()
+        self.owner = User.objects.create_user('owner', password=PASSWORD)
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.module = create_course(self.owner, subject, 'algebra', 1)\
+            .modules.get()
+        self.data = bytes(range(256)) * 400
+        response = self.client.post(
+            reverse('api:upload_create'),
+            {'module': self.module.pk, 'model_name': 'file',
+             'title': 'Data', 'filename': 'Data File.bin',
+             'size': len(self.data)},
+            **self.basic_auth(self.owner))
+        self.assertEqual(response.status_code, 201)
+        self.upload_id = response.json()['id']
+
+    def put(self, start, end):
+        return self.client.generic(
+            'PUT', reverse('api:upload_detail', args=[self.upload_id]),
+            self.data[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes {}-{}/{}'.format(start, end,
+                                                       len(self.data)),
+            **self.basic_auth(self.owner))
+
+    def complete(self, checksum):
+        return self.client.post(
+            reverse('api:upload_complete', args=[self.upload_id]),
+            {'checksum': checksum}, **self.basic_auth(self.owner))
+
+    def test_resume_after_interruption(self):
+        half = len(self.data) // 2
+        self.assertEqual(self.put(0, half - 1).json()['offset'], half)
+        # клиент узнает, с какого места продолжать
+        response = self.client.get(
+            reverse('api:upload_detail', args=[self.upload_id]),
+            **self.basic_auth(self.owner))
+        self.assertEqual(response.json()['offset'], half)
+        response = self.put(half, len(self.data) - 1)
+        self.assertEqual(response.json()['offset'], len(self.data))
+        response = self.complete(zlib.crc32(self.data))
+        self.assertEqual(response.status_code, 201)
+        item = File.objects.get(pk=response.json()['item'])
+        self.assertEqual(item.filename, 'Data File.bin')
+        with item.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(Content.objects.filter(module=self.module,
+                                               object_id=item.pk).exists())
+
+    def test_wrong_offset_conflicts(self):
+        self.put(0, 999)
+        self.assertEqual(self.put(0, 999).status_code, 409)
+        self.assertEqual(self.put(2000, 2999).status_code, 409)
+        self.assertEqual(self.complete(0).status_code, 409)
+
+    def test_checksum_mismatch(self):
+        self.put(0, len(self.data) - 1)
+        response = self.complete(zlib.crc32(self.data) ^ 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+
+    def test_abandoned_uploads_are_purged(self):
+        self.put(0, 999)
+        upload = Upload.objects.get()
+        self.assertTrue(os.path.exists(upload.path))
+        self.assertEqual(purge_uploads(60), 0)
+        Upload.objects.update(updated=timezone.now() -
+                              datetime.timedelta(minutes=2))
+        self.assertEqual(purge_uploads(60), 1)
+        self.assertFalse(os.path.exists(upload.path))
+
+
+class BlobStorageTest(TemporarySettingsMixin, TransactionTestCase):
+    """ Файлы без ссылок удаляются после фиксации транзакции """
+
+    def setUp(self):
+        super(BlobStorageTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+
+    def create_file(self, data, name='notes.txt'):
+        item = File(owner=self.owner, title='Notes')
+        item.file.save(name, ContentFile(data))
+        return item
+
+    def references(self):
+        return dict(Blob.objects.values_list('name', 'references'))
+
+    def test_same_content_is_stored_once(self):
+        first = self.create_file(b'notes', 'first.txt')
+        second = self.create_file(b'notes', 'second.txt')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(self.references(), {first.file.name: 2})
+        self.assertEqual((first.filename, second.filename),
+                         ('first.txt', 'second.txt'))
+
+    def test_replace_and_delete(self):
+        first = self.create_file(b'notes')
+        second = self.create_file(b'notes')
+        old_name = first.file.name
+        first.file.save('new.txt', ContentFile(b'new notes'))
+        self.assertEqual(self.references(),
+                         {old_name: 1, first.file.name: 1})
+        second.delete()
+        self.assertEqual(self.references(), {first.file.name: 1})
+        self.assertFalse(default_storage.exists(old_name))
+        name = first.file.name
+        first.delete()
+        self.assertEqual(self.references(), {})
+        self.assertFalse(default_storage.exists(name))
+
+    def test_file_replaced_before_save(self):
+        item = File(owner=self.owner, title='Notes')
+        item.file.save('draft.txt', ContentFile(b'draft'), save=False)
+        draft = item.file.name
+        item.file.save('final.txt', ContentFile(b'final'))
+        self.assertEqual(self.references(), {item.file.name: 1})
+        self.assertFalse(default_storage.exists(draft))
+
+    def test_dedupe_legacy_files(self):
+        for name in ('files/a.txt', 'files/b.txt'):
+            path = default_storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'legacy')
+        # копия курса до переноса: два объекта с одним старым именем
+        items = [File.objects.create(owner=self.owner, title=str(n),
+                                     file=name)
+                 for n, name in enumerate(['files/a.txt', 'files/a.txt',
+                                           'files/b.txt'])]
+        out, err = io.StringIO(), io.StringIO()
+        call_command('dedupe_media', stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        self.assertIn('Moved 2 files, 6 bytes freed', out.getvalue())
+        names = {File.objects.get(pk=item.pk).file.name for item in items}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(self.references(), {name: 3})
+        self.assertTrue(default_storage.exists(name))
+        self.assertFalse(default_storage.exists('files/a.txt'))
+        self.assertFalse(default_storage.exists('files/b.txt'))
+
+
+class ThumbnailResolver(OfflineResolver):
+    """ Миниатюра без обращения к сервису; вызовы считаются """
+    calls = []
+
+    def thumbnail(self, url):
+        self.calls.append(url)
+        return 'https://img.example.com/thumb.jpg'
+
+
+class VideoResolverTest(TemporarySettingsMixin, TestCase):
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    def setUp(self):
+        super(VideoResolverTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        ThumbnailResolver.calls = []
+
+    def test_resolver_follows_setting(self):
+        self.assertIsInstance(get_resolver(), OfflineResolver)
+        with self.settings(VIDEO_RESOLVER='courses.tests.ThumbnailResolver'):
+            self.assertIsInstance(get_resolver(), ThumbnailResolver)
+        self.assertNotIsInstance(get_resolver(), ThumbnailResolver)
+
+    @override_settings(VIDEO_RESOLVER='courses.tests.ThumbnailResolver')
+    def test_thumbnail_fetched_by_render_job(self):
+        video = Video.objects.create(owner=self.owner, title='Video',
+                                     url=self.url)
+        self.assertEqual((video.provider, video.video_id),
+                         ('youtube', 'dQw4w9WgXcQ'))
+        self.assertIn('dQw4w9WgXcQ', video.embed_url)
+        self.assertEqual(video.thumbnail_url, '')
+        self.assertEqual(ThumbnailResolver.calls, [])
+        render_item('video', video.pk)
+        self.assertEqual(ThumbnailResolver.calls, [self.url])
+        self.assertEqual(Video.objects.get(pk=video.pk).thumbnail_url,
+                         'https://img.example.com/thumb.jpg')
+        # миниатюра уже получена
+        render_item('video', video.pk)
+        self.assertEqual(len(ThumbnailResolver.calls), 1)
+
+    def test_offline_resolver_has_no_thumbnail(self):
+        video = Video.objects.create(owner=self.owner, title='Video',
+                                     url=self.url)
+        render_item('video', video.pk)
+        self.assertEqual(Video.objects.get(pk=video.pk).thumbnail_url, '')
+
+
+class SearchTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        self.student = User.objects.create_user('student')
+        subject = Subject.objects.create(title='Python', slug='python')
+        self.course = create_course(self.owner, subject, 'django')
+        self.module = Module.objects.create(
+            course=self.course, title='Models',
+            description='Secret description')
+        Content.objects.create(module=self.module, item=Text.objects.create(
+            owner=self.owner, title='Lesson', content='Unicorn queries'))
+
+    def titles(self, query, user=None):
+        documents, has_more = search(query, user=user)
+        return sorted(document.title for document in documents)
+
+    def test_texts_visible_to_students_and_owner(self):
+        self.assertEqual(self.titles('unicorn'), [])
+        self.assertEqual(self.titles('unicorn', self.student), [])
+        self.assertEqual(self.titles('unicorn', self.owner), ['Lesson'])
+        self.course.students.add(self.student)
+        self.assertEqual(self.titles('unicorn', self.student), ['Lesson'])
+        # названия курсов и модулей видны всем
+        self.assertEqual(self.titles('models'), ['Models'])
+
+    def test_module_description_not_indexed(self):
+        self.course.students.add(self.student)
+        self.assertEqual(self.titles('secret', self.student), [])
+        rebuild_index()
+        self.assertEqual(self.titles('secret', self.student), [])
+        self.assertEqual(self.titles('unicorn', self.student), ['Lesson'])
+
+
+class TransferTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(TransferTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(self.owner, subject, 'algebra', 2)
+        module = self.course.modules.first()
+        add_texts(module, 2)
+        item = File(owner=self.owner, title='Notes')
+        item.file.save('notes.txt', ContentFile(b'notes'))
+        Content.objects.create(module=module, item=item)
+        Content.objects.create(module=module, item=Video.objects.create(
+            owner=self.owner, title='Video',
+            url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'))
+
+    def snapshot(self):
+        return {
+            'modules': list(Module.objects.order_by('order')
+                            .values_list('title', 'order')),
+            'contents': [(content.order, content.item.title)
+                         for content in Content.objects.order_by(
+                             'module__order', 'order')],
+            'texts': list(Text.objects.order_by('title')
+                          .values_list('title', 'content')),
+            'videos': list(Video.objects.values_list('url', 'embed_url')),
+            'files': [(item.filename, item.file.read())
+                      for item in File.objects.all()],
+        }
+
+    def test_round_trip(self):
+        path = os.path.join(self.temp_dir, 'courses.tar.gz')
+        call_command('export_courses', output=path, stdout=io.StringIO(),
+                     stderr=io.StringIO())
+        before = self.snapshot()
+        Course.objects.all().delete()
+        for model in (Text, Video, File):
+            model.objects.all().delete()
+        out = io.StringIO()
+        call_command('import_courses', path, stdout=out)
+        self.assertIn('Imported 1 courses', out.getvalue())
+        self.assertEqual(self.snapshot(), before)
+        course = Course.objects.get(slug='algebra')
+        self.assertEqual(course.total_modules, 2)
+        self.assertEqual(course.owner, self.owner)
+
+    def test_existing_courses_are_skipped(self):
+        path = os.path.join(self.temp_dir, 'courses.jsonl')
+        call_command('export_courses', output=path, stdout=io.StringIO(),
+                     stderr=io.StringIO())
+        out = io.StringIO()
+        call_command('import_courses', path, stdout=out)
+        self.assertIn('skipped 1 existing', out.getvalue())
+        self.assertEqual(Course.objects.count(), 1)
+
+    def test_identical_archive_files_are_released(self):
+        path = os.path.join(self.temp_dir, 'courses.tar')
+        call_command('export_courses', output=path, stdout=io.StringIO(),
+                     stderr=io.StringIO())
+        name = File.objects.get().file.name
+        # второй файл архива с тем же содержимым, на него ничто не ссылается
+        with tarfile.open(path, 'a') as tar:
+            info = tarfile.TarInfo('media/copy.txt')
+            info.size = len(b'notes')
+            tar.addfile(info, io.BytesIO(b'notes'))
+        Course.objects.all().delete()
+        File.objects.all().delete()
+        self.assertEqual(Blob.objects.get(name=name).references, 0)
+        call_command('import_courses', path, stdout=io.StringIO())
+        self.assertEqual(Blob.objects.get(name=name).references, 1)
+
+
+class CloneTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(CloneTest, self).setUp()
+        self.owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(self.owner, subject, 'algebra', 2)
+        self.module = self.course.modules.first()
+        self.module.description = 'Secret description'
+        self.module.save()
+        add_texts(self.module, 2)
+        add_media(self.module)
+
+    def contents(self, course):
+        return [(content.module.title, content.order, content.item.title)
+                for content in Content.objects.filter(module__course=course)
+                .order_by('module__order', 'order')]
+
+    def test_clone_is_independent(self):
+        clone = clone_course(self.course)
+        self.assertEqual(clone.slug, 'algebra-copy')
+        self.assertEqual(self.contents(clone), self.contents(self.course))
+        self.assertEqual(Course.objects.get(pk=clone.pk).total_modules, 2)
+        original, copy = [
+            Content.objects.filter(module__course=course)
+            .order_by('module__order', 'order').first().item
+            for course in (self.course, clone)]
+        self.assertNotEqual(original.pk, copy.pk)
+        copy.content = 'Changed'
+        copy.save()
+        Module.objects.filter(course=clone).delete()
+        original.refresh_from_db()
+        self.assertEqual(original.content, 'Text 0')
+        self.assertEqual(len(self.contents(self.course)), 4)
+        # файл копии ссылается на тот же blob
+        name = File.objects.first().file.name
+        self.assertEqual(Blob.objects.get(name=name).references, 2)
+
+    def test_slug_collisions(self):
+        slugs = [clone_course(self.course).slug for n in range(3)]
+        self.assertEqual(slugs, ['algebra-copy', 'algebra-copy-2',
+                                 'algebra-copy-3'])
+
+    def test_module_description_not_indexed(self):
+        clone = clone_course(self.course)
+        self.assertEqual(search('secret', user=self.owner), ([], False))
+        self.assertEqual(SearchDocument.objects.get(
+            module__course=clone, module__title=self.module.title,
+            content=None).body, '')
+
+
+class ServerTimingTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(ServerTimingTest, self).setUp()
+        timing.store.samples = {}
+        self.url = reverse('courses:search') + '?q=algebra'
+
+    def test_header_for_staff_only(self):
+        user = User.objects.create_user('student')
+        self.client.force_login(user)
+        self.assertNotIn('Server-Timing', self.client.get(self.url))
+        user.is_staff = True
+        user.save()
+        header = self.client.get(self.url)['Server-Timing']
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="\d+ calls", ')
+        self.assertIn('tpl;dur=', header)
+        self.assertRegex(header, r'total;dur=[\d.]+$')
+
+    @override_settings(DEBUG=True)
+    def test_header_in_debug(self):
+        self.assertIn('Server-Timing', self.client.get(self.url))
+
+    def test_stats(self):
+        for n in range(3):
+            self.client.get(self.url)
+        self.assertEqual(self.client.get(
+            reverse('courses:timing_stats')).status_code, 403)
+        self.client.force_login(User.objects.create_user(
+            'staff', is_staff=True))
+        stats = self.client.get(reverse('courses:timing_stats')).json()
+        self.assertEqual(stats['courses:search']['count'], 3)
+        self.assertEqual(set(stats['courses:search']),
+                         {'count', 'p50_ms', 'p95_ms', 'p99_ms',
+                          'db_mean_ms', 'cache_mean_ms', 'tpl_mean_ms',
+                          'item_mean_ms', 'queries_mean'})
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([timing.percentile(values, p)
+                          for p in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(timing.percentile([7], 99), 7)
+
+
+@mock.patch.object(catalog, 'LOCK_WAIT', 0.1)
+class CatalogFallbackTest(TemporarySettingsMixin, TestCase):
+    """ Без общего кеша каталог отдается из файла или базы данных """
+
+    def setUp(self):
+        super(CatalogFallbackTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        for n in range(3):
+            create_course(owner, subject, 'course-{}'.format(n))
+        catalog._cache_failed_at = None
+        self.path = os.path.join(self.temp_dir, 'catalog.json')
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def slugs(self, snapshot):
+        return sorted(course['slug'] for course in snapshot.courses)
+
+    def test_lock_held_elsewhere(self):
+        cache.add(catalog.LOCK_KEY, 'other', catalog.LOCK_TIMEOUT)
+        with self.assertLogs('courses.catalog', 'ERROR'):
+            snapshot = catalog.get_catalog()
+        self.assertEqual(self.slugs(snapshot),
+                         ['course-0', 'course-1', 'course-2'])
+        self.assertTrue(os.path.exists(self.path))
+        # до следующей проверки кеша используется тот же снимок
+        with self.assertNumQueries(0):
+            self.assertIs(catalog.get_catalog(), snapshot)
+        response = self.client.get(reverse('api:course-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_cache_error_uses_snapshot_file(self):
+        catalog.rebuild()
+        Course.objects.filter(slug='course-2').delete()
+        catalog._current = None
+        with mock.patch('courses.catalog.cache') as broken:
+            broken.get.side_effect = ConnectionError('cache is down')
+            with self.assertLogs('courses.catalog', 'ERROR'), \
+                    self.assertNumQueries(0):
+                snapshot = catalog.get_catalog()
+        self.assertEqual(self.slugs(snapshot),
+                         ['course-0', 'course-1', 'course-2'])
+
+    def test_update_does_not_wait_for_lock(self):
+        cache.add(catalog.LOCK_KEY, 'other', catalog.LOCK_TIMEOUT)
+        catalog.refresh(course_ids=[Course.objects.first().pk])
+        with self.assertLogs('courses.catalog', 'ERROR'):
+            catalog._apply()
+        self.assertEqual(Job.objects.filter(
+            name=rebuild_catalog.job_name).count(), 1)
+
+    def test_version_bump_does_not_write_file(self):
+        catalog.rebuild()
+        os.utime(self.path, (0, 0))
+        catalog.refresh(course_ids=[Course.objects.first().pk])
+        catalog._apply()
+        self.assertNotEqual(catalog.get_catalog().version,
+                            catalog._read_file()[0]['version'])
+        self.assertEqual(os.path.getmtime(self.path), 0)
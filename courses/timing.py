@@ -0,0 +1,185 @@
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Категории времени запроса в порядке вывода в Server-Timing
+CATEGORIES = ('db', 'cache', 'tpl', 'item')
+PERCENTILES = (50, 95, 99)
+# методы кеша, время которых учитывается
+CACHE_METHODS = ('get', 'set', 'add', 'delete', 'get_many', 'set_many',
+                 'delete_many', 'incr', 'decr', 'touch', 'has_key')
+WORKERS_KEY = 'timing:workers'
+
+_local = threading.local()
+
+
+def percentile(values, p):
+    """ Процентиль по методу ближайшего ранга """
+    values = sorted(values)
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class RequestTimings:
+    """ Время и число вызовов по категориям для одного запроса """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(CATEGORIES, 0.0)
+        self.counts = dict.fromkeys(CATEGORIES, 0)
+        # вложенные замеры одной категории не суммируются дважды
+        self.depth = dict.fromkeys(CATEGORIES, 0)
+
+    def add(self, category, duration):
+        self.durations[category] += duration
+        self.counts[category] += 1
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def header(self, total):
+        parts = ['{};dur={:.1f};desc="{} calls"'.format(
+            category, self.durations[category] * 1000,
+            self.counts[category])
+            for category in CATEGORIES if self.counts[category]]
+        parts.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(parts)
+
+
+def current():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timer(category):
+    """
+    Учитывает время блока в категории текущего запроса. Вне запроса,
+    например в фоновых задачах, ничего не делает.
+    """
+    timings = current()
+    if timings is None or timings.depth[category]:
+        yield
+        return
+    timings.depth[category] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.depth[category] -= 1
+        timings.add(category, time.perf_counter() - started)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """ Обертка для connection.execute_wrapper() """
+    with timer('db'):
+        return execute(sql, params, many, context)
+
+
+def _timed_method(method):
+    def wrapper(*args, **kwargs):
+        with timer('cache'):
+            return method(*args, **kwargs)
+    wrapper._timed = True
+    return wrapper
+
+
+def instrument_caches():
+    """
+    Оборачивает методы классов бэкендов кеша. Выполняется один раз;
+    вне запросов обертка только вызывает исходный метод.
+    """
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        for name in CACHE_METHODS:
+            method = getattr(backend, name, None)
+            if method is not None and not getattr(method, '_timed', False):
+                setattr(backend, name, _timed_method(method))
+
+
+class TimingStore:
+    """
+    Скользящее окно длительностей запросов по именам URL в процессе.
+    Окно периодически копируется в кеш, чтобы статистика собиралась
+    со всех процессов uWSGI.
+    """
+
+    def __init__(self, window=500, interval=60):
+        self.window = window
+        self.interval = interval
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.key = 'timing:{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def add(self, name, total, timings):
+        sample = [round(total * 1000, 3)] + \
+            [round(timings.durations[category] * 1000, 3)
+             for category in CATEGORIES] + \
+            [timings.counts['db']]
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(sample)
+            if time.monotonic() - self.last_flush < self.interval:
+                return
+            self.last_flush = time.monotonic()
+            samples = {name: list(values)
+                       for name, values in self.samples.items()}
+        self.flush(samples)
+
+    def flush(self, samples):
+        cache = caches['default']
+        cache.set(self.key, samples, self.interval * 10)
+        workers = cache.get(WORKERS_KEY) or []
+        if self.key not in workers:
+            cache.set(WORKERS_KEY, workers[-50:] + [self.key], None)
+        for name, stats in summarize(samples).items():
+            logger.info(json.dumps(dict(stats, view=name, worker=self.key)))
+
+    def collect(self):
+        """ Окна всех процессов, включая текущий """
+        with self.lock:
+            merged = {name: list(values)
+                      for name, values in self.samples.items()}
+        cache = caches['default']
+        keys = [key for key in cache.get(WORKERS_KEY) or []
+                if key != self.key]
+        for samples in cache.get_many(keys).values():
+            for name, values in samples.items():
+                merged.setdefault(name, []).extend(values)
+        return merged
+
+
+def summarize(samples):
+    """ Процентили общей длительности и средние по категориям """
+    result = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        totals = [value[0] for value in values]
+        stats = {'count': len(values)}
+        for p in PERCENTILES:
+            stats['p{}_ms'.format(p)] = percentile(totals, p)
+        for n, category in enumerate(CATEGORIES, 1):
+            stats['{}_mean_ms'.format(category)] = round(
+                sum(value[n] for value in values) / len(values), 3)
+        stats['queries_mean'] = round(
+            sum(value[-1] for value in values) / len(values), 2)
+        result[name] = stats
+    return result
+
+
+store = TimingStore(window=getattr(settings, 'TIMING_WINDOW', 500),
+                    interval=getattr(settings, 'TIMING_FLUSH_INTERVAL', 60))
@@ -0,0 +1,191 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .bulk import ITEM_MODELS, item_fields, bulk_insert, bulk_contents, \
+    after_bulk_insert
+from .loaders import load_content_items
+from .models import Subject, Course, Module, Content
+
+FORMAT_VERSION = 1
+
+
+def _item_record(item, usernames):
+    record = {'type': item._meta.model_name,
+              'owner': usernames.get(item.owner_id)}
+    for field in item_fields(type(item)):
+        value = field.value_from_object(item)
+        # для файлов переносится имя в хранилище
+        record[field.name] = value.name if field.name == 'file' else value
+    return record
+
+
+def export_records(courses, batch_size=100):
+    """
+    Генератор записей курсов для JSON Lines: одна запись - один курс
+    со своими модулями и содержимым. Курсы читаются пачками по
+    первичному ключу, для пачки выполняется постоянное число запросов.
+    """
+    courses = courses.select_related('subject', 'owner').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(courses.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+
+        modules = {}
+        for module in Module.objects.filter(course__in=batch)\
+                .order_by('course_id', 'order'):
+            modules.setdefault(module.course_id, []).append(module)
+        contents = {}
+        batch_contents = list(Content.objects
+                              .filter(module__course__in=batch)
+                              .order_by('module_id', 'order'))
+        load_content_items(batch_contents)
+        for content in batch_contents:
+            contents.setdefault(content.module_id, []).append(content)
+        usernames = dict(User.objects.filter(
+            pk__in={content.item.owner_id for content in batch_contents
+                    if content.item is not None})
+            .values_list('pk', 'username'))
+
+        for course in batch:
+            yield {
+                'version': FORMAT_VERSION,
+                'subject': {'title': course.subject.title,
+                            'slug': course.subject.slug},
+                'owner': course.owner.username,
+                'title': course.title,
+                'slug': course.slug,
+                'overview': course.overview,
+                'created': course.created.isoformat(),
+                'modules': [{
+                    'title': module.title,
+                    'description': module.description,
+                    'order': module.order,
+                    'contents': [{
+                        'order': content.order,
+                        'item': _item_record(content.item, usernames),
+                    } for content in contents.get(module.pk, [])
+                        if content.item is not None],
+                } for module in modules.get(course.pk, [])],
+            }
+
+
+def media_names(record):
+    """ Имена файлов в хранилище, на которые ссылается запись курса """
+    for module in record['modules']:
+        for content in module['contents']:
+            if content['item'].get('file'):
+                yield content['item']['file']
+
+
+class Importer:
+    """
+    Создает курсы из записей export_records пачками: bulk_create для
+    каждой модели, порядковые номера берутся из записей. Курсы, slug
+    которых уже есть в базе, пропускаются, поэтому прерванный импорт
+    можно запустить повторно.
+    """
+
+    def __init__(self, owner=None, media_map=None, batch_size=100):
+        self.owner = owner
+        self.media_map = media_map or {}
+        self.batch_size = batch_size
+        self.subjects = {}
+        self.users = {}
+        self.imported = self.skipped = 0
+
+    def run(self, records):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+
+    def get_subject_ids(self, records):
+        slugs = {record['subject']['slug'] for record in records} - \
+            set(self.subjects)
+        if slugs:
+            self.subjects.update(Subject.objects.filter(slug__in=slugs)
+                                 .values_list('slug', 'pk'))
+            created = [Subject(**record['subject']) for record in
+                       {r['subject']['slug']: r for r in records}.values()
+                       if record['subject']['slug'] not in self.subjects]
+            for subject in bulk_insert(Subject, created):
+                self.subjects[subject.slug] = subject.pk
+        return self.subjects
+
+    def get_user_id(self, username):
+        if self.owner is not None:
+            return self.owner.pk
+        if username not in self.users:
+            self.users[username] = User.objects.filter(username=username)\
+                .values_list('pk', flat=True).first()
+        if self.users[username] is None:
+            raise User.DoesNotExist('Unknown user {}'.format(username))
+        return self.users[username]
+
+    def build_item(self, record, default_owner_id):
+        model = ITEM_MODELS[record['type']]
+        item = model(owner_id=self.get_user_id(record['owner'])
+                     if record.get('owner') else default_owner_id)
+        for field in item_fields(model):
+            if field.name in record:
+                value = record[field.name]
+                if field.name == 'file':
+                    value = self.media_map.get(value, value)
+                setattr(item, field.attname, value)
+        return item
+
+    def import_batch(self, records):
+        existing = set(Course.objects.filter(
+            slug__in=[record['slug'] for record in records])
+            .values_list('slug', flat=True))
+        records = [record for record in records
+                   if record['slug'] not in existing]
+        self.skipped += len(existing)
+        if not records:
+            return
+
+        with transaction.atomic():
+            subjects = self.get_subject_ids(records)
+            courses = [Course(subject_id=subjects[record['subject']['slug']],
+                              owner_id=self.get_user_id(record['owner']),
+                              title=record['title'],
+                              slug=record['slug'],
+                              overview=record['overview'])
+                       for record in records]
+            bulk_insert(Course, courses, self.batch_size)
+            # created заполняется auto_now_add, восстанавливаем исходное
+            for course, record in zip(courses, records):
+                course.created = parse_datetime(record['created'])
+            Course.objects.bulk_update(courses, ['created'],
+                                       batch_size=self.batch_size)
+
+            modules = [Module(course=course, title=module['title'],
+                              description=module['description'],
+                              order=module.get('order'))
+                       for course, record in zip(courses, records)
+                       for module in record['modules']]
+            Module._meta.get_field('order').assign(modules, fresh=True)
+            bulk_insert(Module, modules)
+
+            module_items = []
+            position = 0
+            for course, record in zip(courses, records):
+                for module in record['modules']:
+                    module_id = modules[position].pk
+                    position += 1
+                    for content in module['contents']:
+                        module_items.append((
+                            module_id, content.get('order'),
+                            self.build_item(content['item'],
+                                            course.owner_id)))
+            contents = bulk_contents(module_items, fresh=True)
+            after_bulk_insert(courses, modules, contents)
+        self.imported += len(courses)
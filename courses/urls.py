@@ -12,6 +12,8 @@ urlpatterns = [
          name='course_create'),
     path('<pk>/edit/', views.CourseUpdateView.as_view(),
          name='course_edit'),
+    path('<pk>/clone/', views.CourseCloneView.as_view(),
+         name='course_clone'),
     path('<pk>/delete/', views.CourseDeleteView.as_view(),
          name='course_delete'),
     path('<pk>/module/', views.CourseModuleUpdateView.as_view(),
@@ -25,6 +27,9 @@ urlpatterns = [
     path('content/<int:id>/delete/',
          views.ContentDeleteView.as_view(),
          name='module_content_delete'),
+    path('content/<model_name>/<int:id>/media/',
+         views.ContentMediaView.as_view(),
+         name='content_media'),
     path('module/<int:module_id>/',
          views.ModuleContentListView.as_view(),
          name='module_content_list'),
@@ -34,6 +39,12 @@ urlpatterns = [
     path('content/order/',
          views.ContentOrderView.as_view(),
          name='content_order'),
+    path('search/',
+         views.SearchView.as_view(),
+         name='search'),
+    path('timing/',
+         views.TimingStatsView.as_view(),
+         name='timing_stats'),
     path('subject/<slug:subject>/',
          views.CourseListView.as_view(),
          name='course_list_subject'),
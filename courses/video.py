@@ -0,0 +1,83 @@
+import logging
+from collections import namedtuple
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Данные видео, которые достаточно определить один раз при сохранении
+VideoInfo = namedtuple('VideoInfo', ['provider', 'video_id', 'embed_url'])
+
+
+class EmbedVideoResolver:
+    """
+    Определяет сервис видео и адрес для встраивания с помощью бэкендов
+    django-embed-video. Адрес миниатюры некоторые бэкенды получают
+    запросом к сервису, поэтому он определяется отдельно, фоновой
+    задачей, и его получение можно отключить.
+    """
+    fetch_thumbnail = True
+
+    def get_backend(self, url):
+        from embed_video.backends import EmbedVideoException, detect_backend
+
+        try:
+            backend = detect_backend(url)
+            if backend.code:
+                return backend
+        except EmbedVideoException:
+            pass
+        return None
+
+    def resolve(self, url):
+        """
+        Возвращает VideoInfo или None, если адрес не распознан.
+        К сервису видео не обращается.
+        """
+        from embed_video.backends import EmbedVideoException
+
+        backend = self.get_backend(url)
+        if backend is None:
+            return None
+        try:
+            embed_url = str(backend.url)
+        except EmbedVideoException:
+            return None
+        provider = type(backend).__name__.replace('Backend', '').lower()
+        return VideoInfo(provider, backend.code, embed_url)
+
+    def thumbnail(self, url):
+        """ Адрес миниатюры видео или ''. Может обращаться к сервису. """
+        from embed_video.backends import EmbedVideoException
+
+        backend = self.get_backend(url) if self.fetch_thumbnail else None
+        if backend is None:
+            return ''
+        try:
+            return backend.thumbnail or ''
+        except (EmbedVideoException, NotImplementedError,
+                requests.RequestException) as e:
+            logger.warning('Cannot get thumbnail of %s: %s', url, e)
+            return ''
+
+
+class OfflineResolver(EmbedVideoResolver):
+    """ Разбирает адрес без обращений к сервисам, например в тестах """
+    fetch_thumbnail = False
+
+
+@lru_cache(maxsize=None)
+def get_resolver():
+    return import_string(getattr(settings, 'VIDEO_RESOLVER',
+                                 'courses.video.EmbedVideoResolver'))()
+
+
+@receiver(setting_changed)
+def reset_resolver(setting, **kwargs):
+    if setting == 'VIDEO_RESOLVER':
+        get_resolver.cache_clear()
@@ -1,11 +1,12 @@
-from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
+from braces.views import CsrfExemptMixin, JsonRequestResponseMixin, \
+    StaffuserRequiredMixin
 
 from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.mixins import LoginRequiredMixin, \
     PermissionRequiredMixin
-from django.core.cache import cache
-from django.db.models import Count
 from django.forms.models import modelform_factory
+from django.http import Http404
 from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse_lazy
 # TemplateResponseMixin – примесь, которая добавит формирование HTML- шаблона
@@ -15,8 +16,16 @@ from django.views.generic.base import TemplateResponseMixin, View
 from django.views.generic.list import ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 
+from . import catalog
+from .cache import enrolled_course_ids
+from .cloning import clone_course
 from .forms import ModuleFormSet
-from .models import Course, Module, Content, Subject
+from .images import derivative_name
+from .loaders import load_module_contents
+from .media import serve_media
+from .models import Course, Module, Content
+from .search import search
+from .timing import store as timing_store, summarize
 from students.forms import CourseEnrollForm
 
 class OwnerMixin(object):
@@ -57,6 +66,19 @@ class CourseCreateView(PermissionRequiredMixin,
     permission_required = 'courses.add_course'
 
 
+class CourseCloneView(PermissionRequiredMixin, LoginRequiredMixin, View):
+    """
+    Копия курса со всем содержимым, например для нового потока.
+    После копирования открывается редактирование копии.
+    """
+    permission_required = 'courses.add_course'
+
+    def post(self, request, pk):
+        course = get_object_or_404(Course, pk=pk, owner=request.user)
+        clone = clone_course(course, owner=request.user)
+        return redirect('courses:course_edit', clone.pk)
+
+
 class CourseUpdateView(PermissionRequiredMixin,
                        OwnerCourseEditMixin,
                        UpdateView):
@@ -182,6 +204,36 @@ class ContentDeleteView(View):
         return redirect('courses:module_content_list', module.id)
 
 
+class ContentMediaView(LoginRequiredMixin, View):
+    """
+    Отдает файлы объектов File и Image только владельцу и студентам,
+    записанным на курс, в который входит объект
+    """
+
+    def get(self, request, model_name, id):
+        if model_name not in ('file', 'image'):
+            raise Http404
+        model = apps.get_model(app_label='courses', model_name=model_name)
+        item = get_object_or_404(model, id=id)
+        if item.owner_id != request.user.id and not Content.objects.filter(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id=item.id,
+                module__course_id__in=enrolled_course_ids(request.user))\
+                .exists():
+            raise Http404
+        name, filename = item.file.name, item.filename
+        if model_name == 'image' and 'w' in request.GET:
+            # уменьшенная копия изображения
+            if request.GET['w'] not in map(str, item.get_derivative_widths()):
+                raise Http404
+            name = derivative_name(name, request.GET['w'])
+            filename = filename and derivative_name(filename,
+                                                    request.GET['w'])
+        return serve_media(request, item.file.storage, name,
+                           as_attachment=model_name == 'file',
+                           filename=filename)
+
+
 class ModuleContentListView(TemplateResponseMixin, View):
     """
     Получает из базы данных модуль по переданному ID и генерирует для него
@@ -193,7 +245,14 @@ class ModuleContentListView(TemplateResponseMixin, View):
         module = get_object_or_404(Module,
                                    id=module_id,
                                    course__owner=requst.user)
-        return self.render_to_response({'module': module})
+        load_module_contents([module])
+        # порядковые номера идут с промежутками, поэтому номер модуля
+        # для заголовка считаем по количеству предыдущих модулей
+        module_number = Module.objects.filter(course=module.course_id,
+                                              order__lt=module.order)\
+            .count() + 1
+        return self.render_to_response({'module': module,
+                                        'module_number': module_number})
 
 
 class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
@@ -202,11 +261,17 @@ class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
     в формате JSON
     """
     def post(self, request):
-        for id, order in self.request_json.items():
-            Module.objects.filter(id=id,
-                                  course__owner=request.user)\
-                .update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+        try:
+            changed, rejected = Module._meta.get_field('order').reorder(
+                Module.objects.filter(course__owner=request.user),
+                self.request_json)
+        except ValueError as e:
+            return self.render_bad_request_response({'error': str(e)})
+        if changed:
+            # массовое обновление не вызывает сигналов
+            Course.objects.filter(modules__in=changed).touch()
+        return self.render_json_response({'saved': 'OK',
+                                          'rejected': rejected})
 
 
 class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
@@ -215,11 +280,17 @@ class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
     в формате JSON
     """
     def post(self, request):
-        for id, order in self.request_json.items():
-            Content.objects.filter(id=id,
-                                   module__course__owner=request.user)\
-                .update(order=order)
-        return self.render_json_response({'status': 'OK'})
+        try:
+            changed, rejected = Content._meta.get_field('order').reorder(
+                Content.objects.filter(module__course__owner=request.user),
+                self.request_json)
+        except ValueError as e:
+            return self.render_bad_request_response({'error': str(e)})
+        if changed:
+            # массовое обновление не вызывает сигналов
+            Course.objects.filter(modules__contents__in=changed).touch()
+        return self.render_json_response({'status': 'OK',
+                                          'rejected': rejected})
 
 
 class CourseListView(TemplateResponseMixin, View):
@@ -230,32 +301,45 @@ class CourseListView(TemplateResponseMixin, View):
     template_name = 'courses/course/list.html'
 
     def get(self, request, subject=None):
-        # количество курсов по кажому предмету
-        subjects = cache.get('all_subjects')
-        if not subjects:
-            subjects = Subject.objects.annotate(
-                total_courses=Count('courses'))
-            cache.set('all_subjects', subjects)
-        # количество модулей в каждом курсе
-        all_courses = Course.objects.annotate(total_modules=Count('modules'))
-        courses = all_courses # FIX local variable 'courses' referenced before assignment
+        # предметы с количеством курсов и курсы с количеством модулей
+        # берутся из снимка каталога, без запросов к базе данных
+        snapshot = catalog.get_catalog()
         if subject:
-            subject = get_object_or_404(Subject, slug=subject)
-            key = 'subject_{}_courses'.format(subject.id)
-            courses = cache.get(key)
-            if not courses:
-                courses = all_courses.filter(subject=subject)
-                cache.set('key', courses)
-            else:
-                courses = cache.get('all_courses')
-                if not courses:
-                    courses = all_courses
-                    cache.set('all_courses', courses)
-        return self.render_to_response({'subjects': subjects,
+            subject = snapshot.subjects_by_slug.get(subject)
+            if subject is None:
+                raise Http404('No Subject matches the given query.')
+            courses = snapshot.subject_courses(subject['id'])
+        else:
+            courses = snapshot.courses
+        return self.render_to_response({'subjects': snapshot.subjects,
                                         'subject': subject,
                                         'courses': courses})
 
 
+class SearchView(TemplateResponseMixin, View):
+    """
+    Поиск по курсам, модулям и текстам. Страницы без подсчета общего
+    количества результатов: только ссылки на соседние страницы.
+    """
+    template_name = 'courses/course/search.html'
+    page_size = 20
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        documents, has_more = search(query,
+                                     offset=(page - 1) * self.page_size,
+                                     limit=self.page_size,
+                                     user=request.user)
+        return self.render_to_response({'query': query,
+                                        'documents': documents,
+                                        'page': page,
+                                        'has_more': has_more})
+
+
 class CourseDetailView(DeleteView):
     """
     Страница курса
@@ -273,3 +357,17 @@ class CourseDetailView(DeleteView):
         context['enroll_form'] = CourseEnrollForm(
             initial={'course': self.object})
         return context
+
+
+class TimingStatsView(StaffuserRequiredMixin, JsonRequestResponseMixin, View):
+    """
+    Процентили длительности запросов по именам URL за последние
+    запросы всех процессов (см. ServerTimingMiddleware)
+    """
+    raise_exception = True
+
+    def get(self, request):
+        stats = summarize(timing_store.collect())
+        return self.render_json_response(
+            dict(sorted(stats.items(),
+                        key=lambda item: -item[1]['p95_ms'])))
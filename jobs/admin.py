@@ -0,0 +1,12 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'priority', 'attempts', 'run_at',
+                    'finished', 'worker']
+    list_filter = ['status', 'name']
+    readonly_fields = ['started', 'finished', 'heartbeat', 'worker', 'result',
+                       'error']
@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import threading
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.queue import purge_done, requeue_stale, work
+
+
+class Command(BaseCommand):
+    """
+    Запускает обработчики фоновых задач:
+
+    python manage.py run_workers --workers 4
+    python manage.py run_workers --processes --workers 2
+
+    Потоки подходят для задач, которые ждут сеть или диск (почта),
+    процессы - для задач, нагружающих процессор (изображения).
+    SIGINT и SIGTERM завершают обработчики после текущей задачи.
+    Выполненные задачи хранятся JOBS_RETENTION секунд.
+    """
+
+    help = 'Runs background job workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', dest='workers', type=int, default=4)
+        parser.add_argument('--processes', dest='processes',
+                            action='store_true',
+                            help='Run workers in processes instead of '
+                                 'threads')
+        parser.add_argument('--poll-interval', dest='poll_interval',
+                            type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--burst', dest='burst', action='store_true',
+                            help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        stale_timeout = getattr(settings, 'JOBS_STALE_TIMEOUT', 600)
+        retention = getattr(settings, 'JOBS_RETENTION', 60 * 60 * 24 * 7)
+        requeue_stale(stale_timeout)
+        purge_done(retention)
+
+        if options['processes']:
+            context = get_context('fork')
+            stop = context.Event()
+            # дочерние процессы не должны использовать соединения родителя
+            connections.close_all()
+            workers = [context.Process(target=work, args=(
+                self.worker_name(n), stop, options['poll_interval'],
+                options['burst'])) for n in range(options['workers'])]
+        else:
+            stop = threading.Event()
+            workers = [threading.Thread(target=work, args=(
+                self.worker_name(n), stop, options['poll_interval'],
+                options['burst'])) for n in range(options['workers'])]
+
+        def shutdown(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        for worker in workers:
+            worker.start()
+        self.stdout.write('Started {} workers'.format(len(workers)))
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(stale_timeout / 10)
+            if not stop.is_set():
+                requeue_stale(stale_timeout)
+                purge_done(retention)
+        connections.close_all()
+
+    def worker_name(self, number):
+        return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), number)
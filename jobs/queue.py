@@ -0,0 +1,214 @@
+import json
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+_discovered = False
+
+
+def task(func=None, priority=0, max_attempts=3):
+    """
+    Регистрирует функцию как фоновую задачу. Аргументы функции должны
+    сериализоваться в JSON. Постановка в очередь: func.delay(*args).
+
+    @task(priority=10)
+    def render_item(model_name, pk):
+        ...
+    """
+    def register(func):
+        name = '{}.{}'.format(func.__module__, func.__name__)
+        _tasks[name] = func
+        func.job_name = name
+        func.delay = lambda *args, **kwargs: enqueue(
+            name, args, kwargs, priority=priority, max_attempts=max_attempts)
+        return func
+
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    global _discovered
+    if name not in _tasks and not _discovered:
+        # задачи объявляются в модулях tasks приложений
+        autodiscover_modules('tasks')
+        _discovered = True
+    return _tasks[name]
+
+
+def enqueue(name, args=(), kwargs=None, priority=0, max_attempts=3,
+            run_at=None):
+    """
+    Ставит задачу в очередь. Внутри транзакции задача становится видна
+    обработчикам только после ее фиксации, вместе с данными, которые
+    она обрабатывает.
+    """
+    job = Job.objects.create(name=name, args=list(args),
+                             kwargs=kwargs or {}, priority=priority,
+                             max_attempts=max_attempts,
+                             run_at=run_at or timezone.now())
+    if getattr(settings, 'JOBS_EAGER', False):
+        # без обработчиков: выполняем в текущем процессе после фиксации
+        transaction.on_commit(lambda: run_now(job.pk))
+    return job
+
+
+def run_now(pk):
+    if claim_job(pk, 'eager'):
+        execute(Job.objects.get(pk=pk))
+
+
+def claim_job(pk, worker):
+    """ Условный UPDATE: задачу получает только один обработчик """
+    now = timezone.now()
+    return Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+        status=Job.RUNNING, worker=worker, started=now, heartbeat=now,
+        attempts=F('attempts') + 1)
+
+
+def claim(worker, batch=10):
+    """
+    Выбирает готовую к выполнению задачу с наибольшим приоритетом и
+    помечает ее выполняемой. Возвращает Job или None.
+    """
+    ready = Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now())
+    connection = connections[router.db_for_write(Job)]
+    if connection.features.has_select_for_update_skip_locked:
+        # PostgreSQL: строки, заблокированные другими обработчиками,
+        # пропускаются, и обработчики не ждут друг друга
+        with transaction.atomic(using=connection.alias):
+            job = ready.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            claim_job(job.pk, worker)
+    else:
+        # SQLite: записи выполняются по очереди, поэтому достаточно
+        # условного UPDATE; при гонке берем следующую задачу
+        for pk in ready.values_list('pk', flat=True)[:batch]:
+            if claim_job(pk, worker):
+                break
+        else:
+            return None
+        job = Job(pk=pk)
+    job.refresh_from_db()
+    return job
+
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return repr(value)
+    return value
+
+
+def execute(job):
+    """
+    Выполняет полученную задачу. После ошибки задача возвращается в
+    очередь с растущей задержкой, пока не исчерпаны попытки.
+    """
+    try:
+        result = get_task(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Job %s failed', job)
+        now = timezone.now()
+        queryset = Job.objects.filter(pk=job.pk)
+        if job.attempts < job.max_attempts:
+            delay = getattr(settings, 'JOBS_RETRY_DELAY', 10) * \
+                2 ** (job.attempts - 1)
+            queryset.update(status=Job.QUEUED, worker='',
+                            run_at=now + timedelta(seconds=delay),
+                            error=traceback.format_exc())
+        else:
+            queryset.update(status=Job.FAILED, finished=now,
+                            error=traceback.format_exc())
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE,
+                                         finished=timezone.now(),
+                                         result=_jsonable(result), error='')
+    return True
+
+
+@contextmanager
+def heartbeat(job, interval=None):
+    """
+    Пока выполняется блок, отдельный поток раз в interval секунд
+    отмечает время в задаче. По этим отметкам requeue_stale отличает
+    долгие задачи от задач, обработчик которых завершился аварийно.
+    """
+    if interval is None:
+        interval = getattr(settings, 'JOBS_HEARTBEAT_INTERVAL', 30)
+    done = threading.Event()
+
+    def beat():
+        try:
+            while not done.wait(interval):
+                Job.objects.filter(pk=job.pk, status=Job.RUNNING,
+                                   worker=job.worker)\
+                    .update(heartbeat=timezone.now())
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def requeue_stale(timeout):
+    """
+    Возвращает в очередь задачи, обработчик которых не отмечался в них
+    дольше timeout секунд: он, скорее всего, завершился аварийно
+    """
+    deadline = timezone.now() - timedelta(seconds=timeout)
+    stale = Job.objects.filter(
+        Q(heartbeat__lt=deadline) |
+        Q(heartbeat__isnull=True, started__lt=deadline),
+        status=Job.RUNNING)
+    stale.filter(attempts__gte=F('max_attempts'))\
+        .update(status=Job.FAILED, finished=timezone.now(),
+                error='Worker lost')
+    return stale.update(status=Job.QUEUED, worker='')
+
+
+def purge_done(max_age):
+    """ Удаляет задачи, выполненные больше max_age секунд назад """
+    return Job.objects.filter(
+        status=Job.DONE,
+        finished__lt=timezone.now() - timedelta(seconds=max_age))\
+        .delete()[0]
+
+
+def work(worker, stop, poll_interval=1.0, burst=False):
+    """
+    Цикл обработчика: берет и выполняет задачи, пока не установлено
+    событие stop. В режиме burst завершается, когда очередь пуста.
+    """
+    try:
+        while not stop.is_set():
+            job = claim(worker)
+            if job is None:
+                if burst:
+                    break
+                stop.wait(poll_interval)
+                continue
+            with heartbeat(job):
+                execute(job)
+    finally:
+        # соединения потока или процесса обработчика
+        connections.close_all()
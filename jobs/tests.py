@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import task, enqueue, claim, execute, requeue_stale, purge_done
+
+calls = []
+
+
+@task(max_attempts=2)
+def flaky(fail):
+    calls.append(fail)
+    if fail:
+        raise ValueError('fail')
+    return {'ok': True}
+
+
+class ClaimTest(TestCase):
+
+    def test_priority_order(self):
+        low = enqueue('low', priority=0)
+        high = enqueue('high', priority=10)
+        job = claim('w1')
+        self.assertEqual(job.pk, high.pk)
+        self.assertEqual((job.status, job.worker, job.attempts),
+                         (Job.RUNNING, 'w1', 1))
+        self.assertIsNotNone(job.heartbeat)
+        self.assertEqual(claim('w2').pk, low.pk)
+        self.assertIsNone(claim('w3'))
+
+    def test_future_job_is_not_claimed(self):
+        enqueue('later', run_at=timezone.now() + timedelta(hours=1))
+        self.assertIsNone(claim('w1'))
+
+
+@override_settings(JOBS_RETRY_DELAY=10)
+class RetryTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def test_success(self):
+        flaky.delay(False)
+        self.assertTrue(execute(claim('w1')))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.result, job.error),
+                         (Job.DONE, {'ok': True}, ''))
+
+    def test_retry_then_fail(self):
+        flaky.delay(True)
+        before = timezone.now()
+        self.assertFalse(execute(claim('w1')))
+        job = Job.objects.get()
+        # повтор с задержкой: до ее истечения задачу никто не берет
+        self.assertEqual((job.status, job.worker), (Job.QUEUED, ''))
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=10))
+        self.assertIn('ValueError', job.error)
+        self.assertIsNone(claim('w1'))
+
+        Job.objects.update(run_at=timezone.now())
+        self.assertFalse(execute(claim('w1')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(calls, [True, True])
+
+
+class StaleTest(TestCase):
+
+    def run_job(self, heartbeat_age, started_age=0, attempts=1):
+        now = timezone.now()
+        return Job.objects.create(
+            name='stale', status=Job.RUNNING, worker='w1',
+            attempts=attempts, max_attempts=3,
+            started=now - timedelta(seconds=started_age),
+            heartbeat=(None if heartbeat_age is None
+                       else now - timedelta(seconds=heartbeat_age)))
+
+    def test_fresh_heartbeat_is_kept(self):
+        # долгая задача, обработчик которой жив
+        job = self.run_job(heartbeat_age=5, started_age=3600)
+        self.assertEqual(requeue_stale(60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+
+    def test_stale_heartbeat_is_requeued(self):
+        stale = self.run_job(heartbeat_age=120)
+        legacy = self.run_job(heartbeat_age=None, started_age=120)
+        self.assertEqual(requeue_stale(60), 2)
+        for job in (stale, legacy):
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.worker), (Job.QUEUED, ''))
+
+    def test_exhausted_attempts_fail(self):
+        job = self.run_job(heartbeat_age=120, attempts=3)
+        self.assertEqual(requeue_stale(60), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error),
+                         (Job.FAILED, 'Worker lost'))
+
+    def test_purge_done(self):
+        now = timezone.now()
+        old = Job.objects.create(name='old', status=Job.DONE,
+                                 finished=now - timedelta(days=8))
+        recent = Job.objects.create(name='recent', status=Job.DONE,
+                                    finished=now)
+        failed = Job.objects.create(name='failed', status=Job.FAILED,
+                                    finished=now - timedelta(days=8))
+        self.assertEqual(purge_done(7 * 24 * 3600), 1)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)),
+                         {recent.pk, failed.pk})
+        self.assertFalse(Job.objects.filter(pk=old.pk).exists())
@@ -1,3 +1,8 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ReminderCheckpoint
+
+
+@admin.register(ReminderCheckpoint)
+class ReminderCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['days', 'date_joined', 'last_id', 'sent', 'updated']
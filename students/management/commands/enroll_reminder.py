@@ -1,41 +1,133 @@
 import datetime
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.mail import send_mass_mail
+from django.core.mail import EmailMessage, get_connection
 from django.contrib.auth.models import User
-from django.db.models import Count
+
+from students.models import ReminderCheckpoint
 
 
 class Command(BaseCommand):
     """
     For use in views and other functions:
 
-    from django.core import management
-    management.call_command('enroll_reminder', days=20)
+    from students.tasks import enroll_reminder
+    enroll_reminder.delay(20)
+
+    or from the command line: manage.py enroll_reminder --days=20 --background
+
+    Users are streamed from the database and e-mails are sent in batches
+    over one connection. After every batch the id of the last processed
+    user is saved in a ReminderCheckpoint row, so an interrupted run
+    started again with the same --days, on any host, continues where
+    it stopped.
 
     """
 
     help = 'Sends an e-mail reminder to users registered more ' \
            'than N days that are not enrolled into any courses yet'
 
+    subject = 'Enroll in a course'
+    message = 'Dear {},\n\n We noticed that you didn\'t ' \
+              'enroll in any courses yet. What are you waiting for?'
+
     def add_arguments(self, parser):
-        parser.add_argument('--days', dest='days', type=int)
+        parser.add_argument('--days', dest='days', type=int,
+                            required=True,
+                            help='Remind users registered at least '
+                                 'this many days ago')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=100,
+                            help='Number of e-mails sent at once')
+        parser.add_argument('--rate', dest='rate', type=float, default=0,
+                            help='Maximum e-mails per second, 0 for '
+                                 'no limit')
+        parser.add_argument('--dry-run', dest='dry_run',
+                            action='store_true',
+                            help='Only count the reminders to send')
+        parser.add_argument('--background', dest='background',
+                            action='store_true',
+                            help='Queue the mailing for run_workers')
 
     def handle(self, *args, **options):
-        emails = []
-        subject = 'Enroll in a course'
-        date_joined = datetime.date.today() - \
-            datetime.timedelta(days=options['days'])
-        users = User.objects.annotate(course_count=Count('courses_joined'))\
-                    .filter(course_count=0, date_joined__lte=date_joined)
-        for user in users:
-            message = 'Dear {},\n\n We noticed that you didn\'t ' \
-                      'enroll in any courses yet. What are you waiting' \
-                      ' for?'.format(user.username)
-            emails.append((subject,
-                           message,
-                           settings.DEFAULT_FROM_EMAIL,
-                           [user.email]))
-        send_mass_mail(emails)
-        self.stdout.write('Sent {} reminders'.format(len(emails)))
+        days = options['days']
+        if options['background']:
+            from students.tasks import enroll_reminder
+            job = enroll_reminder.delay(days)
+            self.stdout.write('Queued job {}'.format(job.pk))
+            return
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        checkpoint = None if dry_run else \
+            ReminderCheckpoint.objects.filter(days=days).first()
+        if checkpoint:
+            self.stdout.write('Resuming after user {}'.format(
+                checkpoint.last_id))
+        else:
+            checkpoint = ReminderCheckpoint(
+                days=days,
+                date_joined=datetime.date.today() -
+                datetime.timedelta(days=days))
+
+        users = User.objects.filter(
+            courses_joined=None,
+            date_joined__lte=checkpoint.date_joined,
+            pk__gt=checkpoint.last_id)\
+            .exclude(email='')\
+            .order_by('pk')\
+            .only('pk', 'username', 'email')
+
+        connection = None if dry_run else get_connection()
+        batch = []
+        last_id = checkpoint.last_id
+        count = 0
+        try:
+            for user in users.iterator(chunk_size=batch_size):
+                batch.append(EmailMessage(self.subject,
+                                          self.message.format(user.username),
+                                          settings.DEFAULT_FROM_EMAIL,
+                                          [user.email],
+                                          connection=connection))
+                last_id = user.pk
+                if len(batch) >= batch_size:
+                    sent = self.send_batch(connection, batch, options)
+                    self.save_progress(checkpoint, last_id, sent, dry_run)
+                    count += sent
+                    batch = []
+            if batch:
+                sent = self.send_batch(connection, batch, options)
+                self.save_progress(checkpoint, last_id, sent, dry_run)
+                count += sent
+        finally:
+            if connection is not None:
+                connection.close()
+
+        if dry_run:
+            self.stdout.write('Would send {} reminders'.format(count))
+            return
+        if checkpoint.pk:
+            # the run is complete, the next one starts from scratch
+            checkpoint.delete()
+        self.stdout.write('Sent {} reminders'.format(checkpoint.sent))
+
+    def send_batch(self, connection, batch, options):
+        started = time.monotonic()
+        sent = len(batch) if options['dry_run'] else \
+            connection.send_messages(batch) or 0
+        if options['rate']:
+            # keep to the requested sending rate
+            delay = len(batch) / options['rate'] - \
+                (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        return sent
+
+    def save_progress(self, checkpoint, last_id, sent, dry_run):
+        if dry_run:
+            return
+        checkpoint.last_id = last_id
+        checkpoint.sent += sent
+        checkpoint.save()
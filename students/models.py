@@ -1,3 +1,18 @@
 from django.db import models
 
-# Create your models here.
+
+class ReminderCheckpoint(models.Model):
+    """
+    Ход рассылки enroll_reminder: id последнего обработанного
+    пользователя. Хранится в базе данных, поэтому прерванную рассылку
+    продолжает запуск на любом сервере, в том числе повтор задачи.
+    """
+    days = models.PositiveIntegerField(unique=True)
+    # граница регистрации, вычисленная при первом запуске
+    date_joined = models.DateField()
+    last_id = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f'{self.days} days: after user {self.last_id}'
@@ -0,0 +1,13 @@
+from django.core import management
+
+from jobs.queue import task
+
+
+@task(priority=-10, max_attempts=5)
+def enroll_reminder(days):
+    """
+    Рассылка выполняется обработчиком очереди. Повтор после ошибки
+    продолжает рассылку с контрольной точки ReminderCheckpoint в базе
+    данных, на каком бы сервере он ни выполнялся.
+    """
+    management.call_command('enroll_reminder', days=days)
@@ -1,3 +1,126 @@
+import datetime
+import io
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from courses.models import Subject, Course, Text
+from courses.tests import PASSWORD, TemporarySettingsMixin, add_texts, \
+    create_course
+from .models import ReminderCheckpoint
+
+
+class EnrollReminderTest(TestCase):
+
+    def setUp(self):
+        joined = timezone.now() - datetime.timedelta(days=30)
+        self.users = [User.objects.create_user(
+            'user{}'.format(n), 'user{}@example.com'.format(n),
+            date_joined=joined) for n in range(5)]
+        # записан на курс, без адреса и зарегистрирован недавно
+        owner = User.objects.create_user('owner', 'owner@example.com')
+        subject = Subject.objects.create(title='Math', slug='math')
+        Course.objects.create(owner=owner, subject=subject, title='Algebra',
+                              slug='algebra', overview='Overview')\
+            .students.add(self.users[4])
+        User.objects.create_user('nomail', date_joined=joined)
+
+    def remind(self, **options):
+        out = io.StringIO()
+        call_command('enroll_reminder', days=20, batch_size=2, stdout=out,
+                     **options)
+        return out.getvalue()
+
+    def recipients(self):
+        return [message.to[0] for message in mail.outbox]
+
+    def test_sends_in_batches(self):
+        self.assertIn('Sent 4 reminders', self.remind())
+        self.assertEqual(self.recipients(),
+                         ['user{}@example.com'.format(n) for n in range(4)])
+        self.assertFalse(ReminderCheckpoint.objects.exists())
+
+    def test_dry_run(self):
+        self.assertIn('Would send 4 reminders', self.remind(dry_run=True))
+        self.assertEqual(mail.outbox, [])
+
+    def test_resume_after_failure(self):
+        send_messages = EmailBackend.send_messages
+        calls = []
+
+        def fail_second_batch(backend, messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise OSError('connection lost')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages',
+                               fail_second_batch):
+            with self.assertRaises(OSError):
+                self.remind()
+        checkpoint = ReminderCheckpoint.objects.get(days=20)
+        self.assertEqual((checkpoint.last_id, checkpoint.sent),
+                         (self.users[1].pk, 2))
+        out = self.remind()
+        self.assertIn('Resuming after user {}'.format(self.users[1].pk),
+                      out)
+        self.assertIn('Sent 4 reminders', out)
+        self.assertEqual(self.recipients(),
+                         ['user{}@example.com'.format(n) for n in range(4)])
+
+    def test_days_are_required(self):
+        with self.assertRaises(CommandError):
+            call_command('enroll_reminder', stdout=io.StringIO())
+
+
+class StudentCourseDetailTest(TemporarySettingsMixin, TestCase):
+
+    def setUp(self):
+        super(StudentCourseDetailTest, self).setUp()
+        owner = User.objects.create_user('owner')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = create_course(owner, subject, 'algebra', 2)
+        self.module = self.course.modules.first()
+        add_texts(self.module, 2)
+        self.students = [User.objects.create_user(
+            'student{}'.format(n), password=PASSWORD) for n in range(2)]
+        self.course.students.add(*self.students)
+        self.url = reverse('students:student_course_detail',
+                           args=[self.course.pk])
+
+    def get(self, student, url=None):
+        self.client.force_login(student)
+        return self.client.get(url or self.url)
+
+    def test_modules_and_contents_are_shared(self):
+        response = self.get(self.students[0])
+        self.assertContains(response, '<p>Text 1</p>', html=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(self.students[1])
+        self.assertContains(response, '<p>Text 1</p>', html=True)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'courses_module' in query['sql']
+                          or 'courses_content' in query['sql']])
+
+    def test_changes_replace_cached_contents(self):
+        self.get(self.students[0])
+        text = Text.objects.get(title='Text 1')
+        text.content = 'Changed'
+        text.save()
+        self.assertContains(self.get(self.students[1]), '<p>Changed</p>',
+                            html=True)
 
-# Create your tests here.
+    def test_access(self):
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(self.get(stranger).status_code, 404)
+        url = reverse('students:student_course_detail_module',
+                      args=[self.course.pk, 0])
+        self.assertEqual(self.get(self.students[0], url).status_code, 404)
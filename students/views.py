@@ -1,13 +1,19 @@
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.http import Http404
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from django.utils.safestring import mark_safe
 from django.views.generic.edit import CreateView, FormView
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
 
 from .forms import CourseEnrollForm
-from courses.models import Course
+from courses.cache import enrolled_course_ids
+from courses.loaders import load_content_items
+from courses.models import Course, Content
 
 
 class StudentRegistrationView(CreateView):
@@ -56,25 +62,70 @@ class StudentCourseListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         qs = super(StudentCourseListView, self).get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(pk__in=enrolled_course_ids(self.request.user))
 
 
 class StudentCourseDetailView(DetailView):
+    """
+    Страница курса для студента.
+
+    Тяжелая часть страницы - список модулей и HTML содержимого модуля -
+    кешируется один раз для версии курса и общая для всех студентов.
+    Поверх нее для каждого запроса подставляются проверка записи на курс,
+    выбранный модуль и данные пользователя.
+    """
     model = Course
     template_name = 'students/course/detail.html'
+    cache_timeout = 60 * 15
 
     def get_queryset(self):
         qs = super(StudentCourseDetailView, self).get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(pk__in=enrolled_course_ids(self.request.user))
+
+    def get_version(self):
+        # отметка изменения курса меняется вместе с модулями и содержимым
+        return int(self.object.updated.timestamp() * 1000000)
+
+    def get_modules(self):
+        """ Список модулей курса, общий для всех студентов """
+        key = 'student_course_modules:{}:{}'.format(self.object.pk,
+                                                    self.get_version())
+        modules = cache.get(key)
+        if modules is None:
+            modules = list(self.object.modules.values('id', 'title'))
+            cache.set(key, modules, self.cache_timeout)
+        return modules
+
+    def get_module_contents(self, module):
+        """ HTML содержимого модуля, общий для всех студентов """
+        key = 'student_module_contents:{}:{}'.format(module['id'],
+                                                     self.get_version())
+        html = cache.get(key)
+        if html is None:
+            # Загружаем содержимое модуля одним запросом на каждый тип
+            contents = load_content_items(
+                Content.objects.filter(module_id=module['id']))
+            html = render_to_string('students/course/contents.html',
+                                    {'contents': contents})
+            cache.set(key, html, self.cache_timeout)
+        return mark_safe(html)
 
     def get_context_data(self, **kwargs):
         context = super(StudentCourseDetailView, self).get_context_data(**kwargs)
-        # Получаем объект курса.
-        course = self.get_object()
+        modules = self.get_modules()
+        module = None
         if 'module_id' in self.kwargs:
             # Получаем текущий модуль по параметрам запроса.
-            context['module'] = course.modules.get(id=self.kwargs['module_id'])
-        else:
+            module = next((m for m in modules
+                           if str(m['id']) == self.kwargs['module_id']),
+                          None)
+            if module is None:
+                raise Http404('No Module matches the given query.')
+        elif modules:
             # Получаем первый модуль.
-            context['module'] = course.modules.all()[0]
+            module = modules[0]
+        context['modules'] = modules
+        context['module'] = module
+        if module:
+            context['module_contents'] = self.get_module_contents(module)
         return context